@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Optional
+
+
+# an AIMD (additive increase, multiplicative decrease) controller for a rate
+# and (optionally) a concurrency limit, `Request` stages report how their
+# responses went and `RateLimit` stages read the current rate, so both adapt
+# to a server's actual limits at runtime
+class AdaptiveLimit:
+    __min_per_sec: float
+    __max_per_sec: float
+    __rate: float
+    __increase_per_sec: float
+    __decrease_factor: float
+    __min_concurrency: int
+    __max_concurrency: int
+    __concurrency: float
+    __latency_target_sec: Optional[float]
+    __cooldown_sec: float
+    __last_decrease: Optional[float]
+    __in_flight: int
+    __waiters: Deque[asyncio.Future]
+    increases: int
+    decreases: int
+
+    def __init__(
+        self,
+        min_per_sec: float,
+        max_per_sec: float,
+        initial_per_sec: Optional[float] = None,
+        increase_per_sec: float = 1.0,
+        decrease_factor: float = 0.5,
+        min_concurrency: int = 1,
+        max_concurrency: int = 0,
+        latency_target_sec: Optional[float] = None,
+        cooldown_sec: float = 1.0,
+    ):
+        if not 0.0 < min_per_sec <= max_per_sec:
+            raise ValueError("Expected 0 < `min_per_sec` <= `max_per_sec`")
+        if not 0.0 < decrease_factor < 1.0:
+            raise ValueError("`decrease_factor` must be between 0 and 1")
+        if max_concurrency < 0 or min_concurrency < 1:
+            raise ValueError("Expected `min_concurrency` >= 1, `max_concurrency` >= 0")
+        if 0 < max_concurrency < min_concurrency:
+            raise ValueError("Expected `min_concurrency` <= `max_concurrency`")
+
+        self.__min_per_sec = min_per_sec
+        self.__max_per_sec = max_per_sec
+        if initial_per_sec is None:
+            initial_per_sec = min_per_sec
+        self.__rate = min(max(initial_per_sec, min_per_sec), max_per_sec)
+        # how much the rate grows per second of healthy responses
+        self.__increase_per_sec = increase_per_sec
+        self.__decrease_factor = decrease_factor
+        # 0 leaves concurrency alone, otherwise it starts at the minimum and
+        # grows by about 1 per `concurrency` healthy responses (like TCP)
+        self.__min_concurrency = min_concurrency
+        self.__max_concurrency = max_concurrency
+        self.__concurrency = float(min_concurrency)
+        # slower responses than this count as the server being overloaded
+        self.__latency_target_sec = latency_target_sec
+        # responses to requests sent before we backed off arrive afterwards,
+        # so only back off once per `cooldown_sec`
+        self.__cooldown_sec = cooldown_sec
+        self.__last_decrease = None
+        self.__in_flight = 0
+        self.__waiters = deque()
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def rate(self) -> float:
+        return self.__rate
+
+    @property
+    def concurrency(self) -> int:
+        # 0 if concurrency isn't controlled
+        if self.__max_concurrency == 0:
+            return 0
+        return int(self.__concurrency)
+
+    def on_success(self, latency_sec: float) -> None:
+        if self.__latency_target_sec is not None:
+            if latency_sec > self.__latency_target_sec:
+                self.on_throttle()
+                return
+
+        # about `rate` responses arrive per second, so this adds up to
+        # `increase_per_sec` each second
+        self.__rate = min(
+            self.__rate + self.__increase_per_sec / self.__rate, self.__max_per_sec
+        )
+        if self.__max_concurrency > 0:
+            self.__concurrency = min(
+                self.__concurrency + 1.0 / self.__concurrency,
+                float(self.__max_concurrency),
+            )
+            self.__wake()
+        self.increases += 1
+
+    def on_throttle(self) -> None:
+        # a 429, 5xx or timeout
+        now = time.monotonic()
+        if self.__last_decrease is not None:
+            if now - self.__last_decrease < self.__cooldown_sec:
+                return
+
+        self.__last_decrease = now
+        self.__rate = max(self.__rate * self.__decrease_factor, self.__min_per_sec)
+        self.__concurrency = max(
+            self.__concurrency * self.__decrease_factor, float(self.__min_concurrency)
+        )
+        self.decreases += 1
+
+    async def acquire(self) -> None:
+        # waits for one of the `concurrency` slots, a no-op if not controlled
+        if self.__max_concurrency == 0:
+            return
+
+        while self.__in_flight >= int(self.__concurrency):
+            waiter = asyncio.get_running_loop().create_future()
+            self.__waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # pass the wake-up on, in case we were the one woken
+                if waiter.done() and not waiter.cancelled():
+                    self.__wake()
+                raise
+
+        self.__in_flight += 1
+
+    def release(self) -> None:
+        if self.__max_concurrency == 0:
+            return
+
+        self.__in_flight -= 1
+        self.__wake()
+
+    def __wake(self) -> None:
+        free = int(self.__concurrency) - self.__in_flight
+        while free > 0 and self.__waiters:
+            waiter = self.__waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
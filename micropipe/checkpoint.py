@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import json
+import pickle  # nosec - checkpoints are only read back by their writer
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from micropipe.types import MetaData, Origin
+
+if TYPE_CHECKING:
+    import sqlite3
+
+
+def origin_keys(origin: Optional[Origin]) -> Tuple[str, ...]:
+    if origin is None:
+        return ()
+    elif isinstance(origin, tuple):
+        return origin
+    return (origin,)
+
+
+def merge_origins(origins: Iterable[Optional[Origin]]) -> Optional[Origin]:
+    keys = tuple(dict.fromkeys(key for o in origins for key in origin_keys(o)))
+    if len(keys) == 0:
+        return None
+    elif len(keys) == 1:
+        return keys[0]
+    return keys
+
+
+# counts the values derived from each input that are still somewhere in (a
+# part of) the pipeline, every value is retained when it's emitted and
+# released once the next stage has handled it, an input whose count drops
+# to 0 will never produce another value
+class Lineage:
+    __counts: Dict[str, int]
+    __failed: Set[str]
+    __on_complete: Callable[[str, bool], None]
+
+    def __init__(self, on_complete: Callable[[str, bool], None]):
+        self.__counts = {}
+        self.__failed = set()
+        # called with the input's key and whether all its values succeeded
+        self.__on_complete = on_complete
+
+    def __len__(self) -> int:
+        return len(self.__counts)
+
+    def retain(self, origin: Optional[Origin]) -> None:
+        for key in origin_keys(origin):
+            self.__counts[key] = self.__counts.get(key, 0) + 1
+
+    def release(self, origin: Optional[Origin], failed: bool = False) -> None:
+        for key in origin_keys(origin):
+            if failed:
+                self.__failed.add(key)
+
+            count = self.__counts[key] - 1
+            if count > 0:
+                self.__counts[key] = count
+                continue
+
+            del self.__counts[key]
+            ok = key not in self.__failed
+            self.__failed.discard(key)
+            self.__on_complete(key, ok)
+
+
+# durably records which inputs completed and the values that passed each
+# `Checkpoint` stage in a SQLite database, writes are buffered and flushed
+# in a single transaction every `batch_size` writes or `flush_interval_sec`
+class CheckpointStore:
+    path: str
+    __key: Optional[Callable[[Any], Any]]
+    __batch_size: int
+    __flush_interval_sec: float
+    __conn: Optional[sqlite3.Connection]
+    __completed: Set[str]
+    __resume: Dict[str, str]
+    __completed_buffer: List[Tuple[str]]
+    __passed_buffer: List[Tuple[str, str]]
+    __records_buffer: List[Tuple[str, str, bytes]]
+    __last_flush: float
+
+    def __init__(
+        self,
+        path: str,
+        key: Optional[Callable[[Any], Any]] = None,
+        batch_size: int = 1000,
+        flush_interval_sec: float = 1.0,
+    ):
+        if batch_size < 1:
+            raise ValueError("`batch_size` must be >= 1")
+        self.path = path
+        # identifies an input across runs, by default its position in the
+        # input, so the input must be the same (and in the same order)
+        self.__key = key
+        self.__batch_size = batch_size
+        self.__flush_interval_sec = flush_interval_sec
+        self.__conn = None
+        self.__completed = set()
+        self.__resume = {}
+        self.__completed_buffer = []
+        self.__passed_buffer = []
+        self.__records_buffer = []
+        self.__last_flush = time.monotonic()
+
+    def key_of(self, value: Any, index: int) -> str:
+        return str(index if self.__key is None else self.__key(value))
+
+    def open(self, checkpoints: Sequence[str]) -> None:
+        # `checkpoints` are the pipeline's checkpoint ids, in flow order
+        import sqlite3
+
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS completed (key TEXT PRIMARY KEY)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS passed "
+                "(key TEXT, checkpoint TEXT, PRIMARY KEY (key, checkpoint))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY "
+                "AUTOINCREMENT, checkpoint TEXT, origin TEXT, value BLOB)"
+            )
+
+        self.__conn = conn
+        self.__completed = {key for (key,) in conn.execute("SELECT key FROM completed")}
+        self.__resume = self.__resume_points(checkpoints)
+        self.__last_flush = time.monotonic()
+
+    def __resume_points(self, checkpoints: Sequence[str]) -> Dict[str, str]:
+        # an unfinished input resumes from the last checkpoint it passed, as
+        # long as every record there that it shares with other inputs can be
+        # replayed, otherwise it (and they) start over from the beginning
+        conn = self.__conn
+        assert conn is not None  # nosec
+        order = {checkpoint: i for i, checkpoint in enumerate(checkpoints)}
+        resume: Dict[str, str] = {}
+        for key, checkpoint in conn.execute("SELECT key, checkpoint FROM passed"):
+            if key in self.__completed or checkpoint not in order:
+                continue
+            if key not in resume or order[checkpoint] > order[resume[key]]:
+                resume[key] = checkpoint
+
+        changed = True
+        while changed:
+            changed = False
+            for checkpoint, origin in conn.execute(
+                "SELECT checkpoint, origin FROM records"
+            ):
+                keys = [k for k in json.loads(origin) if k not in self.__completed]
+                if not any(resume.get(k) == checkpoint for k in keys):
+                    continue
+                if all(resume.get(k) == checkpoint for k in keys):
+                    continue
+                for k in keys:
+                    if resume.pop(k, None) is not None:
+                        changed = True
+
+        # records that won't be replayed are written again when their
+        # inputs pass the checkpoint again
+        stale = [
+            (record_id,)
+            for record_id, checkpoint, origin in conn.execute(
+                "SELECT id, checkpoint, origin FROM records"
+            )
+            if not all(resume.get(k) == checkpoint for k in json.loads(origin))
+        ]
+        with conn:
+            conn.executemany("DELETE FROM records WHERE id = ?", stale)
+
+        return resume
+
+    def is_completed(self, key: str) -> bool:
+        return key in self.__completed
+
+    def resumes_at(self, key: str) -> Optional[str]:
+        # the checkpoint an unfinished input resumes from, if any
+        return self.__resume.get(key)
+
+    def replay_counts(self, checkpoint: str) -> Dict[str, int]:
+        # how many of the records to replay at `checkpoint` each input has,
+        # only reads the origins, not the values
+        counts: Dict[str, int] = {}
+        conn = self.__conn
+        if conn is None:
+            return counts
+
+        rows = conn.execute(
+            "SELECT origin FROM records WHERE checkpoint = ?", (checkpoint,)
+        )
+        for (origin,) in rows:
+            for key in json.loads(origin):
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def replay(
+        self, checkpoint: str, page_size: int = 1000
+    ) -> Iterator[Tuple[Origin, Any, Optional[MetaData]]]:
+        # read a page at a time, so only a page of values is held in memory
+        # and no cursor stays open while the store is written to
+        last_id = 0
+        while self.__conn is not None:
+            rows = self.__conn.execute(
+                "SELECT id, origin, value FROM records WHERE checkpoint = ? "
+                "AND id > ? ORDER BY id LIMIT ?",
+                (checkpoint, last_id, page_size),
+            ).fetchall()
+
+            for last_id, origin, blob in rows:
+                keys = tuple(json.loads(origin))
+                value, meta = pickle.loads(blob)  # nosec
+                yield (keys[0] if len(keys) == 1 else keys), value, meta
+
+            if len(rows) < page_size:
+                return
+
+    def record(
+        self,
+        checkpoint: str,
+        origin: Optional[Origin],
+        value: Any,
+        meta: Optional[MetaData],
+    ) -> None:
+        blob = pickle.dumps((value, meta), protocol=pickle.HIGHEST_PROTOCOL)
+        keys = json.dumps(origin_keys(origin))
+        self.__records_buffer.append((checkpoint, keys, blob))
+        self.__maybe_flush()
+
+    def mark_passed(self, key: str, checkpoint: str) -> None:
+        self.__passed_buffer.append((key, checkpoint))
+        self.__maybe_flush()
+
+    def mark_completed(self, key: str) -> None:
+        self.__completed.add(key)
+        self.__completed_buffer.append((key,))
+        self.__maybe_flush()
+
+    def __maybe_flush(self) -> None:
+        buffered = (
+            len(self.__completed_buffer)
+            + len(self.__passed_buffer)
+            + len(self.__records_buffer)
+        )
+        if buffered >= self.__batch_size:
+            self.flush()
+        elif time.monotonic() - self.__last_flush >= self.__flush_interval_sec:
+            self.flush()
+
+    def flush(self) -> None:
+        # one transaction, and records before the marks that depend on them,
+        # so a crash never leaves an input marked without its records
+        conn = self.__conn
+        self.__last_flush = time.monotonic()
+        if conn is None:
+            return
+
+        with conn:
+            conn.executemany(
+                "INSERT INTO records (checkpoint, origin, value) VALUES (?, ?, ?)",
+                self.__records_buffer,
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO passed (key, checkpoint) VALUES (?, ?)",
+                self.__passed_buffer,
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO completed (key) VALUES (?)",
+                self.__completed_buffer,
+            )
+            # a completed input's records are never replayed
+            conn.executemany(
+                "DELETE FROM records WHERE origin = ?",
+                [(json.dumps([key]),) for (key,) in self.__completed_buffer],
+            )
+
+        self.__records_buffer = []
+        self.__passed_buffer = []
+        self.__completed_buffer = []
+
+    def close(self) -> None:
+        conn = self.__conn
+        if conn is not None:
+            self.flush()
+            conn.close()
+            self.__conn = None
+
+    def clear(self) -> None:
+        # forget everything, the next run starts from scratch
+        import sqlite3
+
+        conn = sqlite3.connect(self.path)
+        with conn:
+            for table in ("completed", "passed", "records"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")  # nosec
+        conn.close()
+        self.__completed = set()
+        self.__resume = {}
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import json
+import pickle  # nosec - only values written by this process are read back
+import time
+import zlib
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from diskcache import Cache, Deque, Disk
+from diskcache.core import UNKNOWN
+
+from micropipe.types import Compression, Serializer
+
+Codec = Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]
+
+# `Deque` keys are integers, the first one pushed is 500 trillion
+_FIRST_KEY = 500_000_000_000_000
+_MAX_KEY = 999_999_999_999_999
+
+
+def _serializer(serializer: Serializer) -> Codec:
+    if serializer is Serializer.PICKLE:
+        protocol = min(5, pickle.HIGHEST_PROTOCOL)
+        return partial(pickle.dumps, protocol=protocol), pickle.loads
+    elif serializer is Serializer.JSON:
+        encoder = json.JSONEncoder(separators=(",", ":"))
+        return lambda v: encoder.encode(v).encode("utf-8"), json.loads
+    else:  # serializer is Serializer.MSGPACK
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError(
+                "`Serializer.MSGPACK` requires msgpack, "
+                "install it with `pip install msgpack`"
+            ) from None
+        return (
+            partial(msgpack.packb, use_bin_type=True),
+            partial(msgpack.unpackb, raw=False, strict_map_key=False),
+        )
+
+
+def _compression(compression: Compression, level: int) -> Codec:
+    if compression is Compression.NONE:
+        return (lambda data: data), (lambda data: data)
+    elif compression is Compression.ZLIB:
+        return partial(zlib.compress, level=level), zlib.decompress
+    else:  # compression is Compression.LZ4
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError(
+                "`Compression.LZ4` requires lz4, install it with `pip install lz4`"
+            ) from None
+        # `compress` and `decompress` come from a C extension without stubs
+        frame: Any = lz4.frame
+        return partial(frame.compress, compression_level=level), frame.decompress
+
+
+def codec(serializer: Serializer, compression: Compression, level: int = 1) -> Codec:
+    # raises `ImportError` early if an optional dependency is missing
+    dumps, loads = _serializer(serializer)
+    if compression is Compression.NONE:
+        return dumps, loads
+
+    compress, decompress = _compression(compression, level)
+    return (lambda v: compress(dumps(v))), (lambda data: loads(decompress(data)))
+
+
+# a `diskcache.Disk` that stores values with the given serializer and
+# compression, its settings are saved in the cache, so reopening the
+# directory (eg. after pickling a `DiskDeque`) reads values back the same way
+class CodecDisk(Disk):
+    __dumps: Callable[[Any], bytes]
+    __loads: Callable[[bytes], Any]
+
+    def __init__(
+        self,
+        directory: str,
+        serializer: str = Serializer.PICKLE.value,
+        compression: str = Compression.NONE.value,
+        compress_level: int = 1,
+        **kwargs,
+    ):
+        super().__init__(directory, **kwargs)
+        self.__dumps, self.__loads = codec(
+            Serializer(serializer), Compression(compression), compress_level
+        )
+
+    def store(self, value: Any, read: bool, key: Any = UNKNOWN):
+        if not read:
+            value = self.__dumps(value)
+        return super().store(value, read, key=key)
+
+    def fetch(self, mode: int, filename: str, value: Any, read: bool) -> Any:
+        data = super().fetch(mode, filename, value, read)
+        if not read:
+            data = self.__loads(data)
+        return data
+
+
+# a `diskcache.Deque` stored with `CodecDisk`, `extend` inserts all values
+# with one statement in a single transaction, and iterating reads the rows in
+# key order with one query, rather than a transaction (or query) per value,
+# both rely on the layout of diskcache 5's `Cache` table
+class DiskDeque(Deque):
+    def __init__(
+        self,
+        directory: str,
+        serializer: Optional[Serializer] = None,
+        compression: Optional[Compression] = None,
+        compress_level: Optional[int] = None,
+        maxlen: Optional[int] = None,
+    ):
+        # unset settings are read from an existing cache (or the defaults), so
+        # an unpickled deque reopens its directory with the same codec
+        settings: Dict[str, Any] = {}
+        if serializer is not None:
+            settings["disk_serializer"] = serializer.value
+        if compression is not None:
+            settings["disk_compression"] = compression.value
+        if compress_level is not None:
+            settings["disk_compress_level"] = compress_level
+
+        self._cache = Cache(
+            directory, disk=CodecDisk, eviction_policy="none", **settings
+        )
+        self._maxlen = float("inf") if maxlen is None else maxlen
+
+    def extend(self, iterable: Iterable[Any]) -> None:
+        if self._maxlen != float("inf"):
+            # values beyond `maxlen` push others out, one at a time
+            super().extend(iterable)
+            return
+
+        cache = self._cache
+        disk = cache.disk
+        now = time.time()
+        rows = []
+        for value in iterable:
+            size, mode, filename, db_value = disk.store(value, False)
+            rows.append((size, mode, filename, db_value))
+        if len(rows) == 0:
+            return
+
+        with cache.transact(retry=True):
+            sql = cache._sql  # pylint: disable=protected-access
+            ((last,),) = sql(
+                "SELECT COALESCE(MAX(key), ?) FROM Cache WHERE raw = 1 "
+                "AND ? < key AND key < ?",
+                (_FIRST_KEY - 1, 0, _MAX_KEY),
+            ).fetchall()
+            cache._con.executemany(  # pylint: disable=protected-access
+                "INSERT INTO Cache(key, raw, store_time, expire_time, access_time,"
+                " access_count, tag, size, mode, filename, value)"
+                " VALUES (?, 1, ?, NULL, ?, 0, NULL, ?, ?, ?, ?)",
+                [(key, now, now, *row) for key, row in enumerate(rows, last + 1)],
+            )
+
+    def __iter__(self) -> Iterator[Any]:
+        cache = self._cache
+        disk = cache.disk
+        rows = cache._sql(  # pylint: disable=protected-access
+            "SELECT mode, filename, value FROM Cache WHERE raw = 1 "
+            "AND ? < key AND key < ? ORDER BY key",
+            (0, _MAX_KEY),
+        )
+        for mode, filename, db_value in rows:
+            yield disk.fetch(mode, filename, db_value, False)
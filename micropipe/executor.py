@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Generic, List, Optional, Tuple, TypeVar, Union
+
+from micropipe.types import FlowValue, MetaData
+
+I = TypeVar("I")  # input
+O = TypeVar("O")  # output
+
+# either "thread", "process" or an existing `Executor`
+ExecutorLike = Union[str, Executor]
+
+
+# these run inside the executor (and must be importable by process workers),
+# errors are returned rather than raised so they only fail their own value
+def _run_chunk(
+    func: Callable[[FlowValue[Any]], Any],
+    flow_vals: List[FlowValue[Any]],
+) -> List[Tuple[bool, Any]]:
+    results: List[Tuple[bool, Any]] = []
+    for flow_val in flow_vals:
+        try:
+            results.append((True, func(flow_val)))
+        except Exception as e:
+            results.append((False, e))
+
+    return results
+
+
+def _run_packed_chunk(
+    func: Callable[[FlowValue[Any]], Any],
+    packed: List[Tuple[Any, Optional[MetaData]]],
+) -> List[Tuple[bool, Any]]:
+    return _run_chunk(func, [FlowValue(value, meta) for value, meta in packed])
+
+
+class ChunkedExecutor(Generic[I, O]):
+    __func: Callable[[FlowValue[I]], O]
+    __executor: Optional[Executor]
+    __kind: ExecutorLike
+    __max_workers: Optional[int]
+    __chunk_size: int
+    __pending: List[Tuple[FlowValue[I], asyncio.Future]]
+    __scheduled: bool
+
+    def __init__(
+        self,
+        func: Callable[[FlowValue[I]], O],
+        executor: ExecutorLike,
+        max_workers: Optional[int] = None,
+        chunk_size: int = 64,
+    ):
+        if isinstance(executor, str) and executor not in ("thread", "process"):
+            raise ValueError("`executor` must be 'thread', 'process' or an Executor")
+        if chunk_size < 1:
+            raise ValueError("`chunk_size` must be >= 1")
+
+        self.__func = func
+        self.__kind = executor
+        self.__executor = executor if isinstance(executor, Executor) else None
+        self.__max_workers = max_workers
+        self.__chunk_size = chunk_size
+        self.__pending = []
+        self.__scheduled = False
+
+    @property
+    def __packed(self) -> bool:
+        # values sent to other processes are pickled, send plain tuples rather
+        # than `FlowValue`s to keep that cheap
+        return self.__kind == "process" or isinstance(
+            self.__executor, ProcessPoolExecutor
+        )
+
+    async def run(self, flow_val: FlowValue[I]) -> O:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.__pending.append((flow_val, future))
+
+        # values that arrive in the same loop iteration are submitted together
+        if len(self.__pending) >= self.__chunk_size:
+            self.__submit()
+        elif not self.__scheduled:
+            self.__scheduled = True
+            loop.call_soon(self.__submit)
+
+        return await future
+
+    def shutdown(self) -> None:
+        # only executors we created are ours to shut down
+        if self.__executor is not None and isinstance(self.__kind, str):
+            self.__executor.shutdown()
+            self.__executor = None
+
+    def __submit(self) -> None:
+        self.__scheduled = False
+        if len(self.__pending) == 0:
+            return
+
+        chunk, self.__pending = self.__pending, []
+        flow_vals = [flow_val for flow_val, _ in chunk]
+        futures = [future for _, future in chunk]
+
+        executor = self.__get_executor()
+        loop = asyncio.get_running_loop()
+        if self.__packed:
+            packed = [(fv.value, fv._meta) for fv in flow_vals]
+            done = loop.run_in_executor(
+                executor, _run_packed_chunk, self.__func, packed
+            )
+        else:
+            done = loop.run_in_executor(executor, _run_chunk, self.__func, flow_vals)
+
+        done.add_done_callback(lambda f: self.__resolve(f, futures))
+
+    @staticmethod
+    def __resolve(done: asyncio.Future, futures: List[asyncio.Future]) -> None:
+        if done.cancelled():
+            for future in futures:
+                future.cancel()
+            return
+
+        error = done.exception()
+        if error is not None:
+            # the whole chunk failed, eg. `func` could not be pickled
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for future, (ok, result) in zip(futures, done.result()):
+            if future.done():
+                continue
+            elif ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def __get_executor(self) -> Executor:
+        if self.__executor is None:
+            if self.__kind == "process":
+                self.__executor = ProcessPoolExecutor(self.__max_workers)
+            else:
+                self.__executor = ThreadPoolExecutor(self.__max_workers)
+
+        return self.__executor
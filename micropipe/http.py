@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+import codecs
+import json
+import re
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+)
+
+from micropipe.types import HttpMethod, StreamFormat
+
+# aiohttp and diskcache are only imported once a session or cache is created,
+# so importing micropipe stays fast for pipelines that never use them
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+    from diskcache import Cache
+    from multidict import CIMultiDictProxy
+
+
+# a lazily opened `ClientSession` (and connection pool) that can be shared by
+# several `Request` stages, `Pipeline` shares one between all of its stages
+class HttpClient:
+    __limit: int
+    __limit_per_host: int
+    __keepalive_timeout: float
+    __ttl_dns_cache: Optional[int]
+    __timeout_sec: Optional[float]
+    __session_kwargs: Any
+    __session: Optional[ClientSession]
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 15.0,
+        ttl_dns_cache: Optional[int] = 300,
+        timeout_sec: Optional[float] = 300.0,
+        **session_kwargs: Any,
+    ):
+        if limit < 0 or limit_per_host < 0:
+            raise ValueError("Connection limits must be >= 0 (0 means unlimited)")
+        self.__limit = limit
+        self.__limit_per_host = limit_per_host
+        self.__keepalive_timeout = keepalive_timeout
+        self.__ttl_dns_cache = ttl_dns_cache
+        self.__timeout_sec = timeout_sec
+        self.__session_kwargs = session_kwargs
+        self.__session = None
+
+    @property
+    def closed(self) -> bool:
+        return self.__session is None
+
+    async def open(self) -> ClientSession:
+        # safe to call from every stage, only the first call creates a session
+        if self.__session is None:
+            self.__session = self._new_session()
+
+        return self.__session
+
+    async def close(self) -> None:
+        if self.__session is not None:
+            session, self.__session = self.__session, None
+            await session.close()
+
+    async def __aenter__(self) -> ClientSession:
+        return await self.open()
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    def _new_session(self) -> ClientSession:
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.__limit,
+            limit_per_host=self.__limit_per_host,
+            keepalive_timeout=self.__keepalive_timeout,
+            ttl_dns_cache=self.__ttl_dns_cache,
+        )
+        timeout = aiohttp.ClientTimeout(total=self.__timeout_sec)
+
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            **self.__session_kwargs,
+        )
+
+
+# a response read back from `ResponseCache`, offers the parts of
+# `ClientResponse` that decode functions typically use
+class CachedResponse:
+    status: int
+    url: str
+    headers: CIMultiDictProxy[str]
+    __body: bytes
+
+    def __init__(self, entry: Dict[str, Any]):
+        self.status = entry["status"]
+        self.url = entry["url"]
+        from multidict import CIMultiDict, CIMultiDictProxy
+
+        self.headers = CIMultiDictProxy(CIMultiDict(entry["headers"]))
+        self.__body = entry["body"]
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get("Content-Type", "").split(";")[0].strip()
+
+    async def read(self) -> bytes:
+        return self.__body
+
+    async def text(self, encoding: Optional[str] = None, errors: str = "strict") -> str:
+        return self.__body.decode(encoding or "utf-8", errors)
+
+    async def json(
+        self,
+        *,
+        encoding: Optional[str] = None,
+        loads: Callable[[str], Any] = json.loads,
+        content_type: Optional[str] = None,
+    ) -> Any:
+        return loads(await self.text(encoding))
+
+    def release(self) -> None:
+        pass
+
+
+# an on-disk cache of successful responses, keyed by method and url
+class ResponseCache:
+    __cache: Cache
+    __ttl_sec: Optional[float]
+    __revalidate: bool
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        ttl_sec: Optional[float] = 3600.0,
+        size_limit: int = 2 ** 30,
+        revalidate: bool = True,
+    ):
+        # entries aren't expired by diskcache itself, a stale entry can still
+        # be revalidated (`If-None-Match` / `If-Modified-Since`) instead of
+        # being downloaded again, `size_limit` bounds the cache by evicting
+        # the least recently stored entries
+        from diskcache import Cache
+
+        self.__cache = Cache(directory, size_limit=size_limit)
+        self.__ttl_sec = ttl_sec
+        self.__revalidate = revalidate
+
+    @staticmethod
+    def __key(method: HttpMethod, url: str) -> str:
+        return f"{method.value} {url}"
+
+    def get(self, method: HttpMethod, url: str) -> Optional[Dict[str, Any]]:
+        return self.__cache.get(self.__key(method, url))
+
+    def is_fresh_entry(self, entry: Dict[str, Any]) -> bool:
+        ttl_sec = self.__ttl_sec
+        if ttl_sec is None:
+            return True
+
+        return time.time() - entry["stored_at"] < ttl_sec
+
+    def is_fresh(self, url: str, method: HttpMethod = HttpMethod.GET) -> bool:
+        # eg. for `RateLimit(exempt=...)`, fresh hits never reach the network
+        entry = self.get(method, url)
+        return entry is not None and self.is_fresh_entry(entry)
+
+    def conditional_headers(self, entry: Dict[str, Any]) -> Dict[str, str]:
+        if not self.__revalidate:
+            return {}
+
+        headers = {}
+        if "ETag" in entry["headers"]:
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if "Last-Modified" in entry["headers"]:
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+
+        return headers
+
+    def store(
+        self,
+        method: HttpMethod,
+        url: str,
+        status: int,
+        headers: Mapping[str, str],
+        body: bytes,
+    ) -> Dict[str, Any]:
+        entry = {
+            "status": status,
+            "url": url,
+            "headers": dict(headers),
+            "body": body,
+            "stored_at": time.time(),
+        }
+        self.__cache.set(self.__key(method, url), entry)
+
+        return entry
+
+    def refresh(self, method: HttpMethod, url: str, entry: Dict[str, Any]) -> None:
+        # the server confirmed (304) the entry is still valid
+        entry["stored_at"] = time.time()
+        self.__cache.set(self.__key(method, url), entry)
+
+    def clear(self) -> None:
+        self.__cache.clear()
+
+    def close(self) -> None:
+        self.__cache.close()
+
+
+# decodes records one by one from the chunks of a (streamed) body, so only
+# the records being decoded are held in memory rather than the whole body
+async def decode_records(
+    chunks: AsyncIterable[bytes], stream_format: StreamFormat
+) -> AsyncIterator[Any]:
+    if stream_format is StreamFormat.NDJSON:
+        buffer = bytearray()
+        async for chunk in chunks:
+            # only the complete lines are split off, a long line that spans
+            # many chunks is appended to rather than copied for every chunk
+            newline = chunk.rfind(b"\n")
+            if newline < 0:
+                buffer += chunk
+                continue
+            buffer += chunk[:newline]
+            for line in buffer.split(b"\n"):
+                if line.strip():
+                    yield json.loads(line)
+            buffer = bytearray(chunk[newline + 1 :])
+
+        if buffer.strip():
+            yield json.loads(buffer)
+    else:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        parser = _JsonArrayParser()
+        async for chunk in chunks:
+            for record in parser.feed(decoder.decode(chunk)):
+                yield record
+
+        for record in parser.feed(decoder.decode(b"", final=True), final=True):
+            yield record
+
+
+_NON_WHITESPACE = re.compile(r"[^ \t\n\r]")
+_DECODER = json.JSONDecoder()
+
+# `_JsonArrayParser` states, what it expects next
+_START = 0  # "["
+_FIRST = 1  # a value or "]"
+_VALUE = 2  # a value
+_SEPARATOR = 3  # "," or "]"
+_DONE = 4  # nothing
+
+
+class _JsonArrayParser:
+    __parts: List[str]
+    __pending: int
+    __needed: int
+    __state: int
+
+    def __init__(self):
+        self.__parts = []
+        self.__pending = 0
+        self.__needed = 0
+        self.__state = _START
+
+    def feed(self, text: str, final: bool = False) -> List[Any]:
+        self.__parts.append(text)
+        self.__pending += len(text)
+        # a record split across chunks is only decoded again once the text
+        # waiting has doubled, so a large record isn't re-parsed every chunk
+        if self.__pending < self.__needed and not final:
+            return []
+
+        buffer = "".join(self.__parts)
+        records = []
+        pos = 0
+        incomplete = False
+
+        while True:
+            match = _NON_WHITESPACE.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            pos = match.start()
+            char = buffer[pos]
+
+            if self.__state == _START:
+                if char != "[":
+                    raise ValueError("Expected a top-level JSON array")
+                self.__state = _FIRST
+                pos += 1
+            elif self.__state == _SEPARATOR or (self.__state == _FIRST and char == "]"):
+                if char == "]":
+                    self.__state = _DONE
+                elif char == ",":
+                    self.__state = _VALUE
+                else:
+                    raise ValueError(f"Expected ',' or ']' at {char!r}")
+                pos += 1
+            elif self.__state == _DONE:
+                raise ValueError("Unexpected data after the JSON array")
+            else:
+                try:
+                    record, end = _DECODER.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    incomplete = True
+                    break  # wait for the rest of the record
+                # a number at the end could continue in the next chunk
+                if end == len(buffer) and not final:
+                    incomplete = True
+                    break
+                records.append(record)
+                self.__state = _SEPARATOR
+                pos = end
+
+        rest = buffer[pos:]
+        self.__parts = [rest]
+        self.__pending = len(rest)
+        self.__needed = 2 * len(rest) if incomplete else 0
+        if final and self.__state != _DONE:
+            raise ValueError("Unexpected end of the JSON array")
+
+        return records
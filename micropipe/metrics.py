@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    from micropipe.pipeline import Pipeline
+
+# latency bucket upper bounds in seconds, 10 µs doubling up to ~84 sec
+LATENCY_BUCKETS: Sequence[float] = tuple(0.00001 * 2 ** i for i in range(24))
+
+
+# a fixed bucket histogram, recording a value is a single bisect, quantiles
+# are estimated by interpolating within the bucket they fall in
+class Histogram:
+    bounds: Sequence[float]
+    counts: List[int]
+    count: int
+    sum: float
+    max: float
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+
+        return self.max
+
+
+# the counters a stage updates while it flows, see `BaseStage.metrics`
+class StageMetrics:
+    received: int
+    emitted: int
+    in_flight: int
+    wait_sec: float
+    latency: Histogram
+    started: Optional[float]
+    finished: Optional[float]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.received = 0
+        self.emitted = 0
+        self.in_flight = 0
+        # time spent waiting on the upstream `task_getter`
+        self.wait_sec = 0.0
+        self.latency = Histogram()
+        self.started = None
+        self.finished = None
+
+    def start(self) -> None:
+        self.reset()
+        self.started = time.monotonic()
+
+    def finish(self) -> None:
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed_sec(self) -> float:
+        if self.started is None:
+            return 0.0
+        end = time.monotonic() if self.finished is None else self.finished
+        return end - self.started
+
+
+def to_json(snapshots: Sequence[Dict[str, Any]]) -> str:
+    return json.dumps({"time": time.time(), "stages": list(snapshots)}, indent=2)
+
+
+_COUNTERS = (
+    ("received", "Values received by the stage."),
+    ("emitted", "Values emitted by the stage."),
+    ("succeeded", "Values handled successfully."),
+    ("failed", "Values that failed (and were dropped)."),
+)
+_GAUGES = (
+    ("in_flight", "Values currently being handled."),
+    ("queue_depth", "Items (values or chunks) waiting in the output queue."),
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(snapshot: Dict[str, Any], **extra: str) -> str:
+    labels = {"stage": snapshot["stage"], "index": str(snapshot["index"]), **extra}
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def to_prometheus(snapshots: Sequence[Dict[str, Any]]) -> str:
+    # the Prometheus text exposition format
+    lines: List[str] = []
+
+    for key, help_text in _COUNTERS:
+        name = f"micropipe_stage_{key}_total"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f"{name}{_labels(s)} {s[key]}" for s in snapshots]
+
+    name = "micropipe_stage_wait_seconds_total"
+    lines += [
+        f"# HELP {name} Time spent waiting for values from upstream.",
+        f"# TYPE {name} counter",
+    ]
+    lines += [f"{name}{_labels(s)} {s['wait_sec']}" for s in snapshots]
+
+    for key, help_text in _GAUGES:
+        name = f"micropipe_stage_{key}"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{_labels(s)} {s[key]}" for s in snapshots]
+
+    name = "micropipe_stage_latency_seconds"
+    lines += [
+        f"# HELP {name} Time taken to handle a value.",
+        f"# TYPE {name} histogram",
+    ]
+    for s in snapshots:
+        latency = s["latency"]
+        cumulative = 0
+        for bound, count in zip(latency["buckets"], latency["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(s, le=repr(bound))} {cumulative}")
+        lines.append(f'{name}_bucket{_labels(s, le="+Inf")} {latency["count"]}')
+        lines.append(f"{name}_sum{_labels(s)} {latency['sum_sec']}")
+        lines.append(f"{name}_count{_labels(s)} {latency['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(pipeline: Pipeline, path: str) -> None:
+    # JSON for a `.json` path, otherwise Prometheus text (eg. a `.prom` file
+    # for node_exporter's textfile collector), replaced atomically
+    snapshots = pipeline.metrics
+    if path.endswith(".json"):
+        text = to_json(snapshots)
+    else:
+        text = to_prometheus(snapshots)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# serves a pipeline's metrics over HTTP while it runs, Prometheus text on
+# `/metrics` and JSON on `/metrics.json`
+class MetricsServer:
+    __pipeline: Pipeline
+    __host: str
+    __port: int
+    __runner: Any
+
+    def __init__(self, pipeline: Pipeline, host: str = "127.0.0.1", port: int = 9100):
+        self.__pipeline = pipeline
+        self.__host = host
+        self.__port = port
+        self.__runner = None
+
+    async def start(self) -> None:
+        from aiohttp import web
+
+        async def prometheus(_: web.Request) -> web.Response:
+            return web.Response(text=to_prometheus(self.__pipeline.metrics))
+
+        async def json_metrics(_: web.Request) -> web.Response:
+            return web.Response(
+                text=to_json(self.__pipeline.metrics), content_type="application/json"
+            )
+
+        app = web.Application()
+        app.router.add_get("/metrics", prometheus)
+        app.router.add_get("/metrics.json", json_metrics)
+
+        self.__runner = web.AppRunner(app)
+        await self.__runner.setup()
+        await web.TCPSite(self.__runner, self.__host, self.__port).start()
+
+    async def stop(self) -> None:
+        if self.__runner is not None:
+            runner, self.__runner = self.__runner, None
+            await runner.cleanup()
+
+    async def __aenter__(self) -> MetricsServer:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.stop()
@@ -2,13 +2,32 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from typing import AsyncIterable, Generic, Iterable, List, Tuple, TypeVar, Union
-
-import coloredlogs
-from tqdm.asyncio import tqdm
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
+from micropipe.checkpoint import CheckpointStore, Lineage
+from micropipe.http import HttpClient
+from micropipe.metrics import write_metrics
+from micropipe.queues import Chunker, QueueFactory
 from micropipe.stages.base import BaseStage
-from micropipe.types import EndFlow, FlowValue
+from micropipe.stages.checkpoint import Checkpoint
+from micropipe.stages.fused import Fused
+from micropipe.tracing import Tracer
+from micropipe.types import END_FLOW, EndFlow, FlowChunk, FlowValue
 
 T = TypeVar("T")  # input
 
@@ -16,68 +35,413 @@ T = TypeVar("T")  # input
 class Pipeline(Generic[T]):
     logger: logging.Logger
     stages: Tuple[BaseStage, ...]
+    flow_stages: Tuple[BaseStage, ...]
     tasks: List[asyncio.Task]
-    input_queue: asyncio.Queue[Union[FlowValue[T], EndFlow]]
+    http_client: HttpClient
+    tracer: Optional[Tracer]
+    checkpoint: Optional[CheckpointStore]
+    input_queue: asyncio.Queue[Union[FlowValue[T], FlowChunk[T], EndFlow]]
 
     def __init__(
         self,
         *stages: BaseStage,
+        max_in_flight: int = 1000,
+        max_queue_size: int = 1000,
+        chunk_size: int = 0,
+        chunk_linger_sec: float = 0.005,
+        fuse: bool = True,
+        http_client: Optional[HttpClient] = None,
+        ordered: bool = False,
+        metrics_file: Optional[str] = None,
+        metrics_interval_sec: float = 10.0,
+        tracer: Optional[Tracer] = None,
+        checkpoint: Optional[CheckpointStore] = None,
+        queue_factory: Optional[QueueFactory] = None,
+        progress: bool = True,
+        quiet: bool = False,
     ):
         if len(stages) == 0:
             raise ValueError("You must specify some stages")
+        if max_in_flight < 0:
+            raise ValueError("`max_in_flight` must be >= 0")
+        if max_queue_size < 0:
+            raise ValueError("`max_queue_size` must be >= 0")
+        if chunk_size < 0:
+            raise ValueError("`chunk_size` must be >= 0")
+
+        checkpoint_ids = [s.checkpoint_id for s in stages if isinstance(s, Checkpoint)]
+        if len(set(checkpoint_ids)) < len(checkpoint_ids):
+            raise ValueError("`Checkpoint` stages must have unique ids")
+
+        # stages that were not given explicit settings inherit the pipeline's
+        for stage in stages:
+            stage._apply_defaults(
+                max_in_flight=max_in_flight,
+                max_queue_size=max_queue_size,
+                chunk_size=chunk_size,
+                chunk_linger_sec=chunk_linger_sec,
+                ordered=ordered,
+                progress=progress and not quiet,
+                queue_factory=queue_factory,
+            )
+
+        # one HTTP client (and connection pool) is shared by all stages that
+        # don't bring their own, it's only opened if a stage uses it
+        self.http_client = HttpClient() if http_client is None else http_client
+        for stage in stages:
+            stage._attach_http_client(self.http_client)
+
         self.stages = stages
+        self.flow_stages = self.__fuse(stages) if fuse else stages
+        # opt-in, records sampled spans of the (async) flow to find bottlenecks
+        self.tracer = tracer
+        for i, stage in enumerate(self.flow_stages):
+            stage._attach_tracer(tracer, i)
+        # opt-in, durably records which inputs completed (and the values that
+        # passed `Checkpoint` stages), so a rerun picks up where this one died
+        self.checkpoint = checkpoint
+        self.__lineage: Optional[Lineage] = None
+        self.__source_lineages: List[Lineage] = []
         self.logger = logging.getLogger()
         self.tasks = []
-        self.input_queue = asyncio.Queue()
+        # while streaming, `metrics` are written to `metrics_file` (as JSON
+        # for a `.json` file, Prometheus text otherwise) every interval
+        self.__metrics_file = metrics_file
+        self.__metrics_interval_sec = metrics_interval_sec
+        self.input_queue = (queue_factory or asyncio.Queue)(max_queue_size)
+        self.__chunker = (
+            Chunker(self.input_queue, chunk_size, chunk_linger_sec)
+            if chunk_size > 1
+            else None
+        )
+
+        # quiet leaves logging (and progress bars) entirely to the caller
+        if not quiet:
+            import coloredlogs
+
+            coloredlogs.install(level=self.logger.level, logger=self.logger)
+
+    @staticmethod
+    def __fuse(stages: Tuple[BaseStage, ...]) -> Tuple[BaseStage, ...]:
+        # replace runs of adjacent fusible stages with a single `Fused` stage
+        fused: List[BaseStage] = []
+        run: List[BaseStage] = []
+
+        for stage in (*stages, None):
+            if stage is not None and stage._fusible:
+                run.append(stage)
+                continue
+
+            if len(run) > 1:
+                # the first stage pulls values in, the last one's queue sends
+                # them on, so the fused stage takes its settings from those
+                first, last = run[0], run[-1]
+                fused.append(
+                    Fused(
+                        run,
+                        max_in_flight=first._max_in_flight,
+                        max_queue_size=last._max_queue_size,
+                        chunk_size=last._chunk_size,
+                        chunk_linger_sec=last._chunk_linger_sec,
+                        ordered=any(stage._ordered for stage in run),
+                        reorder_window=first._reorder_window,
+                        progress=first._progress,
+                        queue_factory=last._queue_factory,
+                    )
+                )
+            else:
+                fused.extend(run)
+            run = []
+
+            if stage is not None:
+                fused.append(stage)
+
+        return tuple(fused)
 
-        coloredlogs.install(level=self.logger.level, logger=self.logger)
+    @property
+    def metrics(self) -> List[Dict[str, Any]]:
+        # a snapshot of every (flow) stage's metrics, safe to poll while running
+        return [
+            {"index": i, **stage.metrics} for i, stage in enumerate(self.flow_stages)
+        ]
+
+    async def __export_metrics(self, path: str) -> None:
+        while True:
+            await asyncio.sleep(self.__metrics_interval_sec)
+            write_metrics(self, path)
 
     async def _flow_generator(self, value: Union[Iterable[T], AsyncIterable[T]]):
-        if isinstance(value, Iterable):
+        put = self.input_queue.put if self.__chunker is None else self.__chunker.put
+        checkpoint = self.checkpoint
+
+        if checkpoint is not None:
+            async for flow_val in self.__checkpointed(checkpoint, value):
+                await put(flow_val)
+        elif isinstance(value, Iterable):
             for i in value:
-                await self.input_queue.put(FlowValue(i))
+                await put(FlowValue(i))
         elif isinstance(value, AsyncIterable):
             async for i in value:
-                await self.input_queue.put(FlowValue(i))
+                await put(FlowValue(i))
         else:
             raise NotImplementedError("value must be either Iterable or AsyncIterable")
 
-        await self.input_queue.put(EndFlow())
+        if self.__chunker is not None:
+            await self.__chunker.flush()
+        await self.input_queue.put(END_FLOW)
 
-    async def pump_async(self, value: Union[Iterable[T], AsyncIterable[T]]):
+    async def __checkpointed(
+        self, store: CheckpointStore, value: Union[Iterable[T], AsyncIterable[T]]
+    ) -> AsyncIterator[FlowValue[T]]:
+        # skips inputs that completed, or resume from a `Checkpoint`, in an
+        # earlier run, the others are tracked until they complete
+        async def inputs(
+            source: Union[Iterable[T], AsyncIterable[T]]
+        ) -> AsyncIterator[T]:
+            if isinstance(source, Iterable):
+                for i in source:
+                    yield i
+            elif isinstance(source, AsyncIterable):
+                async for i in source:
+                    yield i
+            else:
+                raise NotImplementedError(
+                    "value must be either Iterable or AsyncIterable"
+                )
+
+        index = 0
+        skipped = 0
+        async for i in inputs(value):
+            key = store.key_of(i, index)
+            index += 1
+            if store.is_completed(key) or store.resumes_at(key) is not None:
+                skipped += 1
+                continue
+
+            flow_val = FlowValue(i)
+            flow_val._origin = key
+            for lineage in self.__source_lineages:
+                lineage.retain(key)
+            yield flow_val
+
+        if skipped > 0:
+            self.logger.info(
+                "[Pipeline] Skipped %d inputs done in an earlier run.", skipped
+            )
+
+    def __start_checkpoint(self, store: CheckpointStore) -> None:
+        stages = self.flow_stages
+        checkpoints = [
+            (i, stage)
+            for i, stage in enumerate(stages)
+            if isinstance(stage, Checkpoint)
+        ]
+        store.open([stage.checkpoint_id for _, stage in checkpoints])
+
+        def on_completed(key: str, ok: bool) -> None:
+            # an input with a failed value is tried again on the next run
+            if ok:
+                store.mark_completed(key)
+
+        def on_passed(checkpoint_id: str) -> Callable[[str, bool], None]:
+            def mark(key: str, ok: bool) -> None:
+                if ok:
+                    store.mark_passed(key, checkpoint_id)
+
+            return mark
+
+        # `lineage` tracks inputs through the whole pipeline, the others up
+        # to (and including) their checkpoint stage
+        lineage = Lineage(on_completed)
+        passed = [(i, Lineage(on_passed(s.checkpoint_id))) for i, s in checkpoints]
+        for i, stage in enumerate(stages):
+            stage._attach_lineage(
+                [lineage, *(p for k, p in passed if k > i)],
+                [lineage, *(p for k, p in passed if k >= i)],
+            )
+            if isinstance(stage, Checkpoint):
+                stage._attach_checkpoint(store)
+
+        self.__lineage = lineage
+        self.__source_lineages = [lineage, *(p for _, p in passed)]
+
+    def __start(self, value: Union[Iterable[T], AsyncIterable[T]]) -> None:
         self.logger.info(f"[Pipeline] Starting flow with {len(self.stages)} stages")
 
         flow_gen_task = asyncio.create_task(self._flow_generator(value))
         self.tasks.append(flow_gen_task)
 
+        stages = self.flow_stages
         task_getter = self.input_queue.get
-        first_stage = asyncio.create_task(self.stages[0].flow(task_getter))
+        first_stage = asyncio.create_task(stages[0].flow(task_getter))
         self.tasks.append(first_stage)
 
-        for i in range(1, len(self.stages)):
-            task_getter = self.stages[i - 1].output_task_getter
-            flow = self.stages[i].flow(task_getter)
+        for i in range(1, len(stages)):
+            task_getter = stages[i - 1].output_task_getter
+            flow = stages[i].flow(task_getter)
             task = asyncio.create_task(flow)
             self.tasks.append(task)
 
-        if len(self.tasks) > 0:
-            await tqdm.gather(*self.tasks)
+    async def stream(
+        self, value: Union[Iterable[T], AsyncIterable[T]]
+    ) -> AsyncGenerator[FlowValue, None]:
+        if self.tracer is not None:
+            self.tracer.start(self.flow_stages)
+        if self.checkpoint is not None:
+            self.__start_checkpoint(self.checkpoint)
+        lineage = self.__lineage
+        self.__start(value)
+
+        # used to surface a failing stage, which would otherwise never emit
+        # an `EndFlow` and leave us waiting forever
+        runner = asyncio.gather(*self.tasks)
+        final_queue = self.flow_stages[-1]._output_queue
+        exporter = None
+        metrics_file = self.__metrics_file
+        if metrics_file is not None:
+            exporter = asyncio.create_task(self.__export_metrics(metrics_file))
+
+        try:
+            while True:
+                if final_queue.empty():
+                    getter = asyncio.ensure_future(final_queue.get())
+                    await asyncio.wait(
+                        {getter, runner}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not getter.done():
+                        getter.cancel()
+                        runner.result()
+                        continue
+                    res = getter.result()
+                else:
+                    res = final_queue.get_nowait()
+
+                if isinstance(res, EndFlow):
+                    break
+                elif isinstance(res, list):
+                    for flow_val in res:
+                        yield flow_val
+                        # at-least-once, an input completes once its values
+                        # were consumed
+                        if lineage is not None:
+                            lineage.release(flow_val._origin)
+                else:
+                    yield res
+                    if lineage is not None:
+                        lineage.release(res._origin)
+
+            await runner
+        finally:
+            # the consumer may stop early, don't leave stages running
+            unfinished = [task for task in self.tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+            await self.http_client.close()
+            if exporter is not None and metrics_file is not None:
+                exporter.cancel()
+                write_metrics(self, metrics_file)
+            if self.tracer is not None:
+                self.__finish_trace(self.tracer)
+            if self.checkpoint is not None:
+                self.checkpoint.close()
 
         self.logger.info("[Pipeline] %d stages completed.", len(self.stages))
 
-        # read final stage
-        final_stage = self.stages[-1]
-        output = []
+    def stream_sync(
+        self,
+        value: Union[Iterable[T], AsyncIterable[T]],
+        engine: str = "auto",
+    ) -> Iterator[FlowValue]:
+        if self.__use_sync_engine(value, engine):
+            assert isinstance(value, Iterable)  # nosec
+            yield from self.__stream_sync_engine(value)
+            return
 
-        while not final_stage._output_queue.empty():
-            res = final_stage._output_queue.get_nowait()
+        loop = self.__event_loop()
+        values = self.stream(value)
 
-            if not isinstance(res, EndFlow):
-                output.append(res)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(values.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(values.aclose())
 
-        return output
+    async def pump_async(self, value: Union[Iterable[T], AsyncIterable[T]]):
+        return [fv async for fv in self.stream(value)]
+
+    def pump(
+        self,
+        value: Union[Iterable[T], AsyncIterable[T]],
+        engine: str = "auto",
+    ):
+        if self.__use_sync_engine(value, engine):
+            assert isinstance(value, Iterable)  # nosec
+            return list(self.__stream_sync_engine(value))
 
-    def pump(self, value: Union[Iterable[T], AsyncIterable[T]]):
-        loop = asyncio.get_event_loop()
+        loop = self.__event_loop()
         output = loop.run_until_complete(self.pump_async(value))
         return output
+
+    def __use_sync_engine(
+        self, value: Union[Iterable[T], AsyncIterable[T]], engine: str
+    ) -> bool:
+        if engine not in ("auto", "async", "sync"):
+            raise ValueError("`engine` must be one of 'auto', 'async' or 'sync'")
+
+        # without I/O (or executor) stages there is nothing to wait for, so
+        # asyncio and its queues would only add overhead, the tracer however
+        # measures the queues and tasks, so it needs the async engine
+        capable = (
+            isinstance(value, Iterable)
+            and self.checkpoint is None
+            and self.tracer is None
+            and all(stage._sync_capable for stage in self.flow_stages)
+        )
+
+        if engine == "sync" and not capable:
+            raise ValueError(
+                "The sync engine needs an Iterable and only supports stages "
+                "without I/O or executors, and no checkpoint or tracer"
+            )
+
+        return engine != "async" and capable
+
+    def __stream_sync_engine(self, value: Iterable[T]) -> Iterator[FlowValue]:
+        self.logger.info(
+            f"[Pipeline] Starting sync flow with {len(self.stages)} stages"
+        )
+
+        values: Iterator[FlowValue] = (FlowValue(i) for i in value)
+        for stage in self.flow_stages:
+            values = stage._flow_sync(values)
+
+        yield from values
+
+        if self.__metrics_file is not None:
+            write_metrics(self, self.__metrics_file)
+        self.logger.info("[Pipeline] %d stages completed.", len(self.stages))
+
+    def __finish_trace(self, tracer: Tracer) -> None:
+        tracer.finish()
+        self.logger.info("[Pipeline] %s", tracer.report(self.flow_stages))
+        if tracer.dropped > 0:
+            self.logger.warning(
+                "[Pipeline] %d trace spans dropped, lower `sample_rate`.",
+                tracer.dropped,
+            )
+        if tracer.path is not None:
+            tracer.write()
+
+    @staticmethod
+    def __event_loop() -> asyncio.AbstractEventLoop:
+        try:
+            return asyncio.get_event_loop()
+        except RuntimeError:
+            # no current loop (e.g. a previous one was closed), start a new one
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            return loop
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+import shutil
+import sys
+import tempfile
+import weakref
+from collections import deque
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from micropipe.types import END_FLOW, FlowValue
+
+if TYPE_CHECKING:
+    import diskcache
+
+T = TypeVar("T")
+
+# makes a stage's output queue, given its `max_queue_size`
+QueueFactory = Callable[[int], asyncio.Queue]
+
+
+# groups `FlowValue`s into lists before putting them on `queue`, a chunk is put
+# once it holds `size` values or `linger_sec` after its first value arrived
+class Chunker(Generic[T]):
+    __queue: asyncio.Queue
+    __size: int
+    __linger_sec: float
+    __chunk: List[FlowValue[T]]
+    __timer: Optional[asyncio.TimerHandle]
+    __lingering: Set[asyncio.Future]
+
+    def __init__(self, queue: asyncio.Queue, size: int, linger_sec: float):
+        if size < 2:
+            raise ValueError("A chunk size < 2 is pointless")
+        self.__queue = queue
+        self.__size = size
+        self.__linger_sec = linger_sec
+        self.__chunk = []
+        self.__timer = None
+        self.__lingering = set()
+
+    async def put(self, flow_val: FlowValue[T]) -> None:
+        self.__chunk.append(flow_val)
+
+        if len(self.__chunk) >= self.__size:
+            await self.flush()
+        elif self.__timer is None and self.__linger_sec > 0.0:
+            loop = asyncio.get_running_loop()
+            self.__timer = loop.call_later(self.__linger_sec, self.__linger)
+
+    async def flush(self) -> None:
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+        chunk, self.__chunk = self.__chunk, []
+        # a chunk sent by the linger timer may still be waiting for room, it
+        # has to go first or the values after it (and END_FLOW) overtake it
+        if len(self.__lingering) > 0:
+            await asyncio.gather(*self.__lingering)
+
+        if len(chunk) > 0:
+            await self.__queue.put(chunk)
+
+    def __linger(self) -> None:
+        self.__timer = None
+        chunk, self.__chunk = self.__chunk, []
+        # keep a reference, the loop only holds weak references to tasks
+        task = asyncio.ensure_future(self.__send(chunk, list(self.__lingering)))
+        self.__lingering.add(task)
+        task.add_done_callback(self.__lingering.discard)
+
+    async def __send(
+        self, chunk: List[FlowValue[T]], previous: List[asyncio.Future]
+    ) -> None:
+        # chunks sent by earlier timers that are still waiting go first
+        if len(previous) > 0:
+            await asyncio.gather(*previous)
+        await self.__queue.put(chunk)
+
+
+# the storage behind `SpillQueue`, items stay in memory until either limit is
+# reached, after that they go to disk until it's drained again, so everything
+# in memory is older than everything on disk and FIFO order is kept
+class _SpillBuffer:
+    __memory: Deque[Tuple[Any, int]]
+    __memory_items: int
+    __memory_bytes: int
+    __bytes: int
+    __directory: Optional[str]
+    __sizer: Callable[[Any], int]
+    __disk: Optional[diskcache.Deque]
+    __disk_len: int
+    __cleanup: Optional[weakref.finalize]
+    spilled: int
+
+    def __init__(
+        self,
+        memory_items: int,
+        memory_bytes: int,
+        directory: Optional[str],
+        sizer: Callable[[Any], int],
+    ):
+        self.__memory = deque()
+        self.__memory_items = memory_items
+        self.__memory_bytes = memory_bytes
+        self.__bytes = 0
+        self.__directory = directory
+        self.__sizer = sizer
+        self.__disk = None
+        # `len` of a `diskcache.Deque` is a query, so it's counted here
+        self.__disk_len = 0
+        self.__cleanup = None
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return len(self.__memory) + self.__disk_len
+
+    def __iter__(self) -> Iterator[Any]:
+        for item, _ in self.__memory:
+            yield item
+        if self.__disk is not None:
+            yield from self.__disk
+
+    def __size(self, item: Any) -> int:
+        if isinstance(item, FlowValue):
+            return self.__sizer(item.value)
+        elif isinstance(item, list):
+            return sum(self.__sizer(flow_val.value) for flow_val in item)
+        return 0
+
+    def append(self, item: Any) -> None:
+        size = self.__size(item)
+        if (
+            self.__disk_len == 0
+            and len(self.__memory) < self.__memory_items
+            and self.__bytes + size <= self.__memory_bytes
+        ):
+            self.__memory.append((item, size))
+            self.__bytes += size
+            return
+
+        if self.__disk is None:
+            self.__disk = self.__open_disk()
+        self.__disk.append(item)
+        self.__disk_len += 1
+        self.spilled += 1
+
+    def popleft(self) -> Any:
+        if len(self.__memory) > 0:
+            item, size = self.__memory.popleft()
+            self.__bytes -= size
+        else:
+            assert self.__disk is not None  # nosec
+            item = self.__disk.popleft()
+            self.__disk_len -= 1
+
+        # nothing follows the end of the flow, the disk is no longer needed
+        if item is END_FLOW and self.__disk_len == 0:
+            self.close()
+        return item
+
+    def __open_disk(self) -> diskcache.Deque:
+        # only imported when spilling, and every queue gets its own (temporary)
+        # directory, so queues made by the same factory don't share one
+        from diskcache import Deque as DiskDeque
+
+        directory = tempfile.mkdtemp(prefix="micropipe-spill-", dir=self.__directory)
+        self.__cleanup = weakref.finalize(
+            self, shutil.rmtree, directory, ignore_errors=True
+        )
+        return DiskDeque(directory=directory)
+
+    def close(self) -> None:
+        if self.__disk is None:
+            return
+
+        disk, self.__disk = self.__disk, None
+        self.__disk_len = 0
+        disk.cache.close()
+        if self.__cleanup is not None:
+            self.__cleanup()
+
+
+# an `asyncio.Queue` that keeps up to `memory_items` items (values or chunks)
+# and `memory_bytes` (as estimated by `sizer` for each value) in memory, and
+# spills the rest to a `diskcache.Deque` under `directory` (by default the
+# system's temp directory), pass one to `Pipeline(queue_factory=...)`, a
+# `maxsize` of at most `memory_items` is ignored
+class SpillQueue(asyncio.Queue):
+    _queue: _SpillBuffer
+    __buffer: _SpillBuffer
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        memory_items: int = 10_000,
+        memory_bytes: int = 64 * 2 ** 20,
+        directory: Optional[str] = None,
+        sizer: Callable[[Any], int] = sys.getsizeof,
+    ):
+        if memory_items < 1:
+            raise ValueError("`memory_items` must be >= 1")
+        if memory_bytes < 0:
+            raise ValueError("`memory_bytes` must be >= 0")
+        self.__buffer = _SpillBuffer(memory_items, memory_bytes, directory, sizer)
+        # a queue bounded to at most `memory_items` blocks before it could
+        # ever spill (eg. `Pipeline`'s default `max_queue_size`), since memory
+        # is bounded anyway such a `maxsize` is ignored, a larger one bounds
+        # the items in memory and on disk together
+        super().__init__(0 if maxsize <= memory_items else maxsize)
+        # `asyncio.Queue` appends to and pops from `_queue`, `qsize` is its len
+        self._queue = self.__buffer
+
+    @property
+    def spilled(self) -> int:
+        # how many items were written to disk so far
+        return self.__buffer.spilled
+
+    def close(self) -> None:
+        # removes the spilled items, done once `EndFlow` was taken off the queue
+        self.__buffer.close()
@@ -1,8 +1,53 @@
-from .collect import CollectDeque, CollectList
+import importlib
+from typing import TYPE_CHECKING, Any
+
+from .checkpoint import Checkpoint
 from .filter import Filter
 from .flatten import Flatten
 from .passthrough import Passthrough
 from .rate_limit import RateLimit
-from .request import Request
 from .transform import Transform
 from .url_generator import UrlGenerator
+
+# stages with heavier dependencies (aiohttp, diskcache, numpy) are imported
+# on first use, so pipelines that don't need them start faster
+_LAZY = {
+    "CollectDeque": ".collect",
+    "CollectList": ".collect",
+    "Request": ".request",
+    "VectorFilter": ".vector",
+    "VectorTransform": ".vector",
+}
+
+# type checkers see plain imports, a module `__getattr__` would make them treat
+# the whole package as incomplete
+if TYPE_CHECKING:
+    from .collect import CollectDeque, CollectList
+    from .request import Request
+    from .vector import VectorFilter, VectorTransform
+else:
+
+    def __getattr__(name: str) -> Any:
+        module = _LAZY.get(name)
+        if module is None:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+        value = getattr(importlib.import_module(module, __name__), name)
+        globals()[name] = value
+        return value
+
+
+__all__ = [
+    "Checkpoint",
+    "CollectDeque",
+    "CollectList",
+    "Filter",
+    "Flatten",
+    "Passthrough",
+    "RateLimit",
+    "Request",
+    "Transform",
+    "UrlGenerator",
+    "VectorFilter",
+    "VectorTransform",
+]
@@ -2,29 +2,142 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
 from abc import ABC, abstractmethod
-from typing import Generic, Optional, TypeVar, Union
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Deque,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TypeVar,
+    Union,
+)
 
-from tqdm.asyncio import tqdm
+from micropipe.checkpoint import Lineage, merge_origins
+from micropipe.metrics import StageMetrics
+from micropipe.queues import Chunker, QueueFactory
+from micropipe.types import (
+    END_FLOW,
+    EndFlow,
+    FlowChunk,
+    FlowValue,
+    MetaData,
+    MetaFunc,
+    Origin,
+    TaskGetter,
+)
 
-from micropipe.types import EndFlow, FlowValue, MetaData, MetaFunc, TaskGetter
+if TYPE_CHECKING:
+    from micropipe.http import HttpClient
+    from micropipe.tracing import Tracer
 
 I = TypeVar("I")  # input
 O = TypeVar("O")  # output
 
+# these are read with `.get(None)`, unset outside of a handler
+# in ordered mode, the sequence number of the task a handler runs in
+_SEQ: ContextVar[Optional[int]] = ContextVar("micropipe_seq")
+# in ordered mode, where a chunk's concurrently handled values collect their
+# output, so it can be emitted in the chunk's order
+_CAPTURE: ContextVar[Optional[List[Any]]] = ContextVar("micropipe_capture")
+# when tracing, the id of the sampled value a handler is working on
+_TRACE_ITEM: ContextVar[Optional[int]] = ContextVar("micropipe_trace")
+# when checkpointing, the origin of the value a handler is working on, which
+# the values it makes inherit
+_ORIGIN: ContextVar[Optional[Origin]] = ContextVar("micropipe_origin")
+
 
 class BaseStage(Generic[I, O], ABC):
-    _output_queue: asyncio.Queue[Union[FlowValue[O], EndFlow]]
+    _output_queue: asyncio.Queue[Union[FlowValue[O], FlowChunk[O], EndFlow]]
     _meta_func: Optional[MetaFunc]
     _logger: logging.Logger
+    _max_in_flight: Optional[int]
+    _max_queue_size: Optional[int]
+    _chunk_size: Optional[int]
+    _chunk_linger_sec: Optional[float]
+    _ordered: Optional[bool]
+    _reorder_window: Optional[int]
+    _progress: Optional[bool]
+    _queue_factory: Optional[QueueFactory]
+    _succeeded: int
+    _failed: int
+    _metrics: StageMetrics
+    _tracer: Optional[Tracer]
+    _trace_index: int
+    __traced: int
+    __retain: Sequence[Lineage]
+    __release: Sequence[Lineage]
+    __chunker: Optional[Chunker[O]]
+    __reorder: Optional[Dict[int, Deque[FlowValue[O]]]]
+    __done_seqs: Set[int]
+    __next_seq: int
+    __flushing: bool
+    __window: Optional[asyncio.Semaphore]
 
     def __init__(
         self,
         meta_func: Optional[MetaFunc] = None,
+        max_in_flight: Optional[int] = None,
+        max_queue_size: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+        chunk_linger_sec: Optional[float] = None,
+        ordered: Optional[bool] = None,
+        reorder_window: Optional[int] = None,
+        progress: Optional[bool] = None,
+        queue_factory: Optional[QueueFactory] = None,
     ):
-        self._output_queue = asyncio.Queue()
+        if max_in_flight is not None and max_in_flight < 0:
+            raise ValueError("`max_in_flight` must be >= 0")
+        if max_queue_size is not None and max_queue_size < 0:
+            raise ValueError("`max_queue_size` must be >= 0")
+        if chunk_size is not None and chunk_size < 0:
+            raise ValueError("`chunk_size` must be >= 0")
+        if reorder_window is not None and reorder_window < 0:
+            raise ValueError("`reorder_window` must be >= 0")
+
+        # `None` means "not set", in which case the owning `Pipeline` may
+        # supply a default, 0 means unbounded (or unchunked)
+        self._max_in_flight = max_in_flight
+        self._max_queue_size = max_queue_size
+        self._chunk_size = chunk_size
+        self._chunk_linger_sec = chunk_linger_sec
+        # makes the output queue, given `max_queue_size`, eg. a `SpillQueue`
+        self._queue_factory = queue_factory
+        # emit values in the order they were received, holding back (at most
+        # `reorder_window`, by default `max_in_flight`) values that overtook
+        # a slower one
+        self._ordered = ordered
+        self._reorder_window = reorder_window
+        self.__reorder = None
+        self.__done_seqs = set()
+        self.__next_seq = 0
+        self.__flushing = False
+        self.__window = None
+        # show a tqdm progress bar while flowing, unless `False`
+        self._progress = progress
         self._meta_func = meta_func
+        self._succeeded = 0
+        self._failed = 0
+        self._metrics = StageMetrics()
+        self._tracer = None
+        self._trace_index = 0
+        self.__traced = 0
+        self.__retain = ()
+        self.__release = ()
         self._logger = logging.getLogger()
+        self.__chunker = None
+        self.__reset_output()
 
     @property
     def name(self) -> str:
@@ -34,43 +147,451 @@ class BaseStage(Generic[I, O], ABC):
     def output_task_getter(self) -> TaskGetter:
         return self._output_queue.get
 
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        # a snapshot, safe to poll while the stage flows
+        metrics = self._metrics
+        latency = metrics.latency
+        elapsed = metrics.elapsed_sec
+        handled = self._succeeded + self._failed
+
+        return {
+            "stage": self.name,
+            "received": metrics.received,
+            "emitted": metrics.emitted,
+            "succeeded": self._succeeded,
+            "failed": self._failed,
+            "in_flight": metrics.in_flight,
+            "queue_depth": self._output_queue.qsize(),
+            "wait_sec": metrics.wait_sec,
+            "elapsed_sec": elapsed,
+            "throughput_per_sec": handled / elapsed if elapsed > 0.0 else 0.0,
+            "latency": {
+                "count": latency.count,
+                "sum_sec": latency.sum,
+                "max_sec": latency.max,
+                "p50_sec": latency.quantile(0.5),
+                "p95_sec": latency.quantile(0.95),
+                "p99_sec": latency.quantile(0.99),
+                "buckets": list(latency.bounds),
+                "counts": list(latency.counts),
+            },
+        }
+
+    def _apply_defaults(self, **defaults: Any) -> None:
+        for key, value in defaults.items():
+            if getattr(self, f"_{key}") is None:
+                setattr(self, f"_{key}", value)
+
+        self.__reset_output()
+
+    def __reset_output(self) -> None:
+        new_queue = self._queue_factory or asyncio.Queue
+        self._output_queue = new_queue(self._max_queue_size or 0)
+
+        # a chunk size of 0 or 1 means values are sent one at a time
+        if self._chunk_size is not None and self._chunk_size > 1:
+            linger = self._chunk_linger_sec or 0.0
+            self.__chunker = Chunker(self._output_queue, self._chunk_size, linger)
+        else:
+            self.__chunker = None
+
     async def flow(self, task_getter: TaskGetter) -> None:
-        tasks = []
+        # tasks are dropped as soon as they finish, only the counters survive,
+        # so memory is bounded by the number of in-flight values
+        pending: Set[asyncio.Task] = set()
         scheduled = 0
+        self._succeeded = 0
+        self._failed = 0
+        metrics = self._metrics
+        metrics.start()
+        tracer = self._tracer
 
-        while True:
-            value = await task_getter()
+        # only pull a value from upstream once there is a free slot, this way a
+        # slow stage pushes back on the stages (and source) before it
+        slots = asyncio.Semaphore(self._max_in_flight) if self._max_in_flight else None
+        progress = None
+        if self._progress is not False:
+            # only imported when used, tqdm adds to import time and per value
+            from tqdm.asyncio import tqdm
 
-            if isinstance(value, EndFlow):
-                break
-            # else
-            task = asyncio.create_task(self._task_handler(value))
-            scheduled += 1
-            tasks.append(task)
+            progress = tqdm(desc=self.name)
+
+        # in ordered mode every task gets a sequence number, its output is held
+        # back until all earlier tasks' output was emitted
+        ordered = bool(self._ordered)
+        seq = 0
+        if ordered:
+            self.__start_reordering()
+
+        def reap(task: asyncio.Task) -> None:
+            pending.discard(task)
+            if progress is not None:
+                progress.update()
+            if slots is not None:
+                slots.release()
+
+        try:
+            while True:
+                if slots is not None:
+                    await slots.acquire()
+
+                wait_start = time.perf_counter()
+                value = await task_getter()
+                wait_end = time.perf_counter()
+                metrics.wait_sec += wait_end - wait_start
+
+                if isinstance(value, EndFlow):
+                    break
+
+                if ordered and self.__window is not None:
+                    # the window bounds how much output can be held back,
+                    # once it's full we stop pulling values from upstream
+                    await self.__window.acquire()
+
+                if isinstance(value, list):
+                    # a whole chunk is handled by a single task
+                    handler = self._chunk_handler(value)
+                    scheduled += len(value)
+                    metrics.received += len(value)
+                else:
+                    handler = self.__handle(value)
+                    scheduled += 1
+                    metrics.received += 1
+
+                if tracer is not None:
+                    self.__traced += 1
+                    if self.__traced % tracer.sample_every == 0:
+                        item = id(value)
+                        index = self._trace_index
+                        tracer.record(index, "wait", wait_start, wait_end, item)
+                        handler = self.__handle_traced(item, handler)
+
+                if ordered:
+                    task = asyncio.create_task(self.__handle_ordered(seq, handler))
+                    seq += 1
+                else:
+                    task = asyncio.create_task(handler)
 
-        results = await tqdm.gather(*tasks)
-        success: int = sum(map(int, results))
+                pending.add(task)
+                task.add_done_callback(reap)
 
-        pct = round(float(success) / float(scheduled) * 100.0, 1)
+            if len(pending) > 0:
+                await asyncio.wait(pending)
+        except asyncio.CancelledError:
+            for task in list(pending):
+                task.cancel()
+            raise
+        finally:
+            if progress is not None:
+                progress.close()
+            self.__reorder = None
+            metrics.finish()
+
+        self._log_summary(scheduled)
+
+        await self._mark_done()
+
+    def _log_summary(self, scheduled: int) -> None:
+        pct = float(self._succeeded) / float(scheduled) * 100.0 if scheduled else 100.0
 
         self._logger.info(
             "[%s] %d / %d (%.1f %%) tasks completed successfully.",
             self.name,
-            success,
+            self._succeeded,
             scheduled,
             pct,
         )
 
-        await self._mark_done()
+    async def _values(self, task_getter: TaskGetter) -> AsyncIterator[FlowValue[I]]:
+        # for stages that override `flow`, yields single values (unpacking
+        # chunks) until `EndFlow` is received
+        metrics = self._metrics
+        metrics.start()
+
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                value = await task_getter()
+                metrics.wait_sec += time.perf_counter() - wait_start
+
+                if isinstance(value, EndFlow):
+                    break
+                elif isinstance(value, list):
+                    metrics.received += len(value)
+                    for flow_val in value:
+                        yield flow_val
+                else:
+                    metrics.received += 1
+                    yield value
+        finally:
+            metrics.finish()
+
+    @property
+    def _concurrent_chunks(self) -> bool:
+        # whether the values in an incoming chunk may be handled concurrently,
+        # rather than one after the other
+        return False
+
+    async def _chunk_handler(self, chunk: FlowChunk[I]) -> None:
+        if self._concurrent_chunks and self.__reorder is not None:
+            for output in await asyncio.gather(*map(self.__handle_captured, chunk)):
+                for flow_val in output:
+                    await self.__route(flow_val)
+        elif self._concurrent_chunks:
+            await asyncio.gather(*map(self.__handle, chunk))
+        else:
+            for flow_val in chunk:
+                await self.__handle(flow_val)
+
+    async def __handle(self, flow_val: FlowValue[I]) -> None:
+        metrics = self._metrics
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        origin = flow_val._origin
+        token = _ORIGIN.set(origin) if self.__release else None
+        success = False
+        try:
+            success = await self._task_handler(flow_val)
+        except Exception as e:
+            self._logger.warning("[%s] TaskHandler Exception: %s", self.name, e)
+        finally:
+            metrics.in_flight -= 1
+            if token is not None:
+                _ORIGIN.reset(token)
+                self._release(origin, failed=not success)
+
+        metrics.latency.record(time.perf_counter() - start)
+        if success:
+            self._succeeded += 1
+        else:
+            self._failed += 1
+
+    async def __handle_captured(self, flow_val: FlowValue[I]) -> List[FlowValue[O]]:
+        # runs in its own task (and context), returns the values it emitted
+        output: List[FlowValue[O]] = []
+        _CAPTURE.set(output)
+        await self.__handle(flow_val)
+
+        return output
+
+    async def __handle_traced(self, item: int, handler: Awaitable[None]) -> None:
+        # records the handler's span, and (through `_TRACE_ITEM`) its outputs'
+        token = _TRACE_ITEM.set(item)
+        start = time.perf_counter()
+        try:
+            await handler
+        finally:
+            _TRACE_ITEM.reset(token)
+            tracer = self._tracer
+            if tracer is not None:
+                end = time.perf_counter()
+                tracer.record(self._trace_index, "handle", start, end, item)
+
+    def __start_reordering(self) -> None:
+        self.__reorder = {}
+        self.__done_seqs = set()
+        self.__next_seq = 0
+        self.__flushing = False
+        window = self._reorder_window
+        if window is None:
+            window = self._max_in_flight
+        self.__window = asyncio.Semaphore(window) if window else None
+
+    async def __handle_ordered(self, seq: int, handler: Awaitable[None]) -> None:
+        _SEQ.set(seq)
+        await handler
+        self.__done_seqs.add(seq)
+        await self.__flush()
+
+    async def __flush(self) -> None:
+        # emits held back values in order, up to the first unfinished task,
+        # only one task flushes at a time, picking up what others finished
+        reorder = self.__reorder
+        if reorder is None or self.__flushing:
+            return
+
+        self.__flushing = True
+        try:
+            while True:
+                held_back = reorder.get(self.__next_seq)
+                if held_back:
+                    await self.__put(held_back.popleft())
+                elif self.__next_seq in self.__done_seqs:
+                    self.__done_seqs.discard(self.__next_seq)
+                    reorder.pop(self.__next_seq, None)
+                    self.__next_seq += 1
+                    if self.__window is not None:
+                        self.__window.release()
+                else:
+                    break
+        finally:
+            self.__flushing = False
 
     async def _mark_done(self) -> None:
-        await self._output_queue.put(EndFlow())
+        if self.__chunker is not None:
+            await self.__chunker.flush()
+        await self._output_queue.put(END_FLOW)
 
-    async def _output(self, value: O, meta: Optional[MetaData] = None) -> None:
+    def _make_flow_value(
+        self, value: O, meta: Optional[MetaData] = None
+    ) -> FlowValue[O]:
         if self._meta_func:
             old_meta = {} if meta is None else meta
             meta = self._meta_func(value, old_meta)
-        await self._output_queue.put(FlowValue(value, meta))
+
+        flow_val = FlowValue(value, meta)
+        origin = _ORIGIN.get(None)
+        if origin is not None:
+            flow_val._origin = origin
+        return flow_val
+
+    def _forward(self, flow_val: FlowValue[Any], value: O) -> FlowValue[O]:
+        # reuses the incoming `FlowValue` for the output, for stages that
+        # emit exactly one value per input value
+        if self._meta_func:
+            flow_val.meta = self._meta_func(value, flow_val.meta)
+        flow_val.value = value
+
+        return flow_val
+
+    async def _output(self, value: O, meta: Optional[MetaData] = None) -> None:
+        await self._emit(self._make_flow_value(value, meta))
+
+    async def _emit(self, flow_val: FlowValue[O]) -> None:
+        for lineage in self.__retain:
+            lineage.retain(flow_val._origin)
+        await self.__route(flow_val)
+
+    async def __route(self, flow_val: FlowValue[O]) -> None:
+        reorder = self.__reorder
+        if reorder is not None:
+            capture = _CAPTURE.get(None)
+            if capture is not None:
+                # already retained, routed once the whole chunk was handled
+                capture.append(flow_val)
+                return
+
+            # the oldest unfinished task emits directly, later ones wait
+            seq = _SEQ.get(None)
+            if seq is not None and (seq != self.__next_seq or self.__flushing):
+                reorder.setdefault(seq, deque()).append(flow_val)
+                return
+
+        await self.__put(flow_val)
+
+    async def __put(self, flow_val: FlowValue[O]) -> None:
+        self._metrics.emitted += 1
+        tracer = self._tracer
+        if tracer is not None:
+            item = _TRACE_ITEM.get(None)
+            if item is not None:
+                # how long the output waited for room downstream
+                start = time.perf_counter()
+                await self.__put_value(flow_val)
+                end = time.perf_counter()
+                tracer.record(self._trace_index, "output", start, end, item)
+                return
+
+        await self.__put_value(flow_val)
+
+    async def __put_value(self, flow_val: FlowValue[O]) -> None:
+        if self.__chunker is None:
+            await self._output_queue.put(flow_val)
+        else:
+            await self.__chunker.put(flow_val)
+
+    def _attach_http_client(self, http_client: HttpClient) -> None:
+        # called by `Pipeline` to share one HTTP client between its stages
+        pass
+
+    def _attach_tracer(self, tracer: Optional[Tracer], index: int) -> None:
+        # called by `Pipeline`, `index` is the stage's place in the flow
+        self._tracer = tracer
+        self._trace_index = index
+        self.__traced = 0
+
+    def _attach_lineage(
+        self, retain: Sequence[Lineage], release: Sequence[Lineage]
+    ) -> None:
+        # called by a checkpointing `Pipeline`, emitted values are retained in
+        # the `retain` lineages, handled ones released from `release`
+        self.__retain = retain
+        self.__release = release
+
+    @property
+    def _tracks_lineage(self) -> bool:
+        return len(self.__release) > 0
+
+    def _release(self, origin: Optional[Origin], failed: bool = False) -> None:
+        for lineage in self.__release:
+            lineage.release(origin, failed)
+
+    def _hold(self, origin: Optional[Origin]) -> None:
+        # keeps `origin` from completing in the lineages this stage emits to,
+        # until it's let go of again
+        for lineage in self.__retain:
+            lineage.retain(origin)
+
+    def _let_go(self, origin: Optional[Origin]) -> None:
+        for lineage in self.__retain:
+            lineage.release(origin)
+
+    @contextmanager
+    def _derived_from(self, origins: Sequence[Optional[Origin]]) -> Iterator[None]:
+        # for stages that override `flow` and combine values, the values made
+        # within derive from all of `origins`
+        if not self.__release:
+            yield
+            return
+
+        token = _ORIGIN.set(merge_origins(origins))
+        try:
+            yield
+        finally:
+            _ORIGIN.reset(token)
+
+    @property
+    def _fusible(self) -> bool:
+        # fusible stages implement `_apply`, a synchronous version of
+        # `_task_handler` that returns the output value (or None to drop it)
+        return False
+
+    def _apply(self, flow_val: FlowValue[I]) -> Optional[FlowValue[O]]:
+        raise NotImplementedError(f"`{self.name}` can't be fused")
+
+    @property
+    def _sync_capable(self) -> bool:
+        # whether the stage can run in `Pipeline`'s synchronous engine
+        return self._fusible
+
+    def _flow_sync(self, values: Iterator[FlowValue[I]]) -> Iterator[FlowValue[O]]:
+        # the synchronous engine's counterpart to `flow`, a generator that
+        # consumes values and yields this stage's output values (only counts
+        # are kept, timing every value would cost more than applying it)
+        scheduled = 0
+        self._succeeded = 0
+        self._failed = 0
+        metrics = self._metrics
+        metrics.start()
+
+        for flow_val in values:
+            scheduled += 1
+            metrics.received += 1
+            try:
+                result = self._apply(flow_val)
+            except Exception as e:
+                self._logger.warning("[%s] TaskHandler Exception: %s", self.name, e)
+                self._failed += 1
+                continue
+
+            self._succeeded += 1
+            if result is not None:
+                metrics.emitted += 1
+                yield result
+
+        metrics.finish()
+        self._log_summary(scheduled)
 
     @abstractmethod
     async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
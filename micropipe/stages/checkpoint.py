@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Generic, Optional, TypeVar
+
+from micropipe.checkpoint import origin_keys
+from micropipe.stages.base import BaseStage
+from micropipe.types import FlowValue, TaskGetter
+
+if TYPE_CHECKING:
+    from micropipe.checkpoint import CheckpointStore
+
+I = TypeVar("I")  # input
+
+
+# records every value that passes it in the pipeline's `CheckpointStore`, on
+# a rerun the recorded values of unfinished inputs are replayed from here, so
+# the stages before it don't run again for them
+class Checkpoint(BaseStage[I, I], Generic[I]):
+    __checkpoint_id: str
+    __store: Optional[CheckpointStore]
+
+    def __init__(self, checkpoint_id: str, **kwargs):
+        super().__init__(**kwargs)
+        self.__checkpoint_id = checkpoint_id
+        self.__store = None
+
+    @property
+    def checkpoint_id(self) -> str:
+        return self.__checkpoint_id
+
+    def _attach_checkpoint(self, store: Optional[CheckpointStore]) -> None:
+        # called by a checkpointing `Pipeline`, without one values just pass
+        self.__store = store
+
+    async def flow(self, task_getter: TaskGetter) -> None:
+        if self.__store is not None:
+            await self.__replay(self.__store)
+        await super().flow(task_getter)
+
+    async def __replay(self, store: CheckpointStore) -> None:
+        # an input isn't complete until all of its replayed values are, so
+        # each one is held until its last record was emitted, if the replay
+        # is cut short they stay held, and are replayed again next run
+        remaining = store.replay_counts(self.__checkpoint_id)
+        if len(remaining) == 0:
+            return
+        for key in remaining:
+            self._hold(key)
+
+        replayed = 0
+        for origin, value, meta in store.replay(self.__checkpoint_id):
+            flow_val: FlowValue[I] = FlowValue(value, meta)
+            flow_val._origin = origin
+            await self._emit(flow_val)
+            replayed += 1
+
+            for key in origin_keys(origin):
+                remaining[key] -= 1
+                if remaining[key] == 0:
+                    del remaining[key]
+                    self._let_go(key)
+
+        self._logger.info(
+            "[%s] Replayed %d values from checkpoint '%s'.",
+            self.name,
+            replayed,
+            self.__checkpoint_id,
+        )
+
+    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
+        if self.__store is not None:
+            self.__store.record(
+                self.__checkpoint_id, flow_val._origin, flow_val.value, flow_val._meta
+            )
+        await self._emit(flow_val)
+
+        return True
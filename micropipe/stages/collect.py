@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import weakref
 from typing import (
+    Any,
+    AsyncIterator,
     Callable,
     Generic,
+    Iterator,
     List,
     MutableSequence,
     Optional,
@@ -11,59 +20,179 @@ from typing import (
     Union,
 )
 
-from diskcache import Deque
+from diskcache import Cache, Deque
 
+from micropipe.disk import DiskDeque, codec
 from micropipe.stages.base import BaseStage
-from micropipe.types import EndFlow, FlowValue, TaskGetter
+from micropipe.types import (
+    END_FLOW,
+    Compression,
+    EndFlow,
+    FlowValue,
+    Origin,
+    Serializer,
+    TaskGetter,
+)
 
 I = TypeVar("I")  # input
 # currently O may be 'Sequence' in the case of Deque
-O = TypeVar("O", bound=Union[Sequence, MutableSequence])  # input
+O = TypeVar("O", bound=Union[Sequence[Any], MutableSequence[Any]])  # input
+
+
+async def _next_value(
+    values: AsyncIterator[FlowValue[I]],
+) -> Union[FlowValue[I], EndFlow]:
+    try:
+        return await values.__anext__()
+    except StopAsyncIteration:
+        return END_FLOW
 
 
 # --- abstract class defined here ---
 
 
 class _CollectBase(BaseStage[I, O], Generic[I, O]):
-    __new_batch: Callable[[], O]
+    __new_batch: Callable[[], Any]
+    __finish_batch: Callable[[Any], O]
+    __sizer: Callable[[I], int]
     _batch_size: int
+    _max_wait_sec: Optional[float]
+    _max_bytes: Optional[int]
 
     def __init__(
         self,
-        new_batch: Callable[[], O],
+        new_batch: Callable[[], Any],
         batch_size: int = 0,
+        finish_batch: Optional[Callable[[Any], O]] = None,
+        max_wait_sec: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sizer: Callable[[I], int] = sys.getsizeof,
         **kwargs,
     ):
         super().__init__(**kwargs)
         if batch_size == 1:
             raise ValueError("A batch size of 1 is pointless")
+        if max_wait_sec is not None and max_wait_sec <= 0.0:
+            raise ValueError("`max_wait_sec` must be > 0")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("`max_bytes` must be >= 1")
+        # `new_batch` makes something to `append` values to, which is turned
+        # into the emitted batch by `finish_batch`
         self.__new_batch = new_batch
+        self.__finish_batch = finish_batch or (lambda batch: batch)
         self._batch_size = batch_size
+        # a partial batch is also emitted `max_wait_sec` after its first value
+        # arrived, or once its values' `sizer` sizes add up to `max_bytes`
+        self._max_wait_sec = max_wait_sec
+        self._max_bytes = max_bytes
+        self.__sizer = sizer
 
     async def flow(self, task_getter: TaskGetter) -> None:
-        batch = self.__new_batch()
+        # made once its first value arrives, so no empty batch is left over
+        batch = None
+        batch_bytes = 0
+        # when checkpointing, a batch derives from the values it holds
+        lineage = self._tracks_lineage
+        origins: List[Optional[Origin]] = []
+        values = self._values(task_getter)
+        loop = asyncio.get_running_loop()
+        max_wait_sec = self._max_wait_sec
+        deadline = 0.0
+        # waiting for a value is only cut short by the deadline, the same
+        # getter is awaited again afterwards, so no value is lost
+        getter: Optional[asyncio.Future] = None
 
-        while True:
-            v = await task_getter()
+        try:
+            while True:
+                if max_wait_sec is None:
+                    v = await _next_value(values)
+                else:
+                    if getter is None:
+                        getter = asyncio.ensure_future(_next_value(values))
+                    timeout = None
+                    if batch is not None:
+                        timeout = max(deadline - loop.time(), 0.0)
+                    done, _ = await asyncio.wait({getter}, timeout=timeout)
+                    if not done:
+                        await self.__output_batch(batch, origins)
+                        batch = None
+                        continue
+                    v, getter = getter.result(), None
 
-            if isinstance(v, EndFlow):
-                break
-            # else
-            batch.append(v.value)
+                if isinstance(v, EndFlow):
+                    break
 
-            # 0 means we never execute this branch, since
-            # len(batch) > 0 (always)
-            if len(batch) == self._batch_size:
-                await self._output(batch)
-                batch = self.__new_batch()
+                if batch is None:
+                    batch = self.__new_batch()
+                    batch_bytes = 0
+                    origins = []
+                    if max_wait_sec is not None:
+                        deadline = loop.time() + max_wait_sec
+                batch.append(v.value)
+                if lineage:
+                    origins.append(v._origin)
+                if self._max_bytes is not None:
+                    batch_bytes += self.__sizer(v.value)
 
-        if len(batch) > 0:
-            await self._output(batch)
+                if self.__full(batch, batch_bytes):
+                    await self.__output_batch(batch, origins)
+                    batch = None
+        finally:
+            if getter is not None:
+                getter.cancel()
+
+        if batch is not None:
+            await self.__output_batch(batch, origins)
 
         self._logger.info("[%s] Collect complete", self.name)
 
         await self._mark_done()
 
+    def __full(self, batch: Any, batch_bytes: int) -> bool:
+        # a `batch_size` of 0 is never reached, since len(batch) > 0 (always)
+        if len(batch) == self._batch_size:
+            return True
+        return self._max_bytes is not None and batch_bytes >= self._max_bytes
+
+    async def __output_batch(self, batch: Any, origins: List[Optional[Origin]]) -> None:
+        batch = self.__finish_batch(batch)
+        with self._derived_from(origins):
+            await self._output(batch)
+        for origin in origins:
+            self._release(origin)
+
+    @property
+    def _sync_capable(self) -> bool:
+        return True
+
+    def _flow_sync(self, values: Iterator[FlowValue[I]]) -> Iterator[FlowValue[O]]:
+        # values are never waited for here, so only `max_bytes` applies
+        batch = None
+        batch_bytes = 0
+        metrics = self._metrics
+        metrics.start()
+
+        for v in values:
+            metrics.received += 1
+            if batch is None:
+                batch = self.__new_batch()
+                batch_bytes = 0
+            batch.append(v.value)
+            if self._max_bytes is not None:
+                batch_bytes += self.__sizer(v.value)
+
+            if self.__full(batch, batch_bytes):
+                metrics.emitted += 1
+                yield self._make_flow_value(self.__finish_batch(batch))
+                batch = None
+
+        if batch is not None:
+            metrics.emitted += 1
+            yield self._make_flow_value(self.__finish_batch(batch))
+
+        metrics.finish()
+        self._logger.info("[%s] Collect complete", self.name)
+
     async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
         pass
 
@@ -84,15 +213,101 @@ class CollectList(_CollectBase[I, List[I]], Generic[I]):
         )
 
 
+def _remove_cache(cache: Cache) -> None:
+    cache.close()
+    shutil.rmtree(cache.directory, ignore_errors=True)
+
+
+# buffers appended values and writes them to the deque in one transaction
+# every `size` values, rather than one transaction per value
+class _DequeWriter:
+    __deque: DiskDeque
+    __size: int
+    __buffer: List[Any]
+    __len: int
+
+    def __init__(self, deque: DiskDeque, size: int):
+        self.__deque = deque
+        self.__size = size
+        self.__buffer = []
+        self.__len = 0
+
+    def __len__(self) -> int:
+        return self.__len
+
+    def append(self, value: Any) -> None:
+        self.__buffer.append(value)
+        self.__len += 1
+        if len(self.__buffer) >= self.__size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.__buffer) > 0:
+            self.__deque.extend(self.__buffer)
+            self.__buffer = []
+
+    def finish(self) -> DiskDeque:
+        self.flush()
+        return self.__deque
+
+
 class CollectDeque(_CollectBase[I, Deque], Generic[I]):
+    __cache_directory: Optional[str]
+    __serializer: Serializer
+    __compression: Compression
+    __compress_level: int
+    __batches: int
+
     def __init__(
         self,
         batch_size: int = 0,
         cache_directory: Optional[str] = None,
+        serializer: Serializer = Serializer.PICKLE,
+        compression: Compression = Compression.NONE,
+        compress_level: int = 1,
+        write_batch_size: int = 1000,
         **kwargs,
     ):
+        if write_batch_size < 1:
+            raise ValueError("`write_batch_size` must be >= 1")
+        # fail early if the serializer (or compression) isn't installed
+        _ = codec(serializer, compression, compress_level)
         super().__init__(
-            lambda: Deque(directory=cache_directory),
+            lambda: _DequeWriter(self.__new_deque(), write_batch_size),
             batch_size,
+            lambda writer: writer.finish(),
             **kwargs,
         )
+        self.__cache_directory = cache_directory
+        self.__serializer = serializer
+        self.__compression = compression
+        self.__compress_level = compress_level
+        self.__batches = 0
+
+    def __new_deque(self) -> DiskDeque:
+        # every batch gets its own directory, a temporary one is removed once
+        # its deque is garbage collected, numbered ones under `cache_directory`
+        # are kept, but replaced when a later run reuses them
+        if self.__cache_directory is None:
+            directory = tempfile.mkdtemp(prefix="micropipe-collect-")
+        else:
+            directory = os.path.join(
+                self.__cache_directory, f"batch-{self.__batches:05d}"
+            )
+            shutil.rmtree(directory, ignore_errors=True)
+        self.__batches += 1
+
+        deque = DiskDeque(
+            directory, self.__serializer, self.__compression, self.__compress_level
+        )
+        if self.__cache_directory is None:
+            weakref.finalize(deque, _remove_cache, deque.cache)
+        return deque
+
+    async def flow(self, task_getter: TaskGetter) -> None:
+        self.__batches = 0
+        await super().flow(task_getter)
+
+    def _flow_sync(self, values: Iterator[FlowValue[I]]) -> Iterator[FlowValue[Deque]]:
+        self.__batches = 0
+        yield from super()._flow_sync(values)
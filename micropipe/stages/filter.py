@@ -1,26 +1,66 @@
 from __future__ import annotations
 
-from typing import Callable, Generic, TypeVar
+from typing import Callable, Generic, Optional, TypeVar
 
+from micropipe.executor import ChunkedExecutor, ExecutorLike
 from micropipe.stages.base import BaseStage
-from micropipe.types import FlowValue
+from micropipe.types import FlowValue, TaskGetter
 
 I = TypeVar("I")  # input
 
 
 class Filter(BaseStage[I, I], Generic[I]):
     __should_keep: Callable[[FlowValue[I]], bool]
+    __executor: Optional[ChunkedExecutor[I, bool]]
 
     def __init__(
         self,
         should_keep: Callable[[FlowValue[I]], bool],
+        executor: Optional[ExecutorLike] = None,
+        max_workers: Optional[int] = None,
+        executor_chunk_size: int = 64,
         **kwargs,
     ):
         super().__init__(**kwargs)
         self.__should_keep = should_keep
+        self.__executor = (
+            None
+            if executor is None
+            else ChunkedExecutor(
+                should_keep, executor, max_workers, executor_chunk_size
+            )
+        )
 
-    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
+    @property
+    def _fusible(self) -> bool:
+        return self.__executor is None
+
+    @property
+    def _concurrent_chunks(self) -> bool:
+        return self.__executor is not None
+
+    def _apply(self, flow_val: FlowValue[I]) -> Optional[FlowValue[I]]:
         if self.__should_keep(flow_val):
-            await self._output(flow_val.value, flow_val.meta)
+            return self._forward(flow_val, flow_val.value)
+
+        return None
+
+    async def flow(self, task_getter: TaskGetter) -> None:
+        try:
+            await super().flow(task_getter)
+        finally:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+
+    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
+        if self.__executor is None:
+            result = self._apply(flow_val)
+        elif await self.__executor.run(flow_val):
+            result = self._forward(flow_val, flow_val.value)
+        else:
+            result = None
+
+        if result is not None:
+            await self._emit(result)
 
         return True
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Generic, List, TypeVar
+from typing import Generic, Iterator, List, TypeVar
 
 from micropipe.stages.base import BaseStage
 from micropipe.types import FlowValue
@@ -11,6 +11,36 @@ I = TypeVar("I")
 class Flatten(BaseStage[List[I], I], Generic[I]):
     async def _task_handler(self, flow_val: FlowValue[List[I]]) -> bool:
         for item in flow_val.value:
-            await self._output(item, flow_val.meta)
+            await self._output(item, flow_val._meta)
 
         return True
+
+    @property
+    def _sync_capable(self) -> bool:
+        return True
+
+    def _flow_sync(
+        self, values: Iterator[FlowValue[List[I]]]
+    ) -> Iterator[FlowValue[I]]:
+        scheduled = 0
+        self._succeeded = 0
+        self._failed = 0
+        metrics = self._metrics
+        metrics.start()
+
+        for flow_val in values:
+            scheduled += 1
+            metrics.received += 1
+            # like the async path, items before an error are still emitted
+            try:
+                for item in flow_val.value:
+                    metrics.emitted += 1
+                    yield self._make_flow_value(item, flow_val._meta)
+            except Exception as e:
+                self._logger.warning("[%s] TaskHandler Exception: %s", self.name, e)
+                self._failed += 1
+                continue
+            self._succeeded += 1
+
+        metrics.finish()
+        self._log_summary(scheduled)
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from typing import Any, Optional, Sequence
+
+from micropipe.stages.base import BaseStage
+from micropipe.types import FlowValue
+
+
+# runs a sequence of fusible stages back-to-back on each value, without any
+# queues or tasks in between, created by `Pipeline`
+class Fused(BaseStage[Any, Any]):
+    __stages: Sequence[BaseStage]
+
+    def __init__(self, stages: Sequence[BaseStage], **kwargs):
+        super().__init__(**kwargs)
+        if len(stages) < 2:
+            raise ValueError("Fusing fewer than 2 stages is pointless")
+        if not all(stage._fusible for stage in stages):
+            raise ValueError("All fused stages must be fusible")
+        self.__stages = stages
+
+    @property
+    def name(self) -> str:
+        return f"Fused({' > '.join(stage.name for stage in self.__stages)})"
+
+    @property
+    def stages(self) -> Sequence[BaseStage]:
+        return self.__stages
+
+    @property
+    def _fusible(self) -> bool:
+        return True
+
+    def _apply(self, flow_val: FlowValue[Any]) -> Optional[FlowValue[Any]]:
+        result: Optional[FlowValue[Any]] = flow_val
+        for stage in self.__stages:
+            if result is None:
+                break
+            result = stage._apply(result)
+
+        return result
+
+    async def _task_handler(self, flow_val: FlowValue[Any]) -> bool:
+        result = self._apply(flow_val)
+        if result is not None:
+            await self._emit(result)
+
+        return True
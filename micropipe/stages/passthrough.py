@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 from copy import copy, deepcopy
-from typing import Callable, Generic, TypeVar
+from typing import Callable, Generic, Optional, TypeVar
 
+from micropipe.executor import ChunkedExecutor, ExecutorLike
 from micropipe.stages.base import BaseStage
-from micropipe.types import CopyMode, FlowValue
+from micropipe.types import CopyMode, FlowValue, TaskGetter
 
 I = TypeVar("I")  # input
 
@@ -12,25 +13,64 @@ I = TypeVar("I")  # input
 class Passthrough(BaseStage[I, I], Generic[I]):
     __func: Callable[[FlowValue[I]], None]
     __copy_mode: CopyMode
+    __executor: Optional[ChunkedExecutor[I, None]]
 
     def __init__(
         self,
         func: Callable[[FlowValue[I]], None],
         copy_mode: CopyMode = CopyMode.NONE,
+        executor: Optional[ExecutorLike] = None,
+        max_workers: Optional[int] = None,
+        executor_chunk_size: int = 64,
         **kwargs,
     ):
         super().__init__(**kwargs)
         self.__func = func
         self.__copy_mode = copy_mode
+        self.__executor = (
+            None
+            if executor is None
+            else ChunkedExecutor(func, executor, max_workers, executor_chunk_size)
+        )
 
-    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
-        await self._output(flow_val.value, flow_val.meta)
+    @property
+    def _fusible(self) -> bool:
+        # copies are made to protect values from `func`, that's only
+        # guaranteed if each copy is made by its own stage
+        return self.__copy_mode is CopyMode.NONE and self.__executor is None
+
+    @property
+    def _concurrent_chunks(self) -> bool:
+        return self.__executor is not None
 
+    def __copy(self, flow_val: FlowValue[I]) -> FlowValue[I]:
         if self.__copy_mode is CopyMode.NONE:
-            self.__func(flow_val)
+            return flow_val
         elif self.__copy_mode is CopyMode.SHALLOW:
-            self.__func(copy(flow_val))
+            return copy(flow_val)
         else:  # self.__copy_mode is CopyMode.DEEP:
-            self.__func(deepcopy(flow_val))
+            return deepcopy(flow_val)
+
+    def _apply(self, flow_val: FlowValue[I]) -> Optional[FlowValue[I]]:
+        self.__func(self.__copy(flow_val))
+
+        return self._forward(flow_val, flow_val.value)
+
+    async def flow(self, task_getter: TaskGetter) -> None:
+        try:
+            await super().flow(task_getter)
+        finally:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+
+    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
+        if self.__executor is None:
+            result = self._apply(flow_val)
+        else:
+            await self.__executor.run(self.__copy(flow_val))
+            result = self._forward(flow_val, flow_val.value)
+
+        if result is not None:
+            await self._emit(result)
 
         return True
@@ -2,59 +2,183 @@ from __future__ import annotations
 
 import asyncio
 import time
-from typing import Generic, TypeVar
-
-from tqdm.asyncio import tqdm
+import urllib.parse
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar, Union
 
+from micropipe.adaptive import AdaptiveLimit
 from micropipe.stages.base import BaseStage
-from micropipe.types import EndFlow, FlowValue, TaskGetter
+from micropipe.types import FlowValue, TaskGetter
 
 I = TypeVar("I")  # input
 
 
+def url_host(flow_val: FlowValue[str]) -> str:
+    # a `key` for `RateLimit`, one bucket per host of a url value
+    return urllib.parse.urlsplit(flow_val.value).netloc
+
+
+class _TokenBucket:
+    rate: float
+    burst: int
+    __tokens: float
+    __updated: float
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__updated = time.monotonic()
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self.__tokens = min(
+            float(self.burst), self.__tokens + (now - self.__updated) * self.rate
+        )
+        self.__updated = now
+
+    def wait_sec(self) -> float:
+        # how long until a whole token is available
+        self.__refill()
+        return max(1.0 - self.__tokens, 0.0) / self.rate
+
+    def take(self) -> bool:
+        # takes a token if one is available, tokens never go negative, so a
+        # change of `rate` applies to the very next token
+        self.__refill()
+        if self.__tokens < 1.0:
+            return False
+        self.__tokens -= 1.0
+        return True
+
+
 class RateLimit(BaseStage[I, I], Generic[I]):
     __max_per_sec: float
+    __adaptive: Optional[AdaptiveLimit]
+    __burst: int
+    __key: Optional[Callable[[FlowValue[I]], Hashable]]
+    __exempt: Optional[Callable[[FlowValue[I]], bool]]
+    __buckets: Dict[Hashable, _TokenBucket]
+    __released: int
 
     def __init__(
         self,
-        max_per_sec: float,
+        max_per_sec: Union[float, AdaptiveLimit],
         concurrency_limit: int = 0,
+        exempt: Optional[Callable[[FlowValue[I]], bool]] = None,
+        burst: int = 1,
+        key: Optional[Callable[[FlowValue[I]], Hashable]] = None,
         **kwargs,
     ):
+        # bound the output queue, so at most *concurrency_limit* released
+        # values wait for the next stage, 0 leaves it to the pipeline
+        if concurrency_limit > 0:
+            kwargs.setdefault("max_queue_size", concurrency_limit)
+        # chunking would hold back values that were already released
+        kwargs.setdefault("chunk_size", 0)
+
         super().__init__(**kwargs)
+        # an `AdaptiveLimit` changes the rate at runtime, eg. fed by `Request`
+        self.__adaptive = None
+        if isinstance(max_per_sec, AdaptiveLimit):
+            self.__adaptive = max_per_sec
+            max_per_sec = max_per_sec.rate
         if max_per_sec <= 0.0:
             raise ValueError("`max_per_sec` must be a positive value > 0")
+        if burst < 1:
+            raise ValueError("`burst` must be >= 1")
 
         self.__max_per_sec = max_per_sec
-
-        # limit the size of the output queue to ensure the next stage can have
-        # at most *concurrency_limit* concurrent *task_handler*s running
-        if concurrency_limit >= 0:
-            self._output_queue = asyncio.Queue(concurrency_limit)
-
-    async def __limited_generator(self, task_getter: TaskGetter):
-        sleep_time = 1.0 / self.__max_per_sec
-
+        self.__burst = burst
+        # values with different keys (eg. `url_host`) get their own buckets
+        self.__key = key
+        # values for which `exempt` is true pass without using up the rate,
+        # eg. `ResponseCache.is_fresh` for urls that won't hit the network
+        self.__exempt = exempt
+        self.__buckets = {}
+        self.__released = 0
+
+    def __bucket(self, flow_val: FlowValue[I]) -> _TokenBucket:
+        key = None if self.__key is None else self.__key(flow_val)
+        bucket = self.__buckets.get(key)
+        if bucket is None:
+            bucket = _TokenBucket(self.__max_per_sec, self.__burst)
+            self.__buckets[key] = bucket
+
+        return bucket
+
+    async def __acquire(self, bucket: _TokenBucket) -> None:
         while True:
-            start = time.monotonic()
-            value = await task_getter()
-            yield value
-
-            sleep_for = sleep_time - (time.monotonic() - start)
-
-            if sleep_for > 0.0:
-                await asyncio.sleep(sleep_for)
-
-    async def flow(self, task_getter: TaskGetter):
-        async for fv in tqdm(self.__limited_generator(task_getter), desc=self.name):
-            if isinstance(fv, EndFlow):
-                break
-            elif isinstance(fv, FlowValue):
-                await self._output(fv.value, fv.meta)
-            else:
-                raise ValueError("Unexpected type in `RateLimit` queue")
+            if self.__adaptive is not None:
+                bucket.rate = self.__adaptive.rate
+            if bucket.take():
+                return
+            await asyncio.sleep(bucket.wait_sec())
+
+    async def flow(self, task_getter: TaskGetter) -> None:
+        # a single loop releases the values one after the other, so no value
+        # waits for a token in a task of its own, a value waiting for its
+        # key's token holds back the values behind it
+        self.__buckets = {}
+        self.__released = 0
+        self._succeeded = 0
+        self._failed = 0
+        scheduled = 0
+        first_release: Optional[float] = None
+        last_release: Optional[float] = None
+        metrics = self._metrics
+
+        async for flow_val in self._values(task_getter):
+            scheduled += 1
+            start = time.perf_counter()
+            origin = flow_val._origin
+            try:
+                if self.__exempt is None or not self.__exempt(flow_val):
+                    await self.__acquire(self.__bucket(flow_val))
+                    last_release = time.monotonic()
+                    if first_release is None:
+                        first_release = last_release
+                    self.__released += 1
+
+                await self._emit(self._forward(flow_val, flow_val.value))
+            except Exception as e:
+                self._logger.warning("[%s] TaskHandler Exception: %s", self.name, e)
+                self._failed += 1
+                self._release(origin, failed=True)
+                continue
+
+            metrics.latency.record(time.perf_counter() - start)
+            self._succeeded += 1
+            self._release(origin)
+
+        # the last value's slot ends before the flow does, so a run right
+        # after this one can't exceed the rate either
+        if len(self.__buckets) > 0:
+            await asyncio.sleep(max(b.wait_sec() for b in self.__buckets.values()))
+
+        self._log_summary(scheduled)
+        if first_release is not None and last_release is not None:
+            self.__log_rate(last_release - first_release)
 
         await self._mark_done()
 
+    def __log_rate(self, duration: float) -> None:
+        buckets = len(self.__buckets)
+        limit = self.__max_per_sec
+        if self.__adaptive is not None:
+            limit = self.__adaptive.rate
+        # n values released at the limit take (n - burst) / rate seconds
+        spaced = max(self.__released - self.__burst * buckets, 0)
+        rate = spaced / duration / buckets if duration > 0.0 else float("inf")
+        self._logger.info(
+            "[%s] %d values released in %.1f sec, %.2f per sec per bucket "
+            "(limit %.2f, %d buckets).",
+            self.name,
+            self.__released,
+            duration,
+            rate,
+            limit,
+            buckets,
+        )
+
     async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
         pass
@@ -1,85 +1,393 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Awaitable, Callable, Generic, Optional, TypeVar
+import random
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Collection,
+    Dict,
+    Generic,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
 import aiohttp
 from aiohttp import ClientResponse, ClientSession
 
+from micropipe.adaptive import AdaptiveLimit
+from micropipe.http import CachedResponse, HttpClient, ResponseCache, decode_records
 from micropipe.stages.base import BaseStage
-from micropipe.types import FlowValue, HttpMethod, TaskGetter
+from micropipe.types import FlowValue, HttpMethod, StreamFormat, TaskGetter
 
 O = TypeVar("O")  # output
 
+# transient failures, anything else (eg. 404) is not worth retrying
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# statuses for which the server may tell us how long to wait
+_RETRY_AFTER_STATUSES = frozenset({429, 503})
+# retries that are always allowed, before the retry budget applies
+_MIN_RETRIES = 10
+# how much of a streamed body is read at a time
+_STREAM_CHUNK_SIZE = 2 ** 16
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    # `Retry-After` is either a number of seconds or an HTTP date
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
 
 class Request(BaseStage[str, O], Generic[O]):
     __method: HttpMethod
-    __decode_func: Callable[[ClientResponse], Awaitable[O]]
+    __decode_func: Optional[Callable[[ClientResponse], Awaitable[O]]]
+    __stream: Optional[StreamFormat]
     __session: Optional[ClientSession]
+    __http_client: Optional[HttpClient]
+    __active_session: Optional[ClientSession]
     __retry_limit: int
-    __retry_timout_sec: int
+    __retry_timout_sec: float
+    __backoff_base_sec: float
+    __retry_statuses: Collection[int]
+    __retry_budget: Optional[float]
+    __cache: Optional[ResponseCache]
+    __requests: int
+    __retries: int
+    __cache_hits: int
+    __cache_misses: int
+    __cache_revalidated: int
+    __coalesce: bool
+    __recent_window: int
+    __in_flight: Dict[str, asyncio.Future]
+    __recent: OrderedDict[str, Optional[O]]
+    __coalesced: int
+    __adaptive: Optional[AdaptiveLimit]
 
     def __init__(
         self,
-        decode_func: Callable[[ClientResponse], Awaitable[O]],
+        decode_func: Optional[Callable[[ClientResponse], Awaitable[O]]] = None,
         method: HttpMethod = HttpMethod.GET,
         retry_limit: int = 5,
-        retry_timout_sec: int = 15,
+        retry_timout_sec: float = 15,
         session: Optional[ClientSession] = None,
+        http_client: Optional[HttpClient] = None,
+        backoff_base_sec: float = 0.5,
+        retry_statuses: Collection[int] = RETRY_STATUSES,
+        retry_budget: Optional[float] = 0.2,
+        cache: Optional[ResponseCache] = None,
+        coalesce: bool = False,
+        recent_window: int = 0,
+        adaptive: Optional[AdaptiveLimit] = None,
+        stream: Optional[StreamFormat] = None,
         **kwargs,
     ):
         super().__init__(**kwargs)
+        if (decode_func is None) == (stream is None):
+            raise ValueError("Specify either `decode_func` or `stream`")
+        if stream is not None and (cache is not None or coalesce):
+            raise ValueError("`stream` can't be combined with `cache` or `coalesce`")
+        if session is not None and http_client is not None:
+            raise ValueError("Specify either `session` or `http_client`, not both")
+        if cache is not None and method not in (HttpMethod.GET, HttpMethod.HEAD):
+            raise ValueError("Only GET and HEAD responses can be cached")
+        if retry_budget is not None and retry_budget < 0.0:
+            raise ValueError("`retry_budget` must be >= 0")
         self.__method = method
         self.__decode_func = decode_func
+        # emit one value per record of the body as it downloads, instead of
+        # the decoded body as a whole
+        self.__stream = stream
         self.__retry_limit = retry_limit
+        # the longest we'll back off for (unless the server says otherwise)
         self.__retry_timout_sec = retry_timout_sec
+        self.__backoff_base_sec = backoff_base_sec
+        self.__retry_statuses = retry_statuses
+        self.__retry_budget = retry_budget
         self.__session = session
+        self.__http_client = http_client
+        self.__active_session = None
+        self.__cache = cache
+        self.__coalesce = coalesce
+        # with `coalesce`, how many recently completed results to reuse
+        self.__recent_window = recent_window
+        self.__in_flight = {}
+        self.__recent = OrderedDict()
+        self.__coalesced = 0
+        # fed with every response's latency and any throttling, and (if it
+        # controls concurrency) limits how many requests are sent at once
+        self.__adaptive = adaptive
+        self.__requests = 0
+        self.__retries = 0
+        self.__cache_hits = 0
+        self.__cache_misses = 0
+        self.__cache_revalidated = 0
+
+    def _attach_http_client(self, http_client: HttpClient) -> None:
+        # an explicitly given `session` or `http_client` takes precedence
+        if self.__session is None and self.__http_client is None:
+            self.__http_client = http_client
 
     async def flow(self, task_getter: TaskGetter) -> None:
-        should_close_session = False
-        if self.__session is None:
-            self.__session = aiohttp.ClientSession()
-            should_close_session = True
-        await super().flow(task_getter)
-        if should_close_session:
-            if self.__session is None:
-                raise TypeError("`Request` tried to close a None session!")
-            await self.__session.close()
+        # without a session or (shared) client, the stage uses and closes its own
+        http_client = self.__http_client
+        owns_client = self.__session is None and http_client is None
+        if owns_client:
+            http_client = HttpClient()
+
+        self.__requests = 0
+        self.__retries = 0
+        self.__cache_hits = 0
+        self.__cache_misses = 0
+        self.__cache_revalidated = 0
+        self.__coalesced = 0
+        self.__recent.clear()
+
+        try:
+            if self.__session is not None:
+                self.__active_session = self.__session
+            elif http_client is not None:
+                self.__active_session = await http_client.open()
+            await super().flow(task_getter)
+        finally:
+            self.__active_session = None
+            if owns_client and http_client is not None:
+                await http_client.close()
+
+        if self.__coalesce:
+            self._logger.info(
+                "[%s] %d duplicate requests coalesced.", self.name, self.__coalesced
+            )
+        if self.__cache is not None:
+            self._logger.info(
+                "[%s] Cache: %d hits, %d misses (%d revalidated).",
+                self.name,
+                self.__cache_hits,
+                self.__cache_misses,
+                self.__cache_revalidated,
+            )
+        if self.__adaptive is not None:
+            self._logger.info(
+                "[%s] Adaptive limit: %.2f per sec, concurrency %d (%d backoffs).",
+                self.name,
+                self.__adaptive.rate,
+                self.__adaptive.concurrency,
+                self.__adaptive.decreases,
+            )
+
+    async def __decode(self, response: Any) -> O:
+        if self.__decode_func is None:
+            raise TypeError("`Request` decode_func is None.")
+        return await self.__decode_func(response)
+
+    def __backoff(self, attempt: int) -> float:
+        # "full jitter", spreads retries out so they don't all hit the server
+        # at the same moment when it recovers
+        ceiling = min(self.__retry_timout_sec, self.__backoff_base_sec * 2 ** attempt)
+        return random.uniform(0.0, ceiling)  # nosec - not used for security
+
+    def __take_retry(self) -> bool:
+        # a stage wide budget, when most requests fail retrying only adds load
+        if self.__retry_budget is not None:
+            allowed = _MIN_RETRIES + self.__retry_budget * self.__requests
+            if self.__retries >= allowed:
+                return False
+
+        self.__retries += 1
+        return True
 
     async def _task_handler(self, flow_val: FlowValue[str]) -> bool:
-        if self.__session is None:
+        if self.__stream is not None:
+            ok, _ = await self.__fetch(flow_val.value, flow_val)
+            return ok
+
+        if self.__coalesce:
+            ok, decoded = await self.__fetch_coalesced(flow_val.value)
+        else:
+            ok, decoded = await self.__fetch(flow_val.value)
+
+        if ok:
+            # a succeeded (not streamed) fetch always returns the decoded value
+            await self._emit(self._forward(flow_val, cast(O, decoded)))
+
+        return ok
+
+    async def __fetch_coalesced(self, url: str) -> Tuple[bool, Optional[O]]:
+        # identical requests share a single call (and decoded result), each
+        # `FlowValue` is still emitted on its own with its own meta
+        if url in self.__recent:
+            self.__coalesced += 1
+            self.__recent.move_to_end(url)
+            return True, self.__recent[url]
+
+        in_flight = self.__in_flight.get(url)
+        if in_flight is not None:
+            self.__coalesced += 1
+            return await asyncio.shield(in_flight)
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.__in_flight[url] = future
+        result: Tuple[bool, Optional[O]] = (False, None)
+
+        try:
+            result = await self.__fetch(url)
+        finally:
+            # waiters fail along with us if we raise
+            del self.__in_flight[url]
+            future.set_result(result)
+
+        ok, decoded = result
+        if ok and self.__recent_window > 0:
+            self.__recent[url] = decoded
+            if len(self.__recent) > self.__recent_window:
+                self.__recent.popitem(last=False)
+
+        return result
+
+    async def __fetch(
+        self, url: str, stream_val: Optional[FlowValue[str]] = None
+    ) -> Tuple[bool, Optional[O]]:
+        # with `stream_val`, records are emitted (with its meta) while the
+        # body downloads and nothing is returned
+        if self.__active_session is None:
             raise TypeError("`Request` session is None.")
 
-        session = self.__session
+        session = self.__active_session
+        cache = self.__cache
+        stream_format = self.__stream
+        cached: Optional[Dict[str, Any]] = None
+        headers: Optional[Dict[str, str]] = None
+
+        if cache is not None:
+            cached = cache.get(self.__method, url)
+            if cached is not None and cache.is_fresh_entry(cached):
+                self.__cache_hits += 1
+                return True, await self.__decode(CachedResponse(cached))
+
+            self.__cache_misses += 1
+            if cached is not None:
+                headers = cache.conditional_headers(cached)
+
+        self.__requests += 1
+        attempt = 0
+        emitted = 0
 
-        remaining_tries = max(self.__retry_limit + 1, 1)
+        while True:
+            ok = False
+            decoded: Optional[O] = None
+            error: Union[str, Exception] = ""
+            retryable = False
+            retry_after: Optional[float] = None
+            throttled = False
 
-        while remaining_tries > 0:
-            remaining_tries -= 1
+            adaptive = self.__adaptive
+            if adaptive is not None:
+                await adaptive.acquire()
+            start = time.monotonic()
+
+            # the response (and so its connection) is released before we decide
+            # whether and how long to wait
             try:
-                response = await session.request(self.__method.name, flow_val.value)
-                status = response.status
+                async with session.request(
+                    self.__method.name, url, headers=headers
+                ) as response:
+                    status = response.status
+
+                    if status == 304 and cache is not None and cached is not None:
+                        self.__cache_revalidated += 1
+                        cache.refresh(self.__method, url, cached)
+                        decoded = await self.__decode(CachedResponse(cached))
+                        ok = True
+                    elif (
+                        200 <= status < 300
+                        and stream_val is not None
+                        and stream_format is not None
+                    ):
+                        chunks = response.content.iter_chunked(_STREAM_CHUNK_SIZE)
+                        records = decode_records(chunks, stream_format)
+                        async for record in records:
+                            await self._output(record, stream_val._meta)
+                            emitted += 1
+                        decoded = None
+                        ok = True
+                    elif 200 <= status < 300:
+                        if cache is not None:
+                            body = await response.read()
+                            cache.store(
+                                self.__method, url, status, response.headers, body
+                            )
+                        decoded = await self.__decode(response)
+                        ok = True
+                    else:
+                        error = f"HTTP Status Code: {status}"
+                        retryable = status in self.__retry_statuses
+                        throttled = status == 429 or status >= 500
+                        if status in _RETRY_AFTER_STATUSES:
+                            retry_after = _retry_after(response.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+                # a retry would emit the records we already emitted again
+                retryable = emitted == 0
+                throttled = isinstance(e, asyncio.TimeoutError)
+            finally:
+                if adaptive is not None:
+                    adaptive.release()
 
-                if status < 200 or status >= 300:
-                    raise RuntimeError(f"HTTP Status Code: {status}")
+            if adaptive is not None:
+                if throttled:
+                    adaptive.on_throttle()
+                elif ok:
+                    adaptive.on_success(time.monotonic() - start)
 
-                decoded = await self.__decode_func(response)
-                await self._output(decoded, flow_val.meta)
+            if ok:
+                return True, decoded
 
-                return True
+            remaining_tries = self.__retry_limit - attempt
+            self._logger.warning(
+                "[%s] TaskHandler Exception: %s (%d tries remaining)",
+                self.name,
+                error,
+                remaining_tries if retryable else 0,
+            )
 
-            except Exception as e:
+            if not retryable:
+                self._logger.warning(
+                    "[%s] Not retryable, losing value from flow.", self.name
+                )
+                return False, None
+            elif remaining_tries <= 0:
                 self._logger.warning(
-                    "[%s] TaskHandler Exception: %s (%d tries remaining)",
-                    self.name,
-                    e,
-                    remaining_tries,
+                    "[%s] Max retries reached, losing value from flow.", self.name
                 )
-                if remaining_tries > 0:
-                    await asyncio.sleep(self.__retry_timout_sec)
-
-        self._logger.warning(
-            "[%s] Max retries reached, losing value from flow.",
-            self.name,
-        )
-        return False
+                return False, None
+            elif not self.__take_retry():
+                self._logger.warning(
+                    "[%s] Retry budget exhausted, losing value from flow.", self.name
+                )
+                return False, None
+
+            if retry_after is None:
+                delay = self.__backoff(attempt)
+            else:
+                delay = retry_after + self.__backoff(0)
+
+            attempt += 1
+            await asyncio.sleep(delay)
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
-from typing import Callable, Generic, TypeVar
+from typing import Callable, Generic, Optional, TypeVar
 
+from micropipe.executor import ChunkedExecutor, ExecutorLike
 from micropipe.stages.base import BaseStage
-from micropipe.types import FlowValue
+from micropipe.types import FlowValue, TaskGetter
 
 I = TypeVar("I")  # input
 O = TypeVar("O")  # output
@@ -11,17 +12,53 @@ O = TypeVar("O")  # output
 
 class Transform(BaseStage[I, O], Generic[I, O]):
     __transformer: Callable[[FlowValue[I]], O]
+    __executor: Optional[ChunkedExecutor[I, O]]
 
     def __init__(
         self,
         transformer: Callable[[FlowValue[I]], O],
+        executor: Optional[ExecutorLike] = None,
+        max_workers: Optional[int] = None,
+        executor_chunk_size: int = 64,
         **kwargs,
     ):
         super(Transform, self).__init__(**kwargs)
         self.__transformer = transformer
+        self.__executor = (
+            None
+            if executor is None
+            else ChunkedExecutor(
+                transformer, executor, max_workers, executor_chunk_size
+            )
+        )
 
-    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
+    @property
+    def _fusible(self) -> bool:
+        return self.__executor is None
+
+    @property
+    def _concurrent_chunks(self) -> bool:
+        return self.__executor is not None
+
+    def _apply(self, flow_val: FlowValue[I]) -> Optional[FlowValue[O]]:
         transformed = self.__transformer(flow_val)
-        await self._output(transformed, flow_val.meta)
+        return self._forward(flow_val, transformed)
+
+    async def flow(self, task_getter: TaskGetter) -> None:
+        try:
+            await super().flow(task_getter)
+        finally:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+
+    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
+        if self.__executor is None:
+            result = self._apply(flow_val)
+        else:
+            transformed = await self.__executor.run(flow_val)
+            result = self._forward(flow_val, transformed)
+
+        if result is not None:
+            await self._emit(result)
 
         return True
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import re
 import urllib.parse
-from typing import Callable, Dict, Generic, TypeVar
+from typing import Callable, Dict, Generic, Optional, TypeVar
 
 from micropipe.stages.base import BaseStage
 from micropipe.types import FlowValue
@@ -44,9 +44,17 @@ class UrlGenerator(BaseStage[I, str], Generic[I]):
 
         return url
 
-    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
+    @property
+    def _fusible(self) -> bool:
+        return True
+
+    def _apply(self, flow_val: FlowValue[I]) -> Optional[FlowValue[str]]:
         url = self.__gen_url(flow_val)
+        return self._forward(flow_val, url)
 
-        await self._output(url, flow_val.meta)
+    async def _task_handler(self, flow_val: FlowValue[I]) -> bool:
+        result = self._apply(flow_val)
+        if result is not None:
+            await self._emit(result)
 
         return True
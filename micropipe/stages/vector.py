@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from abc import abstractmethod
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from micropipe.stages.base import BaseStage
+from micropipe.types import FlowValue, MetaData, Origin, TaskGetter, VectorOutput
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+Metas = List[Optional[MetaData]]
+
+
+# --- abstract class defined here ---
+
+
+class _VectorBase(BaseStage[Any, Any]):
+    _size: int
+    _output_mode: VectorOutput
+    _dtype: Any
+
+    def __init__(
+        self,
+        size: int = 1024,
+        output: VectorOutput = VectorOutput.ELEMENTS,
+        dtype: Any = None,
+        **kwargs,
+    ):
+        if np is None:
+            raise ImportError(
+                f"`{self.__class__.__name__}` requires numpy, "
+                "install it with `pip install micropipe[numpy]`"
+            )
+        super().__init__(**kwargs)
+        if size < 1:
+            raise ValueError("`size` must be >= 1")
+        self._size = size
+        self._output_mode = output
+        self._dtype = dtype
+
+    @abstractmethod
+    def _process(self, array: np.ndarray, metas: Metas) -> Tuple[np.ndarray, Metas]:
+        ...
+
+    def __apply(self, values: List[Any], metas: Metas) -> List[FlowValue[Any]]:
+        try:
+            array, metas = self._process(np.asarray(values, dtype=self._dtype), metas)
+            outputs = self.__outputs(array, metas)
+        except Exception as e:
+            self._logger.warning("[%s] Vector Exception: %s", self.name, e)
+            self._failed += len(values)
+            return []
+
+        self._succeeded += len(values)
+        return outputs
+
+    def __outputs(self, array: np.ndarray, metas: Metas) -> List[FlowValue[Any]]:
+        if self._output_mode is VectorOutput.ARRAYS:
+            # a reducing transformer (eg. `np.sum`) returns a 0-d array
+            array = np.atleast_1d(array)
+            if array.size == 0:
+                return []
+            # one value stands for the whole array, so it gets all the metas
+            merged: MetaData = {}
+            for meta in metas:
+                if meta:
+                    merged.update(meta)
+            return [self._make_flow_value(array, merged or None)]
+
+        # `tolist` converts to python scalars far faster than iterating
+        return [
+            self._make_flow_value(value, meta)
+            for value, meta in zip(array.tolist(), metas)
+        ]
+
+    async def flow(self, task_getter: TaskGetter) -> None:
+        self._succeeded = 0
+        self._failed = 0
+        scheduled = 0
+        values: List[Any] = []
+        metas: Metas = []
+        # when checkpointing, a batch's outputs derive from all its values
+        lineage = self._tracks_lineage
+        origins: List[Optional[Origin]] = []
+
+        async for flow_val in self._values(task_getter):
+            values.append(flow_val.value)
+            metas.append(flow_val._meta)
+            if lineage:
+                origins.append(flow_val._origin)
+
+            if len(values) == self._size:
+                scheduled += len(values)
+                await self.__emit_batch(values, metas, origins)
+                values, metas, origins = [], [], []
+
+        if len(values) > 0:
+            scheduled += len(values)
+            await self.__emit_batch(values, metas, origins)
+
+        self._log_summary(scheduled)
+
+        await self._mark_done()
+
+    async def __emit_batch(
+        self, values: List[Any], metas: Metas, origins: List[Optional[Origin]]
+    ) -> None:
+        failed = self._failed
+        with self._derived_from(origins):
+            outputs = self.__apply(values, metas)
+        for output in outputs:
+            await self._emit(output)
+        for origin in origins:
+            self._release(origin, failed=self._failed > failed)
+
+    @property
+    def _sync_capable(self) -> bool:
+        return True
+
+    def _flow_sync(self, values: Iterator[FlowValue[Any]]) -> Iterator[FlowValue[Any]]:
+        self._succeeded = 0
+        self._failed = 0
+        scheduled = 0
+        batch: List[Any] = []
+        metas: Metas = []
+        metrics = self._metrics
+        metrics.start()
+
+        for flow_val in values:
+            metrics.received += 1
+            batch.append(flow_val.value)
+            metas.append(flow_val._meta)
+
+            if len(batch) == self._size:
+                scheduled += len(batch)
+                outputs = self.__apply(batch, metas)
+                metrics.emitted += len(outputs)
+                yield from outputs
+                batch, metas = [], []
+
+        if len(batch) > 0:
+            scheduled += len(batch)
+            outputs = self.__apply(batch, metas)
+            metrics.emitted += len(outputs)
+            yield from outputs
+
+        metrics.finish()
+        self._log_summary(scheduled)
+
+    async def _task_handler(self, flow_val: FlowValue[Any]) -> bool:
+        pass
+
+
+# -- concrete classes below here ---
+
+
+class VectorTransform(_VectorBase):
+    __transformer: Callable[[np.ndarray], np.ndarray]
+
+    def __init__(
+        self,
+        transformer: Callable[[np.ndarray], np.ndarray],
+        size: int = 1024,
+        output: VectorOutput = VectorOutput.ELEMENTS,
+        dtype: Any = None,
+        **kwargs,
+    ):
+        super().__init__(size, output, dtype, **kwargs)
+        self.__transformer = transformer
+
+    def _process(self, array: np.ndarray, metas: Metas) -> Tuple[np.ndarray, Metas]:
+        transformed = np.asarray(self.__transformer(array))
+
+        if self._output_mode is VectorOutput.ELEMENTS and len(transformed) != len(
+            array
+        ):
+            raise ValueError("`transformer` must keep the array's length")
+
+        return transformed, metas
+
+
+class VectorFilter(_VectorBase):
+    __mask: Callable[[np.ndarray], np.ndarray]
+
+    def __init__(
+        self,
+        mask: Callable[[np.ndarray], np.ndarray],
+        size: int = 1024,
+        output: VectorOutput = VectorOutput.ELEMENTS,
+        dtype: Any = None,
+        **kwargs,
+    ):
+        super().__init__(size, output, dtype, **kwargs)
+        self.__mask = mask
+
+    def _process(self, array: np.ndarray, metas: Metas) -> Tuple[np.ndarray, Metas]:
+        keep = np.asarray(self.__mask(array), dtype=bool)
+        kept_metas = [meta for meta, k in zip(metas, keep.tolist()) if k]
+
+        return array[keep], kept_metas
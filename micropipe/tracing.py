@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from micropipe.stages.base import BaseStage
+
+# (stage index, span name, start, end, item id), times in `perf_counter` sec
+Span = Tuple[int, str, float, float, int]
+
+
+# records sampled per-value spans of every stage in a pipeline run, pass one
+# to `Pipeline(*stages, tracer=Tracer(...))`
+class Tracer:
+    path: Optional[str]
+    sample_every: int
+    max_spans: int
+    spans: List[Span]
+    dropped: int
+    __stage_names: Dict[int, str]
+    __started: float
+    __finished: Optional[float]
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        sample_rate: float = 0.01,
+        max_spans: int = 1_000_000,
+    ):
+        if not 0.0 < sample_rate <= 1.0:
+            raise ValueError("`sample_rate` must be > 0 and <= 1")
+        # where the Chrome trace-event JSON is written once the run completes
+        self.path = path
+        # sampling every n-th value keeps the cost per value a counter check
+        self.sample_every = max(round(1.0 / sample_rate), 1)
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self.__stage_names = {}
+        self.__started = time.perf_counter()
+        self.__finished = None
+
+    def start(self, stages: Sequence[BaseStage]) -> None:
+        self.spans = []
+        self.dropped = 0
+        self.__stage_names = {i: stage.name for i, stage in enumerate(stages)}
+        self.__started = time.perf_counter()
+        self.__finished = None
+
+    def finish(self) -> None:
+        self.__finished = time.perf_counter()
+
+    @property
+    def duration_sec(self) -> float:
+        end = time.perf_counter() if self.__finished is None else self.__finished
+        return end - self.__started
+
+    def record(
+        self, stage: int, name: str, start: float, end: float, item: int
+    ) -> None:
+        if len(self.spans) < self.max_spans:
+            self.spans.append((stage, name, start, end, item))
+        else:
+            self.dropped += 1
+
+    def to_chrome(self) -> Dict[str, Any]:
+        # the Chrome trace-event format (also read by Perfetto), one thread per
+        # stage with its waits on upstream, and one async track per value
+        events: List[Dict[str, Any]] = [
+            {"ph": "M", "name": "thread_name", "pid": 0, "tid": i, "args": {"name": n}}
+            for i, n in self.__stage_names.items()
+        ]
+
+        for stage, name, start, end, item in self.spans:
+            ts = (start - self.__started) * 1e6
+            if name == "wait":
+                events.append(
+                    {
+                        "ph": "X",
+                        "name": "wait upstream",
+                        "pid": 0,
+                        "tid": stage,
+                        "ts": ts,
+                        "dur": (end - start) * 1e6,
+                    }
+                )
+                continue
+
+            common = {
+                "name": name,
+                "cat": self.__stage_names.get(stage, str(stage)),
+                "id": item,
+                "pid": 0,
+                "tid": stage,
+            }
+            events.append({**common, "ph": "b", "ts": ts})
+            events.append({**common, "ph": "e", "ts": (end - self.__started) * 1e6})
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: Optional[str] = None) -> None:
+        path = self.path if path is None else path
+        if path is None:
+            raise ValueError("No trace `path` given")
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_chrome(), f)
+        os.replace(tmp_path, path)
+
+    def summary(self, stages: Sequence[BaseStage]) -> Dict[str, Any]:
+        # in a linear pipeline the stages before the bottleneck are blocked on
+        # a full output queue and the ones after it are starved, so the
+        # critical stage is the one that's neither
+        duration = self.duration_sec
+        handled: Dict[int, float] = {}
+        blocked: Dict[int, float] = {}
+        for stage, name, start, end, _ in self.spans:
+            if name == "handle":
+                handled[stage] = handled.get(stage, 0.0) + end - start
+            elif name == "output":
+                blocked[stage] = blocked.get(stage, 0.0) + end - start
+
+        report = []
+        for i, stage in enumerate(stages):
+            metrics = stage.metrics
+            starved = min(metrics["wait_sec"] / duration, 1.0) if duration else 0.0
+            handle_sec = handled.get(i, 0.0)
+            blocked_share = blocked.get(i, 0.0) / handle_sec if handle_sec else 0.0
+            report.append(
+                {
+                    "index": i,
+                    "stage": stage.name,
+                    "starved": starved,
+                    "blocked": blocked_share,
+                    "busy": (1.0 - starved) * (1.0 - blocked_share),
+                    "p50_sec": metrics["latency"]["p50_sec"],
+                    "p99_sec": metrics["latency"]["p99_sec"],
+                }
+            )
+
+        critical = max(report, key=lambda r: r["busy"]) if report else None
+        return {
+            "duration_sec": duration,
+            "stages": report,
+            "critical_stage": None if critical is None else critical["stage"],
+        }
+
+    def report(self, stages: Sequence[BaseStage]) -> str:
+        summary = self.summary(stages)
+        lines = [f"Trace of {summary['duration_sec']:.2f} sec:"]
+        for r in summary["stages"]:
+            lines.append(
+                f"  [{r['index']}] {r['stage']}: {r['starved']:.0%} starved, "
+                f"{r['blocked']:.0%} blocked on output, "
+                f"latency p50 {r['p50_sec'] * 1000:.1f} ms, "
+                f"p99 {r['p99_sec'] * 1000:.1f} ms"
+            )
+        lines.append(f"Critical stage: {summary['critical_stage']}")
+
+        return "\n".join(lines)
@@ -1,7 +1,18 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import Any, Awaitable, Callable, Dict, Generic, Optional, TypeVar, Union
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 T = TypeVar("T")
 O = TypeVar("O")
@@ -9,26 +20,56 @@ O = TypeVar("O")
 # helper type aliases
 MetaData = Dict[str, Any]
 MetaFunc = Callable[[O, MetaData], MetaData]
+# the key(s) of the input value(s) a value was derived from, when checkpointing,
+# values derived from several inputs (eg. a `Collect` batch) carry a tuple
+Origin = Union[str, Tuple[str, ...]]
 
 # classes
 class EndFlow:
-    def __eq__(self, __o: object) -> bool:
-        return isinstance(__o, EndFlow)
+    # a singleton, use `END_FLOW` and check for it by identity
+    __slots__ = ()
+    __instance: Optional[EndFlow] = None
+
+    def __new__(cls) -> EndFlow:
+        if cls.__instance is None:
+            cls.__instance = super().__new__(cls)
+        return cls.__instance
+
+    def __reduce__(self):
+        return (EndFlow, ())
+
+
+END_FLOW = EndFlow()
 
 
 class FlowValue(Generic[T]):
+    __slots__ = ("value", "_meta", "_origin")
+
     value: T
-    meta: MetaData
+    # `None` until meta is first used, most values never need any
+    _meta: Optional[MetaData]
+    _origin: Optional[Origin]
 
     def __init__(self, value: T, meta: Optional[MetaData] = None):
         self.value = value
-        self.meta = {} if meta is None else meta
+        self._meta = meta
+        self._origin = None
+
+    @property
+    def meta(self) -> MetaData:
+        if self._meta is None:
+            self._meta = {}
+        return self._meta
+
+    @meta.setter
+    def meta(self, meta: MetaData) -> None:
+        self._meta = meta
 
     def __eq__(self, __o: object) -> bool:
         return (
             isinstance(__o, FlowValue)
             and __o.value == self.value
-            and __o.meta == self.meta
+            and (__o._meta or {}) == (self._meta or {})
         )
 
 
@@ -38,6 +79,29 @@ class CopyMode(Enum):
     NONE = 3
 
 
+class VectorOutput(Enum):
+    ELEMENTS = 1  # one value per array element
+    ARRAYS = 2  # one value per array
+
+
+class StreamFormat(Enum):
+    NDJSON = 1  # one JSON value per line
+    JSON_LINES = 1  # (the same format)
+    JSON_ARRAY = 2  # a top-level JSON array of values
+
+
+class Serializer(Enum):
+    PICKLE = "pickle"  # protocol 5, any picklable value
+    JSON = "json"  # JSON compatible values only
+    MSGPACK = "msgpack"  # requires msgpack
+
+
+class Compression(Enum):
+    NONE = "none"
+    ZLIB = "zlib"
+    LZ4 = "lz4"  # requires lz4
+
+
 class HttpMethod(Enum):
     GET = "GET"
     POST = "POST"
@@ -50,5 +114,6 @@ class HttpMethod(Enum):
     PATCH = "PATCH"
 
 
-# helper alias that depends on above classes
-TaskGetter = Callable[..., Awaitable[Union[FlowValue[T], EndFlow]]]
+# helper aliases that depend on above classes
+FlowChunk = List[FlowValue[T]]
+TaskGetter = Callable[..., Awaitable[Union[FlowValue[T], FlowChunk[T], EndFlow]]]
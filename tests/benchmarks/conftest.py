@@ -0,0 +1,106 @@
+import asyncio
+import itertools
+import os
+import threading
+import tracemalloc
+from typing import Any, Callable, List
+
+import pytest
+from aiohttp import web
+
+# the large scaling runs (up to 10^7 values, 20 stages) take minutes, they
+# only run with MICROPIPE_BENCH_SCALING=1
+SCALING = os.environ.get("MICROPIPE_BENCH_SCALING", "") not in ("", "0")
+
+
+_REQUESTS = itertools.count(1)
+
+
+async def _item(request: web.Request) -> web.Response:
+    # `latency_ms` delays the response, `error_rate` is the share of 503s,
+    # every n-th request fails rather than a random share, so every run
+    # sees the same number of errors
+    latency_sec = float(request.query.get("latency_ms", 0)) / 1000.0
+    error_rate = float(request.query.get("error_rate", 0))
+    count = next(_REQUESTS)
+
+    if latency_sec > 0.0:
+        await asyncio.sleep(latency_sec)
+    if error_rate > 0.0 and count % round(1.0 / error_rate) == 0:
+        return web.Response(status=503)
+
+    return web.json_response({"id": int(request.match_info["id"])})
+
+
+async def _records(request: web.Request) -> web.StreamResponse:
+    # `n` NDJSON records, written in chunks of 100
+    n = int(request.query.get("n", 1000))
+    response = web.StreamResponse()
+    await response.prepare(request)
+    for start in range(0, n, 100):
+        lines = (f'{{"id": {i}}}\n' for i in range(start, min(start + 100, n)))
+        await response.write("".join(lines).encode())
+    await response.write_eof()
+
+    return response
+
+
+@pytest.fixture(scope="session")
+def http_server():
+    # runs in its own thread (and event loop), since `Pipeline.pump` runs
+    # its own loop in the benchmark's thread
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def start():
+        app = web.Application()
+        app.router.add_get("/items/{id}", _item)
+        app.router.add_get("/records", _records)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        state["runner"] = runner
+        state["port"] = runner.addresses[0][1]
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(start())
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait(10)
+
+    yield f"http://127.0.0.1:{state['port']}"
+
+    asyncio.run_coroutine_threadsafe(state["runner"].cleanup(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+
+
+def item_urls(
+    base_url: str, n: int, latency_ms: float = 0, error_rate: float = 0.0
+) -> List[str]:
+    query = f"latency_ms={latency_ms}&error_rate={error_rate}"
+    return [f"{base_url}/items/{i}?{query}" for i in range(n)]
+
+
+@pytest.fixture
+def peak_memory(benchmark) -> Callable[..., Any]:
+    # runs `func` once more with tracemalloc (outside of the timed rounds,
+    # it slows everything down) and records the peak in the benchmark's
+    # `extra_info`, so it ends up in the saved results
+    def measure(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        tracemalloc.start()
+        try:
+            result = func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        benchmark.extra_info["peak_memory_mb"] = round(peak / 2 ** 20, 3)
+        return result
+
+    return measure
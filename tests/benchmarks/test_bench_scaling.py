@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from micropipe import Pipeline, stages
+
+from .conftest import SCALING
+
+# a few rounds of long runs, too noisy for `poe bench`'s compare gate
+pytestmark = pytest.mark.noisy
+
+SIZES = [10 ** i for i in range(3, 8)] if SCALING else [10 ** 3, 10 ** 4]
+DEPTHS = [1, 2, 5, 10, 20] if SCALING else [1, 5]
+DEPTH_SIZE = 10 ** 5 if SCALING else 10 ** 3
+
+
+def _record_throughput(benchmark, size: int) -> None:
+    # the points of the scaling curves, saved with the results
+    if benchmark.stats is not None:
+        benchmark.extra_info["values_per_sec"] = size / benchmark.stats.stats.mean
+
+
+def _run(size: int, depth: int, engine: str):
+    pipeline = Pipeline(
+        *[stages.Transform(lambda fv: fv.value + 1) for _ in range(depth)],
+        stages.Filter(lambda fv: fv.value % 2 == 0),
+        quiet=True,
+        fuse=False,
+    )
+
+    # only the count is kept, so memory reflects the pipeline, not the result
+    if engine == "sync":
+        return sum(1 for _ in pipeline.stream_sync(range(size), engine="sync"))
+
+    async def count() -> int:
+        return sum([1 async for _ in pipeline.stream(range(size))])
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(count())
+    finally:
+        loop.close()
+
+
+@pytest.mark.parametrize("engine", ["async", "sync"])
+@pytest.mark.parametrize("size", SIZES)
+def test_bench_scaling_size(benchmark, peak_memory, size, engine):
+    # throughput (and peak memory) against the number of values, 5 stages
+    benchmark.group = f"scaling-size-{engine}"
+
+    count = benchmark.pedantic(_run, args=(size, 5, engine), rounds=3)
+    peak_memory(_run, size, 5, engine)
+    _record_throughput(benchmark, size)
+
+    assert count == size // 2
+
+
+@pytest.mark.parametrize("engine", ["async", "sync"])
+@pytest.mark.parametrize("depth", DEPTHS)
+def test_bench_scaling_depth(benchmark, peak_memory, depth, engine):
+    # throughput (and peak memory) against the number of stages
+    benchmark.group = f"scaling-depth-{engine}"
+    size = DEPTH_SIZE
+
+    count = benchmark.pedantic(_run, args=(size, depth, engine), rounds=3)
+    peak_memory(_run, size, depth, engine)
+    _record_throughput(benchmark, size)
+
+    assert count == size // 2
@@ -0,0 +1,186 @@
+import pytest
+
+from micropipe import Pipeline, stages
+from micropipe.types import CopyMode, StreamFormat
+
+from .conftest import item_urls
+
+N = 5_000
+
+
+def _pump(*pipeline_stages, values=range(N), engine="async", **kwargs):
+    pipeline = Pipeline(*pipeline_stages, quiet=True, **kwargs)
+    return pipeline.pump(values, engine=engine)
+
+
+@pytest.mark.parametrize("engine", ["async", "sync"])
+def test_bench_transform(benchmark, peak_memory, engine):
+    benchmark.group = "stages"
+    run = lambda: _pump(stages.Transform(lambda fv: fv.value + 1), engine=engine)
+
+    result = benchmark(run)
+    peak_memory(run)
+
+    assert len(result) == N
+
+
+def test_bench_filter(benchmark, peak_memory):
+    benchmark.group = "stages"
+    run = lambda: _pump(stages.Filter(lambda fv: fv.value % 2 == 0))
+
+    result = benchmark(run)
+    peak_memory(run)
+
+    assert len(result) == N // 2
+
+
+def test_bench_flatten(benchmark, peak_memory):
+    benchmark.group = "stages"
+    values = [list(range(10))] * (N // 10)
+    run = lambda: _pump(stages.Flatten(), values=values)
+
+    result = benchmark(run)
+    peak_memory(run)
+
+    assert len(result) == N
+
+
+@pytest.mark.parametrize("copy_mode", list(CopyMode), ids=lambda m: m.name)
+def test_bench_passthrough(benchmark, peak_memory, copy_mode):
+    benchmark.group = "stages"
+    values = [{"id": i, "tags": ["a", "b"], "nested": {"x": i}} for i in range(N)]
+    run = lambda: _pump(
+        stages.Passthrough(lambda fv: None, copy_mode=copy_mode), values=values
+    )
+
+    result = benchmark(run)
+    peak_memory(run)
+
+    assert len(result) == N
+
+
+def test_bench_collect_list(benchmark, peak_memory):
+    benchmark.group = "stages"
+    run = lambda: _pump(stages.CollectList(batch_size=100))
+
+    result = benchmark(run)
+    peak_memory(run)
+
+    assert len(result) == N // 100
+
+
+def test_bench_collect_deque(benchmark, peak_memory):
+    benchmark.group = "stages"
+    run = lambda: _pump(stages.CollectDeque(batch_size=1000))
+
+    result = benchmark.pedantic(run, rounds=5)
+    peak_memory(run)
+
+    assert len(result) == N // 1000
+
+
+def test_bench_url_generator(benchmark, peak_memory):
+    benchmark.group = "stages"
+    run = lambda: _pump(
+        stages.UrlGenerator(
+            "https://example.com/{id}", lambda fv: {"id": str(fv.value), "page": "1"}
+        )
+    )
+
+    result = benchmark(run)
+    peak_memory(run)
+
+    assert result[0].value == "https://example.com/0?page=1"
+
+
+def test_bench_rate_limit(benchmark, peak_memory):
+    # the limiter's own overhead, at a rate that's never reached
+    benchmark.group = "stages"
+    run = lambda: _pump(stages.RateLimit(max_per_sec=10 ** 9, burst=N))
+
+    result = benchmark(run)
+    peak_memory(run)
+
+    assert len(result) == N
+
+
+@pytest.mark.parametrize("mode", ["fused", "unfused", "chunked"])
+def test_bench_queue_overhead(benchmark, peak_memory, mode):
+    # 10 stages that do nothing, so all that's measured is moving values
+    benchmark.group = "queue-overhead"
+    kwargs = {
+        "fused": {"fuse": True},
+        "unfused": {"fuse": False},
+        "chunked": {"fuse": False, "chunk_size": 256},
+    }[mode]
+    run = lambda: _pump(
+        *[stages.Passthrough(lambda fv: None) for _ in range(10)], **kwargs
+    )
+
+    result = benchmark(run)
+    peak_memory(run)
+
+    assert len(result) == N
+
+
+@pytest.mark.noisy
+@pytest.mark.parametrize(
+    "latency_ms,error_rate", [(0, 0.0), (5, 0.0), (5, 0.05)], ids=str
+)
+def test_bench_request(benchmark, peak_memory, http_server, latency_ms, error_rate):
+    benchmark.group = "request"
+    urls = item_urls(http_server, 500, latency_ms=latency_ms, error_rate=error_rate)
+    run = lambda: _pump(
+        stages.Request(
+            decode_func=lambda resp: resp.json(),
+            backoff_base_sec=0.001,
+            retry_budget=None,
+        ),
+        values=urls,
+    )
+
+    result = benchmark.pedantic(run, rounds=3)
+    peak_memory(run)
+
+    assert len(result) == 500
+
+
+@pytest.mark.noisy
+def test_bench_request_stream(benchmark, peak_memory, http_server):
+    benchmark.group = "request"
+    run = lambda: _pump(
+        stages.Request(stream=StreamFormat.NDJSON),
+        values=[f"{http_server}/records?n={N * 10}"],
+    )
+
+    result = benchmark.pedantic(run, rounds=3)
+    peak_memory(run)
+
+    assert len(result) == N * 10
+
+
+@pytest.mark.noisy
+def test_bench_scenario_api(benchmark, peak_memory, http_server):
+    # end-to-end: generate urls, stay under a rate limit, call a slow and
+    # somewhat flaky API, then aggregate the results
+    benchmark.group = "scenarios"
+    run = lambda: _pump(
+        stages.UrlGenerator(
+            f"{http_server}/items/{{id}}",
+            lambda fv: {"id": str(fv.value), "latency_ms": "2", "error_rate": "0.02"},
+        ),
+        stages.RateLimit(max_per_sec=2000, burst=100),
+        stages.Request(
+            decode_func=lambda resp: resp.json(),
+            backoff_base_sec=0.001,
+            retry_budget=None,
+        ),
+        stages.Transform(lambda fv: fv.value["id"]),
+        stages.CollectList(),
+        values=range(300),
+    )
+
+    result = benchmark.pedantic(run, rounds=3)
+    peak_memory(run)
+
+    assert sorted(result[0].value) == list(range(300))
@@ -0,0 +1,213 @@
+import asyncio
+
+import pytest
+
+from micropipe.stages.base import BaseStage
+from micropipe.types import EndFlow, FlowValue
+
+
+class _SlowEcho(BaseStage[int, int]):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.running = 0
+        self.peak = 0
+
+    async def _task_handler(self, flow_val: FlowValue[int]) -> bool:
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        await self._output(flow_val.value, flow_val.meta)
+
+        return True
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight():
+    stage = _SlowEcho(max_in_flight=3)
+
+    input_queue = asyncio.Queue()
+    for i in range(20):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert stage.peak == 3
+    assert stage._output_queue.qsize() == 21
+
+
+@pytest.mark.asyncio
+async def test_max_queue_size_applies_backpressure():
+    stage = _SlowEcho(max_queue_size=2)
+
+    input_queue = asyncio.Queue()
+    for i in range(10):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    flow = asyncio.create_task(stage.flow(input_queue.get))
+    await asyncio.sleep(0.05)
+
+    # nobody is consuming, so the stage can't get ahead of its output queue
+    assert stage._output_queue.qsize() == 2
+    assert not flow.done()
+
+    received = []
+    while True:
+        fv = await stage._output_queue.get()
+        if isinstance(fv, EndFlow):
+            break
+        received.append(fv.value)
+
+    await flow
+    assert sorted(received) == list(range(10))
+
+
+def test_negative_limits():
+    with pytest.raises(ValueError):
+        _ = _SlowEcho(max_in_flight=-1)
+    with pytest.raises(ValueError):
+        _ = _SlowEcho(max_queue_size=-1)
+
+
+class _Flaky(BaseStage[int, int]):
+    async def _task_handler(self, flow_val: FlowValue[int]) -> bool:
+        if flow_val.value % 4 == 0:
+            raise RuntimeError("boom")
+        await self._output(flow_val.value, flow_val.meta)
+
+        return flow_val.value % 4 != 1
+
+
+@pytest.mark.asyncio
+async def test_flow_counts_and_reaps_tasks():
+    stage = _Flaky()
+
+    input_queue = asyncio.Queue()
+    for i in range(100):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert stage._succeeded == 50
+    assert stage._failed == 50
+    assert stage._output_queue.qsize() == 76
+    assert len([t for t in asyncio.all_tasks() if not t.done()]) == 1
+
+
+@pytest.mark.asyncio
+async def test_chunked_output():
+    stage = _SlowEcho(chunk_size=4, chunk_linger_sec=0.0)
+
+    input_queue = asyncio.Queue()
+    # chunks and single values can be mixed on the input side
+    input_queue.put_nowait([FlowValue(i) for i in range(5)])
+    for i in range(5, 10):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    chunks = []
+    while not stage._output_queue.empty():
+        chunks.append(stage._output_queue.get_nowait())
+
+    assert [len(c) for c in chunks[:-1]] == [4, 4, 2]
+    assert sorted(fv.value for c in chunks[:-1] for fv in c) == list(range(10))
+    assert chunks[-1] == EndFlow()
+    assert stage._succeeded == 10
+
+
+@pytest.mark.asyncio
+async def test_chunked_output_linger():
+    stage = _SlowEcho(chunk_size=100, chunk_linger_sec=0.01)
+
+    input_queue = asyncio.Queue()
+    input_queue.put_nowait(FlowValue(1))
+
+    flow = asyncio.create_task(stage.flow(input_queue.get))
+
+    # the partial chunk is sent once the linger time passes
+    chunk = await asyncio.wait_for(stage._output_queue.get(), timeout=1.0)
+    assert chunk == [FlowValue(1)]
+
+    input_queue.put_nowait(EndFlow())
+    await flow
+
+
+class _Jittery(BaseStage[int, int]):
+    # later values finish first, and every value is emitted twice
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.held_back_peak = 0
+
+    async def _task_handler(self, flow_val: FlowValue[int]) -> bool:
+        await self._output(flow_val.value)
+        await asyncio.sleep(0.001 * (flow_val.value % 7))
+        await self._output(flow_val.value)
+        self.held_back_peak = max(self.held_back_peak, len(self._BaseStage__reorder))
+
+        return True
+
+    @property
+    def _concurrent_chunks(self) -> bool:
+        return True
+
+
+def _drain(stage):
+    values = []
+    while not stage._output_queue.empty():
+        item = stage._output_queue.get_nowait()
+        if isinstance(item, list):
+            values.extend(fv.value for fv in item)
+        elif not isinstance(item, EndFlow):
+            values.append(item.value)
+
+    return values
+
+
+@pytest.mark.asyncio
+async def test_ordered():
+    stage = _Jittery(ordered=True, max_in_flight=8)
+
+    input_queue = asyncio.Queue()
+    for i in range(50):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert _drain(stage) == [i for i in range(50) for _ in range(2)]
+    # values that overtook a slower one are held back within the window
+    assert 0 < stage.held_back_peak <= 8
+
+
+@pytest.mark.asyncio
+async def test_ordered_chunks():
+    stage = _Jittery(ordered=True, chunk_size=4, chunk_linger_sec=0.0)
+
+    input_queue = asyncio.Queue()
+    for i in range(0, 40, 8):
+        input_queue.put_nowait([FlowValue(j) for j in range(i, i + 8)])
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert _drain(stage) == [i for i in range(40) for _ in range(2)]
+
+
+@pytest.mark.asyncio
+async def test_ordered_window_applies_backpressure():
+    stage = _Jittery(ordered=True, max_in_flight=0, reorder_window=3)
+
+    input_queue = asyncio.Queue()
+    for i in range(20):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert _drain(stage) == [i for i in range(20) for _ in range(2)]
+    assert stage.held_back_peak <= 3
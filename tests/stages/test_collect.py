@@ -1,10 +1,13 @@
 import asyncio
+import gc
+import os
 
 import diskcache
 import pytest
 
+from micropipe import Pipeline
 from micropipe.stages import CollectDeque, CollectList
-from micropipe.types import EndFlow, FlowValue
+from micropipe.types import Compression, EndFlow, FlowValue, Serializer
 
 
 @pytest.mark.asyncio
@@ -85,3 +88,139 @@ async def test_collect_deque_batch_size():
     assert len(val.value) == 5
     assert val.value.peek() == 9
     assert val.value.peekleft() == 5
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "serializer,compression",
+    [
+        (Serializer.PICKLE, Compression.NONE),
+        (Serializer.JSON, Compression.ZLIB),
+    ],
+)
+async def test_collect_deque_serializer(serializer, compression):
+    input_queue = asyncio.Queue()
+
+    for i in range(25):
+        input_queue.put_nowait(FlowValue({"id": i}))
+    input_queue.put_nowait(EndFlow())
+
+    stage = CollectDeque(
+        batch_size=10,
+        serializer=serializer,
+        compression=compression,
+        write_batch_size=4,
+    )
+    await stage.flow(input_queue.get)
+
+    batches = [stage._output_queue.get_nowait().value for _ in range(3)]
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [v["id"] for batch in batches for v in batch] == list(range(25))
+    assert batches[2].peekleft() == {"id": 20}
+
+
+@pytest.mark.asyncio
+async def test_collect_deque_cache_directory(tmp_path):
+    async def collect():
+        input_queue = asyncio.Queue()
+        for i in range(10):
+            input_queue.put_nowait(FlowValue(i))
+        input_queue.put_nowait(EndFlow())
+
+        stage = CollectDeque(batch_size=5, cache_directory=str(tmp_path))
+        await stage.flow(input_queue.get)
+        return [stage._output_queue.get_nowait().value for _ in range(2)]
+
+    # every batch gets its own directory, reused (and replaced) by a later run
+    first, second = await collect()
+    assert list(first) == [0, 1, 2, 3, 4]
+    assert list(second) == [5, 6, 7, 8, 9]
+    assert sorted(os.listdir(tmp_path)) == ["batch-00000", "batch-00001"]
+
+    first, second = await collect()
+    assert list(first) == [0, 1, 2, 3, 4]
+    assert list(second) == [5, 6, 7, 8, 9]
+
+
+@pytest.mark.asyncio
+async def test_collect_deque_cleanup():
+    input_queue = asyncio.Queue()
+    input_queue.put_nowait(FlowValue(1))
+    input_queue.put_nowait(EndFlow())
+
+    stage = CollectDeque()
+    await stage.flow(input_queue.get)
+
+    batch = stage._output_queue.get_nowait().value
+    directory = batch.directory
+    assert os.path.isdir(directory)
+
+    # a temporary directory is removed along with its deque
+    del batch
+    gc.collect()
+    assert not os.path.exists(directory)
+
+
+def test_collect_deque_missing_serializer():
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        with pytest.raises(ImportError):
+            _ = CollectDeque(serializer=Serializer.MSGPACK)
+
+
+@pytest.mark.asyncio
+async def test_collect_list_max_wait():
+    input_queue = asyncio.Queue()
+
+    async def produce():
+        for i in range(3):
+            await input_queue.put(FlowValue(i))
+        await asyncio.sleep(0.2)
+        for i in range(3, 5):
+            await input_queue.put(FlowValue(i))
+        await input_queue.put(EndFlow())
+
+    stage = CollectList(batch_size=100, max_wait_sec=0.05)
+    producer = asyncio.create_task(produce())
+    start = asyncio.get_running_loop().time()
+    await stage.flow(input_queue.get)
+    await producer
+
+    # the first batch lingered, the second was emitted at the end of the flow
+    assert stage._output_queue.qsize() == 3
+    assert stage._output_queue.get_nowait() == FlowValue([0, 1, 2])
+    assert stage._output_queue.get_nowait() == FlowValue([3, 4])
+    assert asyncio.get_running_loop().time() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_collect_list_max_bytes():
+    input_queue = asyncio.Queue()
+
+    for value in ("abc", "de", "fghij", "k", "lm", "nop"):
+        input_queue.put_nowait(FlowValue(value))
+    input_queue.put_nowait(EndFlow())
+
+    stage = CollectList(max_bytes=5, sizer=len)
+    await stage.flow(input_queue.get)
+
+    assert stage._output_queue.get_nowait() == FlowValue(["abc", "de"])
+    assert stage._output_queue.get_nowait() == FlowValue(["fghij"])
+    assert stage._output_queue.get_nowait() == FlowValue(["k", "lm", "nop"])
+    assert stage._output_queue.get_nowait() == EndFlow()
+
+
+def test_collect_list_sync_max_bytes():
+    pipeline = Pipeline(CollectList(batch_size=3, max_bytes=4, sizer=len), quiet=True)
+
+    result = pipeline.pump(["ab", "cd", "e", "f", "g", "h"], engine="sync")
+
+    assert [fv.value for fv in result] == [["ab", "cd"], ["e", "f", "g"], ["h"]]
+
+
+def test_collect_arguments():
+    with pytest.raises(ValueError):
+        _ = CollectList(max_wait_sec=0.0)
+    with pytest.raises(ValueError):
+        _ = CollectList(max_bytes=0)
@@ -19,3 +19,18 @@ async def test_filter():
     assert stage._output_queue.qsize() == 6
     assert stage._output_queue.get_nowait().value == 0
     assert stage._output_queue.get_nowait().value == 2
+
+
+@pytest.mark.asyncio
+async def test_filter_executor():
+    stage = Filter(should_keep=lambda x: x.value % 2 == 0, executor="thread")
+    input_queue = asyncio.Queue()
+
+    for i in range(10):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+    assert stage._output_queue.qsize() == 6
+    values = [stage._output_queue.get_nowait().value for _ in range(5)]
+    assert sorted(values) == [0, 2, 4, 6, 8]
@@ -2,6 +2,7 @@ import asyncio
 
 import pytest
 
+from micropipe import Pipeline
 from micropipe.stages import Flatten
 from micropipe.types import EndFlow, FlowValue
 
@@ -21,3 +22,14 @@ async def test_flatten():
     assert stage._output_queue.qsize() == 11
     assert stage._output_queue.get_nowait().value == 0
     assert stage._output_queue.get_nowait().value == 1
+
+
+@pytest.mark.parametrize("engine", ["async", "sync"])
+def test_flatten_not_iterable(engine):
+    pipeline = Pipeline(Flatten(), quiet=True)
+
+    result = pipeline.pump([[1, 2], 3, [4]], engine)
+
+    # the same on both engines, the value that can't be flattened fails
+    assert [fv.value for fv in result] == [1, 2, 4]
+    assert pipeline.stages[0]._failed == 1
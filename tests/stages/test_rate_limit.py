@@ -3,7 +3,9 @@ import time
 
 import pytest
 
+from micropipe.adaptive import AdaptiveLimit
 from micropipe.stages import RateLimit
+from micropipe.stages.rate_limit import url_host
 from micropipe.types import EndFlow, FlowValue
 
 
@@ -48,3 +50,102 @@ async def test_rate_limit():
 def test_rate_limit_not_zero():
     with pytest.raises(ValueError):
         _ = RateLimit(max_per_sec=0)
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_exempt():
+    input_queue = asyncio.Queue()
+    stage = RateLimit(max_per_sec=1, exempt=lambda fv: fv.value % 2 == 1)
+
+    for i in range(6):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    start = time.monotonic()
+    await stage.flow(input_queue.get)
+
+    # only the 3 even values use up the rate (and the last one's slot)
+    assert time.monotonic() - start < 4
+    assert stage._output_queue.qsize() == 7
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_burst_and_rate():
+    input_queue = asyncio.Queue()
+    stage = RateLimit(max_per_sec=100, burst=10)
+
+    for i in range(60):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    start = time.monotonic()
+    await stage.flow(input_queue.get)
+    duration = time.monotonic() - start
+
+    # 10 values burst through, the other 50 take exactly 0.5 sec at 100 / sec
+    assert 0.49 <= duration < 0.6
+    assert stage._output_queue.qsize() == 61
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_per_key():
+    input_queue = asyncio.Queue()
+    stage = RateLimit(max_per_sec=10, key=url_host)
+
+    for i in range(4):
+        for host in ("a", "b", "c"):
+            input_queue.put_nowait(FlowValue(f"http://{host}.example.com/{i}"))
+    input_queue.put_nowait(EndFlow())
+
+    start = time.monotonic()
+    await stage.flow(input_queue.get)
+    duration = time.monotonic() - start
+
+    # each host has its own bucket, so all 3 are released side by side
+    assert 0.39 <= duration < 0.5
+    assert stage._output_queue.qsize() == 13
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_single_loop():
+    input_queue = asyncio.Queue()
+    stage = RateLimit(max_per_sec=100)
+
+    for i in range(20):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    # values wait for their token in the stage's loop, not in a task each
+    tasks = len(asyncio.all_tasks())
+    flow = asyncio.ensure_future(stage.flow(input_queue.get))
+    await asyncio.sleep(0.05)
+    assert len(asyncio.all_tasks()) == tasks + 1
+    assert 0 < stage._output_queue.qsize() < 20
+
+    await flow
+    assert stage._output_queue.qsize() == 21
+
+
+def test_rate_limit_concurrency_limit():
+    assert RateLimit(max_per_sec=1, concurrency_limit=3)._output_queue.maxsize == 3
+    # 0 means no limit of its own, so a pipeline's default applies
+    assert RateLimit(max_per_sec=1)._max_queue_size is None
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_adaptive():
+    adaptive = AdaptiveLimit(min_per_sec=1, max_per_sec=100, initial_per_sec=100)
+    stage = RateLimit(max_per_sec=adaptive)
+
+    input_queue = asyncio.Queue()
+    for i in range(3):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    # the server pushed back, down to 50 / sec
+    adaptive.on_throttle()
+
+    start = time.monotonic()
+    await stage.flow(input_queue.get)
+
+    assert 0.039 <= time.monotonic() - start < 0.1
@@ -1,11 +1,17 @@
 import asyncio
+import json
 
 import aiohttp
 import pytest
-from aioresponses import aioresponses
+from aioresponses import CallbackResult, aioresponses
+from yarl import URL
 
-from micropipe.stages import Request
-from micropipe.types import EndFlow, FlowValue
+from micropipe import Pipeline
+from micropipe.adaptive import AdaptiveLimit
+from micropipe.http import HttpClient, ResponseCache
+from micropipe.stages import Request, Transform
+from micropipe.stages.request import _retry_after
+from micropipe.types import EndFlow, FlowValue, StreamFormat
 
 
 @pytest.mark.asyncio
@@ -28,3 +34,271 @@ async def test_request():
         assert stage._output_queue.get_nowait() == EndFlow()
 
     await session.close()
+
+
+class _CountingClient(HttpClient):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sessions = 0
+
+    def _new_session(self):
+        self.sessions += 1
+        return super()._new_session()
+
+
+def test_request_shared_http_client():
+    client = _CountingClient(limit=10, limit_per_host=2)
+    pipeline = Pipeline(
+        Request(decode_func=lambda resp: resp.json()),
+        Transform(lambda fv: fv.value["next"]),
+        Request(decode_func=lambda resp: resp.json()),
+        http_client=client,
+    )
+
+    with aioresponses() as m:
+        m.get(
+            "http://test.example.com/a", payload={"next": "http://test.example.com/b"}
+        )
+        m.get("http://test.example.com/b", payload={"id": 2})
+
+        result = pipeline.pump(["http://test.example.com/a"])
+
+    assert result == [FlowValue({"id": 2})]
+    # both stages used the same session, which was closed at the end
+    assert client.sessions == 1
+    assert client.closed
+
+
+@pytest.mark.asyncio
+async def test_request_own_http_client():
+    stage = Request(decode_func=lambda resp: resp.json())
+
+    input_queue = asyncio.Queue()
+    input_queue.put_nowait(FlowValue("http://test.example.com"))
+    input_queue.put_nowait(EndFlow())
+
+    with aioresponses() as m:
+        m.get("http://test.example.com", payload={"id": 1})
+
+        await stage.flow(input_queue.get)
+        assert stage._output_queue.get_nowait() == FlowValue({"id": 1})
+
+
+async def _run(stage, urls):
+    input_queue = asyncio.Queue()
+    for url in urls:
+        input_queue.put_nowait(FlowValue(url))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+
+def _calls(m, url):
+    return len(m.requests.get(("GET", URL(url)), []))
+
+
+@pytest.mark.asyncio
+async def test_request_no_retry_on_404():
+    stage = Request(decode_func=lambda resp: resp.json(), backoff_base_sec=0.001)
+
+    with aioresponses() as m:
+        m.get("http://test.example.com", status=404, repeat=True)
+
+        await _run(stage, ["http://test.example.com"])
+
+        assert _calls(m, "http://test.example.com") == 1
+        assert stage._failed == 1
+
+
+@pytest.mark.asyncio
+async def test_request_retries_transient_errors():
+    stage = Request(decode_func=lambda resp: resp.json(), backoff_base_sec=0.001)
+
+    with aioresponses() as m:
+        m.get("http://test.example.com", status=500)
+        m.get("http://test.example.com", status=503, headers={"Retry-After": "0"})
+        m.get("http://test.example.com", payload={"id": 1})
+
+        await _run(stage, ["http://test.example.com"])
+
+        assert _calls(m, "http://test.example.com") == 3
+        assert stage._output_queue.get_nowait() == FlowValue({"id": 1})
+
+
+@pytest.mark.asyncio
+async def test_request_retry_budget():
+    stage = Request(
+        decode_func=lambda resp: resp.json(),
+        backoff_base_sec=0.001,
+        retry_budget=0.0,
+    )
+    urls = [f"http://test.example.com/{i}" for i in range(20)]
+
+    with aioresponses() as m:
+        for url in urls:
+            m.get(url, status=500, repeat=True)
+
+        await _run(stage, urls)
+
+        # without any budget, only the minimum number of retries are made
+        assert sum(_calls(m, url) for url in urls) == 20 + 10
+        assert stage._failed == 20
+
+
+def test_retry_after():
+    assert _retry_after({"Retry-After": "3"}) == 3.0
+    assert _retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0.0
+    assert _retry_after({"Retry-After": "soon"}) is None
+    assert _retry_after({}) is None
+
+
+@pytest.mark.asyncio
+async def test_request_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_sec=60)
+    url = "http://test.example.com"
+
+    with aioresponses() as m:
+        m.get(url, payload={"id": 1}, headers={"ETag": '"v1"'}, repeat=True)
+
+        first = Request(decode_func=lambda resp: resp.json(), cache=cache)
+        await _run(first, [url])
+        second = Request(decode_func=lambda resp: resp.json(), cache=cache)
+        await _run(second, [url])
+
+        # the second stage never touched the network
+        assert _calls(m, url) == 1
+        assert first._output_queue.get_nowait() == FlowValue({"id": 1})
+        assert second._output_queue.get_nowait() == FlowValue({"id": 1})
+        assert cache.is_fresh(url)
+
+
+@pytest.mark.asyncio
+async def test_request_cache_revalidation(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_sec=0)
+    url = "http://test.example.com"
+
+    with aioresponses() as m:
+        m.get(url, payload={"id": 1}, headers={"ETag": '"v1"'})
+        m.get(url, status=304)
+
+        await _run(Request(decode_func=lambda resp: resp.json(), cache=cache), [url])
+        assert not cache.is_fresh(url)
+
+        stage = Request(decode_func=lambda resp: resp.json(), cache=cache)
+        await _run(stage, [url])
+
+        requests = m.requests[("GET", URL(url))]
+        assert requests[1].kwargs["headers"] == {"If-None-Match": '"v1"'}
+        # a 304 is answered from the cache
+        assert stage._output_queue.get_nowait() == FlowValue({"id": 1})
+
+
+@pytest.mark.asyncio
+async def test_request_coalesce():
+    stage = Request(decode_func=lambda resp: resp.json(), coalesce=True)
+    url = "http://test.example.com"
+
+    input_queue = asyncio.Queue()
+    for i in range(5):
+        input_queue.put_nowait(FlowValue(url, {"i": i}))
+    input_queue.put_nowait(EndFlow())
+
+    async def slow_response(url, **kwargs):
+        await asyncio.sleep(0.01)
+        return CallbackResult(payload={"id": 1})
+
+    with aioresponses() as m:
+        m.get(url, callback=slow_response, repeat=True)
+
+        await stage.flow(input_queue.get)
+
+        assert _calls(m, url) == 1
+
+    outputs = [stage._output_queue.get_nowait() for _ in range(5)]
+    assert sorted(fv.meta["i"] for fv in outputs) == list(range(5))
+    assert all(fv.value == {"id": 1} for fv in outputs)
+
+
+@pytest.mark.asyncio
+async def test_request_coalesce_recent_window():
+    # one at a time, so only the recent window can catch the duplicates
+    stage = Request(
+        decode_func=lambda resp: resp.json(),
+        coalesce=True,
+        recent_window=1,
+        max_in_flight=1,
+    )
+    urls = ["http://test.example.com/a"] * 3 + ["http://test.example.com/b"] * 2
+
+    with aioresponses() as m:
+        for url in set(urls):
+            m.get(url, payload={"url": url}, repeat=True)
+
+        await _run(stage, urls)
+
+        assert _calls(m, "http://test.example.com/a") == 1
+        assert _calls(m, "http://test.example.com/b") == 1
+        assert stage._output_queue.qsize() == 6
+
+
+@pytest.mark.asyncio
+async def test_request_adaptive():
+    adaptive = AdaptiveLimit(min_per_sec=1, max_per_sec=100, initial_per_sec=20)
+    stage = Request(
+        decode_func=lambda resp: resp.json(),
+        backoff_base_sec=0.001,
+        adaptive=adaptive,
+    )
+
+    with aioresponses() as m:
+        m.get("http://test.example.com", status=429, headers={"Retry-After": "0"})
+        m.get("http://test.example.com", payload={"id": 1})
+
+        await _run(stage, ["http://test.example.com"])
+
+    # halved on the 429, then grew again on the success
+    assert adaptive.decreases == 1
+    assert adaptive.increases == 1
+    assert 10 < adaptive.rate < 11
+
+
+@pytest.mark.asyncio
+async def test_request_stream():
+    stage = Request(stream=StreamFormat.NDJSON)
+
+    input_queue = asyncio.Queue()
+    input_queue.put_nowait(FlowValue("http://test.example.com", {"page": 1}))
+    input_queue.put_nowait(EndFlow())
+
+    with aioresponses() as m:
+        m.get("http://test.example.com", body='{"id": 1}\n{"id": 2}\n')
+
+        await stage.flow(input_queue.get)
+
+    # one value per record, each with the url's meta
+    assert stage._output_queue.qsize() == 3
+    assert stage._output_queue.get_nowait() == FlowValue({"id": 1}, {"page": 1})
+    assert stage._output_queue.get_nowait() == FlowValue({"id": 2}, {"page": 1})
+
+
+def test_request_stream_pipeline():
+    pipeline = Pipeline(
+        Request(stream=StreamFormat.JSON_ARRAY),
+        Transform(lambda fv: fv.value["id"]),
+    )
+
+    with aioresponses() as m:
+        m.get("http://test.example.com", body=json.dumps([{"id": i} for i in range(5)]))
+
+        result = pipeline.pump(["http://test.example.com"])
+
+    assert [fv.value for fv in result] == list(range(5))
+
+
+def test_request_stream_arguments():
+    with pytest.raises(ValueError):
+        _ = Request()
+    with pytest.raises(ValueError):
+        _ = Request(decode_func=lambda resp: resp.json(), stream=StreamFormat.NDJSON)
+    with pytest.raises(ValueError):
+        _ = Request(stream=StreamFormat.NDJSON, coalesce=True)
@@ -22,3 +22,47 @@ async def test_transform():
 
     for i in range(10):
         assert stage._output_queue.get_nowait().value == transformer(FlowValue(i))
+
+
+def square(flow_val: FlowValue[int]) -> int:
+    return flow_val.value ** 2 + flow_val.meta.get("offset", 0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("executor", ["thread", "process"])
+async def test_transform_executor(executor):
+    stage = Transform[int, int](square, executor=executor, max_workers=2)
+
+    input_queue = asyncio.Queue()
+    for i in range(10):
+        input_queue.put_nowait(FlowValue(i, {"offset": 1}))
+    input_queue.put_nowait([FlowValue(i) for i in range(10, 20)])
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert stage._output_queue.qsize() == 21
+    outputs = [stage._output_queue.get_nowait() for _ in range(20)]
+    assert sorted(fv.value for fv in outputs) == sorted(
+        [i ** 2 + 1 for i in range(10)] + [i ** 2 for i in range(10, 20)]
+    )
+    assert stage._succeeded == 20
+
+
+@pytest.mark.asyncio
+async def test_transform_executor_errors():
+    def invert(flow_val: FlowValue[int]) -> float:
+        return 1 / flow_val.value
+
+    stage = Transform[int, float](invert, executor="thread")
+
+    input_queue = asyncio.Queue()
+    for i in range(5):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    # only the value that raised is lost
+    assert stage._output_queue.qsize() == 5
+    assert stage._failed == 1
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from micropipe import Pipeline
+from micropipe.stages import Flatten, VectorFilter, VectorTransform
+from micropipe.types import EndFlow, FlowValue, VectorOutput
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.mark.asyncio
+async def test_vector_transform():
+    stage = VectorTransform(lambda a: a ** 2, size=4)
+
+    input_queue = asyncio.Queue()
+    for i in range(10):
+        input_queue.put_nowait(FlowValue(i, {"i": i}))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert stage._output_queue.qsize() == 11
+    for i in range(10):
+        fv = stage._output_queue.get_nowait()
+        # per element output keeps each value's meta
+        assert fv == FlowValue(i ** 2, {"i": i})
+        assert type(fv.value) is int
+    assert stage._output_queue.get_nowait() == EndFlow()
+
+
+@pytest.mark.asyncio
+async def test_vector_filter_arrays():
+    stage = VectorFilter(lambda a: a % 2 == 0, size=5, output=VectorOutput.ARRAYS)
+
+    input_queue = asyncio.Queue()
+    input_queue.put_nowait([FlowValue(i) for i in range(10)])
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert stage._output_queue.qsize() == 3
+    arrays = [stage._output_queue.get_nowait() for _ in range(3)]
+    assert arrays[0].value.tolist() == [0, 2, 4]
+    assert arrays[1].value.tolist() == [6, 8]
+    assert arrays[2] == EndFlow()
+
+    # array chunks can be flattened again
+    flatten_queue = asyncio.Queue()
+    for item in arrays:
+        flatten_queue.put_nowait(item)
+
+    flatten = Flatten()
+    await flatten.flow(flatten_queue.get)
+
+    assert flatten._output_queue.qsize() == 6
+    flattened = [flatten._output_queue.get_nowait() for _ in range(5)]
+    assert [fv.value for fv in flattened] == [0, 2, 4, 6, 8]
+    assert flatten._output_queue.get_nowait() == EndFlow()
+
+
+@pytest.mark.parametrize("engine", ["async", "sync"])
+def test_vector_transform_reduce(engine):
+    pipeline = Pipeline(
+        VectorTransform(np.sum, size=4, output=VectorOutput.ARRAYS), quiet=True
+    )
+
+    result = pipeline.pump(range(8), engine)
+
+    assert [fv.value.tolist() for fv in result] == [[6], [22]]
+    metrics = pipeline.metrics[0]
+    assert metrics["received"] == 8
+    assert metrics["emitted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_vector_arrays_meta():
+    stage = VectorTransform(lambda a: a, size=4, output=VectorOutput.ARRAYS)
+
+    input_queue = asyncio.Queue()
+    for i in range(4):
+        input_queue.put_nowait(FlowValue(i, {f"k{i % 2}": i}))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    assert stage._output_queue.get_nowait().meta == {"k0": 2, "k1": 3}
+
+
+@pytest.mark.asyncio
+async def test_vector_transform_errors():
+    stage = VectorTransform(lambda a: a[:1], size=3)
+
+    input_queue = asyncio.Queue()
+    for i in range(3):
+        input_queue.put_nowait(FlowValue(i))
+    input_queue.put_nowait(EndFlow())
+
+    await stage.flow(input_queue.get)
+
+    # a per element output must keep the array's length
+    assert stage._output_queue.qsize() == 1
+    assert stage._failed == 3
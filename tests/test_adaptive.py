@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from micropipe.adaptive import AdaptiveLimit
+
+
+def test_adaptive_limit_bounds():
+    with pytest.raises(ValueError):
+        _ = AdaptiveLimit(min_per_sec=10, max_per_sec=1)
+    with pytest.raises(ValueError):
+        _ = AdaptiveLimit(min_per_sec=1, max_per_sec=10, decrease_factor=1.0)
+
+    limit = AdaptiveLimit(min_per_sec=1, max_per_sec=2, increase_per_sec=10)
+    assert limit.rate == 1
+    assert limit.concurrency == 0
+
+    for _ in range(10):
+        limit.on_success(0.1)
+    assert limit.rate == 2
+
+    limit = AdaptiveLimit(min_per_sec=1, max_per_sec=2, cooldown_sec=0)
+    for _ in range(10):
+        limit.on_throttle()
+    assert limit.rate == 1
+
+
+def test_adaptive_limit_aimd():
+    limit = AdaptiveLimit(min_per_sec=1, max_per_sec=100, initial_per_sec=10)
+
+    # ~`rate` healthy responses (about a second's worth) add `increase_per_sec`
+    for _ in range(10):
+        limit.on_success(0.1)
+    assert 10.9 < limit.rate < 11
+
+    limit.on_throttle()
+    assert 5.4 < limit.rate < 5.5
+    # within the cooldown, later throttled responses don't back off again
+    limit.on_throttle()
+    assert 5.4 < limit.rate < 5.5
+    assert limit.decreases == 1
+
+
+def test_adaptive_limit_latency_target():
+    limit = AdaptiveLimit(
+        min_per_sec=1, max_per_sec=100, initial_per_sec=10, latency_target_sec=0.5
+    )
+
+    limit.on_success(0.1)
+    assert limit.rate > 10
+    limit.on_success(1.0)
+    assert limit.rate < 10
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limit_concurrency():
+    limit = AdaptiveLimit(
+        min_per_sec=1, max_per_sec=100, min_concurrency=1, max_concurrency=4
+    )
+    assert limit.concurrency == 1
+
+    await limit.acquire()
+    waiter = asyncio.create_task(limit.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    # 1 healthy response doubles the concurrency, so the waiter gets a slot
+    limit.on_success(0.1)
+    assert limit.concurrency == 2
+    await asyncio.wait_for(waiter, 1)
+
+    limit.release()
+    limit.release()
@@ -1,9 +1,14 @@
 import math
+import subprocess  # nosec
+import sys
+
+import pytest
 
 from micropipe import Pipeline, stages
+from micropipe.types import VectorOutput
 
 
-def basic_example(lim: int = 10_000):
+def basic_example(lim: int = 10_000, engine: str = "async", **kwargs):
     pipeline = Pipeline(
         stages.Transform(lambda fv: fv.value ** 2),
         stages.Filter(lambda fv: fv.value % 2 == 0),
@@ -12,9 +17,10 @@ def basic_example(lim: int = 10_000):
         stages.Transform(lambda fv: math.asin(fv.value)),
         stages.CollectList(),
         stages.Transform(lambda fv: sum(fv.value)),
+        **kwargs,
     )
 
-    result = pipeline.pump(range(lim))
+    result = pipeline.pump(range(lim), engine=engine)
 
     return result
 
@@ -27,3 +33,80 @@ def test_execution_speed(benchmark):
     assert result[0].value == sum(
         [math.asin(math.sin(i ** 2) ** 2) for i in range(lim) if i % 2 == 0]
     )
+
+
+def test_execution_speed_chunked(benchmark):
+    lim = 10_000
+    result = benchmark(basic_example, lim=lim, chunk_size=256)
+
+    assert len(result) == 1
+    assert result[0].value == sum(
+        [math.asin(math.sin(i ** 2) ** 2) for i in range(lim) if i % 2 == 0]
+    )
+
+
+def test_execution_speed_sync(benchmark):
+    lim = 10_000
+    result = benchmark(basic_example, lim=lim, engine="sync")
+
+    assert len(result) == 1
+    assert result[0].value == sum(
+        [math.asin(math.sin(i ** 2) ** 2) for i in range(lim) if i % 2 == 0]
+    )
+
+
+def vector_example(lim: int = 10_000):
+    np = pytest.importorskip("numpy")
+
+    pipeline = Pipeline(
+        stages.VectorTransform(lambda a: a ** 2, dtype=np.float64),
+        stages.VectorFilter(lambda a: a % 2 == 0),
+        stages.VectorTransform(np.sin),
+        stages.VectorTransform(lambda a: a ** 2),
+        stages.VectorTransform(np.arcsin, output=VectorOutput.ARRAYS),
+        stages.CollectList(),
+        stages.Transform(lambda fv: sum(a.sum() for a in fv.value)),
+    )
+
+    return pipeline.pump(range(lim))
+
+
+def test_execution_speed_vector(benchmark):
+    lim = 10_000
+    result = benchmark(vector_example, lim=lim)
+
+    assert len(result) == 1
+    assert result[0].value == pytest.approx(
+        sum([math.asin(math.sin(i ** 2) ** 2) for i in range(lim) if i % 2 == 0])
+    )
+
+
+# modules a pure-CPU pipeline shouldn't have to import
+HEAVY_MODULES = ("aiohttp", "coloredlogs", "diskcache", "numpy", "tqdm")
+
+IMPORT_SCRIPT = f"""
+import sys
+from micropipe import Pipeline, stages
+Pipeline(stages.Transform(lambda fv: fv.value), quiet=True).pump(range(10))
+print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+
+def _run_import_script() -> str:
+    out = subprocess.run(  # nosec
+        [sys.executable, "-c", IMPORT_SCRIPT], check=True, capture_output=True
+    )
+    return out.stdout.decode().strip()
+
+
+def test_import_speed(benchmark):
+    loaded = benchmark(_run_import_script)
+
+    assert loaded == ""
+
+
+def test_execution_speed_quiet(benchmark):
+    lim = 10_000
+    result = benchmark(basic_example, lim=lim, quiet=True)
+
+    assert len(result) == 1
@@ -0,0 +1,171 @@
+import pytest
+
+from micropipe import Pipeline, stages
+from micropipe.checkpoint import CheckpointStore, Lineage, merge_origins
+
+
+def _pipeline(path, *stage_list, **kwargs):
+    return Pipeline(*stage_list, checkpoint=CheckpointStore(path), **kwargs)
+
+
+def test_merge_origins():
+    assert merge_origins([]) is None
+    assert merge_origins(["1", None, "1"]) == "1"
+    assert merge_origins(["1", ("2", "1"), "3"]) == ("1", "2", "3")
+
+
+def test_lineage():
+    completed = []
+    lineage = Lineage(lambda key, ok: completed.append((key, ok)))
+
+    lineage.retain("a")
+    lineage.retain(("a", "b"))
+    lineage.release("a")
+    assert completed == []
+    lineage.release(("a", "b"), failed=True)
+    assert completed == [("a", False), ("b", False)]
+    assert len(lineage) == 0
+
+    lineage.retain("a")
+    lineage.release("a")
+    assert completed[-1] == ("a", True)
+
+
+@pytest.mark.parametrize("chunk_size", [0, 16])
+def test_checkpoint_skips_completed(tmp_path, chunk_size):
+    path = str(tmp_path / "run.sqlite")
+    fail = {7, 42}
+
+    def double(fv):
+        if fv.value in fail:
+            raise ValueError("boom")
+        return fv.value * 2
+
+    stage_list = (stages.Transform(double), stages.Filter(lambda fv: True))
+    result = _pipeline(path, *stage_list, chunk_size=chunk_size).pump(range(100))
+    assert len(result) == 98
+
+    # only the inputs that failed are run again
+    fail.clear()
+    result = _pipeline(path, *stage_list, chunk_size=chunk_size).pump(range(100))
+    assert sorted(fv.value for fv in result) == [14, 84]
+
+    assert _pipeline(path, *stage_list).pump(range(100)) == []
+
+
+def test_checkpoint_consumer_stops(tmp_path):
+    path = str(tmp_path / "run.sqlite")
+    stage_list = (stages.Transform(lambda fv: fv.value + 1),)
+
+    seen = []
+    for fv in _pipeline(path, *stage_list).stream_sync(range(50)):
+        seen.append(fv.value)
+        if len(seen) == 10:
+            break
+
+    rest = [fv.value for fv in _pipeline(path, *stage_list).pump(range(50))]
+    # at-least-once, everything not consumed before is emitted again
+    assert set(seen) | set(rest) == set(range(1, 51))
+    assert len(rest) <= 41
+
+
+def test_checkpoint_stage_replays(tmp_path):
+    path = str(tmp_path / "run.sqlite")
+    fetched = []
+    crash = [True]
+
+    def fetch(fv):
+        fetched.append(fv.value)
+        return [fv.value] * 2
+
+    def store(fv):
+        if crash[0]:
+            raise ValueError("crashed")
+        return fv.value
+
+    def pipeline():
+        return _pipeline(
+            path,
+            stages.Transform(fetch),
+            stages.Checkpoint("fetched"),
+            stages.Flatten(),
+            stages.Transform(store),
+        )
+
+    assert pipeline().pump(range(20)) == []
+    assert sorted(fetched) == list(range(20))
+
+    # the values that passed the checkpoint are replayed, not fetched again
+    crash[0] = False
+    fetched.clear()
+    result = pipeline().pump(range(20))
+    assert fetched == []
+    assert sorted(fv.value for fv in result) == sorted(list(range(20)) * 2)
+
+    assert pipeline().pump(range(20)) == []
+
+
+def test_checkpoint_collect(tmp_path):
+    path = str(tmp_path / "run.sqlite")
+    crash = [True]
+
+    def total(fv):
+        if crash[0] and 5 in fv.value:
+            raise ValueError("crashed")
+        return sum(fv.value)
+
+    def pipeline():
+        return _pipeline(
+            path,
+            stages.CollectList(batch_size=3),
+            stages.Transform(total),
+        )
+
+    result = pipeline().pump(range(9))
+    assert sorted(fv.value for fv in result) == [3, 21]
+
+    # the batch holding 5 failed, so its values are collected again
+    crash[0] = False
+    assert [fv.value for fv in pipeline().pump(range(9))] == [12]
+
+
+def test_checkpoint_key(tmp_path):
+    path = str(tmp_path / "run.sqlite")
+    stage_list = (stages.Transform(lambda fv: fv.value),)
+
+    def pipeline():
+        checkpoint = CheckpointStore(path, key=lambda value: value)
+        return Pipeline(*stage_list, checkpoint=checkpoint)
+
+    assert len(pipeline().pump(["a", "b"])) == 2
+    # keyed by value, so the inputs' order doesn't matter
+    assert [fv.value for fv in pipeline().pump(["c", "b", "a"])] == ["c"]
+
+
+def test_checkpoint_arguments(tmp_path):
+    path = str(tmp_path / "run.sqlite")
+    with pytest.raises(ValueError):
+        _ = CheckpointStore(path, batch_size=0)
+    with pytest.raises(ValueError):
+        _ = Pipeline(stages.Checkpoint("a"), stages.Checkpoint("a"))
+
+    pipeline = _pipeline(path, stages.Transform(lambda fv: fv.value))
+    with pytest.raises(ValueError):
+        pipeline.pump(range(10), engine="sync")
+
+
+def test_checkpoint_store_replay_pages(tmp_path):
+    store = CheckpointStore(str(tmp_path / "run.sqlite"))
+    store.open(["fetched"])
+    for i in range(5):
+        store.record("fetched", str(i % 2), i, None)
+        store.record("fetched", ("0", "1"), -i, {"i": i})
+    store.flush()
+
+    assert store.replay_counts("fetched") == {"0": 8, "1": 7}
+    # read back in order, a page at a time
+    replayed = list(store.replay("fetched", page_size=3))
+    assert [value for _, value, _ in replayed] == [v for i in range(5) for v in (i, -i)]
+    assert replayed[1] == (("0", "1"), 0, {"i": 0})
+    assert list(store.replay("other", page_size=3)) == []
+    store.close()
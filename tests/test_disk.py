@@ -0,0 +1,42 @@
+import pickle
+
+import pytest
+
+from micropipe.disk import DiskDeque, codec
+from micropipe.types import Compression, Serializer
+
+
+@pytest.mark.parametrize("serializer", [Serializer.PICKLE, Serializer.JSON])
+@pytest.mark.parametrize("compression", [Compression.NONE, Compression.ZLIB])
+def test_codec(serializer, compression):
+    dumps, loads = codec(serializer, compression)
+    value = {"a": [1, 2.5, "three", None]}
+
+    assert isinstance(dumps(value), bytes)
+    assert loads(dumps(value)) == value
+
+
+def test_disk_deque(tmp_path):
+    deque = DiskDeque(str(tmp_path), Serializer.JSON, Compression.ZLIB)
+
+    deque.extend([])
+    deque.extend(range(5))
+    deque.appendleft(-1)
+    deque.extend(["x" * 2 ** 16, 6])  # a value large enough to go in a file
+
+    assert len(deque) == 8
+    assert list(deque) == [-1, 0, 1, 2, 3, 4, "x" * 2 ** 16, 6]
+    assert deque.peek() == 6
+    assert deque[1] == 0
+
+    # the codec is read back from the directory
+    unpickled = pickle.loads(pickle.dumps(deque))
+    assert isinstance(unpickled, DiskDeque)
+    assert list(unpickled) == list(deque)
+
+
+def test_disk_deque_maxlen(tmp_path):
+    deque = DiskDeque(str(tmp_path), maxlen=3)
+    deque.extend(range(5))
+
+    assert list(deque) == [2, 3, 4]
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from micropipe.http import decode_records
+from micropipe.types import StreamFormat
+
+RECORDS = [{"id": 1, "tags": ["a", "b"]}, 123, "x,]", None, [], {"é": 4.5}]
+
+
+async def _chunks(body: bytes, size: int):
+    for i in range(0, len(body), size):
+        yield body[i : i + size]
+
+
+async def _decode(body: bytes, size: int, stream_format: StreamFormat):
+    return [r async for r in decode_records(_chunks(body, size), stream_format)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [1, 2, 7, 1024])
+async def test_decode_records_ndjson(size):
+    body = "\n".join(json.dumps(r) for r in RECORDS).encode() + b"\n\n"
+
+    assert await _decode(body, size, StreamFormat.NDJSON) == RECORDS
+    assert await _decode(body, size, StreamFormat.JSON_LINES) == RECORDS
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [1, 2, 7, 1024])
+async def test_decode_records_json_array(size):
+    body = json.dumps(RECORDS, indent=2, ensure_ascii=False).encode()
+
+    assert await _decode(body, size, StreamFormat.JSON_ARRAY) == RECORDS
+    assert await _decode(b" [ ] ", size, StreamFormat.JSON_ARRAY) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body", [b"{}", b"[1, 2", b"[1 2]", b"[1] 2", b"[1,]"])
+async def test_decode_records_json_array_invalid(body):
+    with pytest.raises(ValueError):
+        await _decode(body, 1, StreamFormat.JSON_ARRAY)
+
+
+class _CountingDecoder(json.JSONDecoder):
+    calls = 0
+
+    def raw_decode(self, s, idx=0):
+        self.calls += 1
+        return super().raw_decode(s, idx)
+
+
+@pytest.mark.asyncio
+async def test_decode_records_large_record(monkeypatch):
+    decoder = _CountingDecoder()
+    monkeypatch.setattr("micropipe.http._DECODER", decoder)
+    record = {"values": list(range(5000))}
+    array = json.dumps([record, 1]).encode()
+    lines = (json.dumps(record) + "\n" + json.dumps(record)).encode()
+
+    assert await _decode(array, 7, StreamFormat.JSON_ARRAY) == [record, 1]
+    # the record is decoded a few times as it grows, not once per chunk
+    assert decoder.calls < 40
+    assert await _decode(lines, 7, StreamFormat.NDJSON) == [record, record]
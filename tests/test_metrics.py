@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+
+from micropipe import Pipeline, stages
+from micropipe.metrics import Histogram, MetricsServer, to_prometheus, write_metrics
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(bounds=(1.0, 2.0, 4.0))
+    assert histogram.quantile(0.5) == 0.0
+
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.record(value)
+
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.count == 4
+    assert histogram.sum == 6.5
+    assert 1.0 <= histogram.quantile(0.5) <= 2.0
+    assert histogram.quantile(0.99) <= 3.0
+
+
+class _Sleepy(stages.Transform):
+    def __init__(self):
+        super().__init__(lambda fv: fv.value)
+
+    @property
+    def _fusible(self):
+        return False
+
+    async def _task_handler(self, flow_val):
+        await asyncio.sleep(0.001)
+        return await super()._task_handler(flow_val)
+
+
+def test_pipeline_metrics():
+    pipeline = Pipeline(
+        _Sleepy(),
+        stages.Filter(lambda fv: fv.value[0] % 2 == 0),
+        stages.Flatten(),
+    )
+
+    _ = pipeline.pump([[i] for i in range(100)], engine="async")
+
+    sleepy, filter_stage, flatten = pipeline.metrics
+    assert sleepy["index"] == 0
+    assert sleepy["received"] == sleepy["emitted"] == sleepy["succeeded"] == 100
+    assert sleepy["in_flight"] == 0
+    assert sleepy["latency"]["count"] == 100
+    assert 0.001 <= sleepy["latency"]["p50_sec"] <= sleepy["latency"]["p99_sec"]
+    assert sleepy["throughput_per_sec"] > 0
+    assert filter_stage["received"] == 100
+    assert filter_stage["emitted"] == 50
+    assert flatten["received"] == flatten["emitted"] == 50
+
+
+def test_sync_engine_metrics():
+    def counts(engine):
+        pipeline = Pipeline(
+            stages.Transform(lambda fv: [fv.value] * (fv.value % 3)),
+            stages.Flatten(),
+            stages.Filter(lambda fv: fv.value % 2 == 0),
+            stages.CollectList(batch_size=7),
+            quiet=True,
+        )
+        _ = pipeline.pump(range(100), engine=engine)
+        keys = ("received", "emitted", "succeeded", "failed")
+        return [{k: m[k] for k in keys} for m in pipeline.metrics]
+
+    sync = counts("sync")
+    assert sync == counts("async")
+    assert [m["emitted"] for m in sync] == [100, 99, 50, 8]
+
+
+def test_pipeline_metrics_export(tmp_path):
+    path = str(tmp_path / "metrics.json")
+    pipeline = Pipeline(_Sleepy(), metrics_file=path, metrics_interval_sec=0.01)
+
+    _ = pipeline.pump(range(20))
+
+    with open(path) as f:
+        exported = json.load(f)
+    assert exported["stages"][0]["emitted"] == 20
+
+    write_metrics(pipeline, str(tmp_path / "metrics.prom"))
+    with open(tmp_path / "metrics.prom") as f:
+        text = f.read()
+    assert 'micropipe_stage_emitted_total{stage="_Sleepy",index="0"} 20' in text
+    assert (
+        'micropipe_stage_latency_seconds_bucket{stage="_Sleepy",index="0",le="+Inf"} 20'
+        in text
+    )
+
+
+def test_prometheus_escapes_labels():
+    snapshot = Pipeline(stages.Transform(lambda fv: fv.value)).metrics[0]
+    snapshot["stage"] = 'a "b"\\'
+
+    assert 'stage="a \\"b\\"\\\\"' in to_prometheus([snapshot])
+
+
+@pytest.mark.asyncio
+async def test_metrics_server(unused_tcp_port):
+    pipeline = Pipeline(stages.Transform(lambda fv: fv.value))
+    _ = await pipeline.pump_async(range(5))
+
+    async with MetricsServer(pipeline, port=unused_tcp_port):
+        async with aiohttp.ClientSession() as session:
+            url = f"http://127.0.0.1:{unused_tcp_port}"
+            async with session.get(f"{url}/metrics") as resp:
+                assert "micropipe_stage_received_total" in await resp.text()
+            async with session.get(f"{url}/metrics.json") as resp:
+                assert (await resp.json())["stages"][0]["received"] == 5
@@ -1,8 +1,208 @@
+import asyncio
+import time
+
 import pytest
 
-from micropipe import Pipeline
+from micropipe import Pipeline, stages
+from micropipe.stages.fused import Fused
+from micropipe.types import CopyMode, FlowValue
 
 
 def test_pipeline_no_stages():
     with pytest.raises(ValueError):
         _ = Pipeline()
+
+
+def test_pipeline_default_limits():
+    explicit = stages.Transform(lambda fv: fv.value, max_queue_size=0)
+    implicit = stages.Transform(lambda fv: fv.value)
+
+    _ = Pipeline(explicit, implicit, max_in_flight=4, max_queue_size=8)
+
+    assert explicit._output_queue.maxsize == 0
+    assert implicit._output_queue.maxsize == 8
+    assert implicit._max_in_flight == 4
+
+
+def test_pipeline_bounded_queues():
+    pipeline = Pipeline(
+        stages.Transform(lambda fv: fv.value * 2),
+        stages.Filter(lambda fv: fv.value % 3 == 0),
+        max_in_flight=2,
+        max_queue_size=2,
+    )
+
+    result = pipeline.pump(range(100), engine="async")
+
+    assert sorted(fv.value for fv in result) == [
+        i * 2 for i in range(100) if i % 3 == 0
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_stream():
+    async def slow_source():
+        for i in range(5):
+            yield i
+            await asyncio.sleep(0.01)
+
+    pipeline = Pipeline(stages.Transform(lambda fv: fv.value + 1))
+
+    received = []
+    async for fv in pipeline.stream(slow_source()):
+        received.append(fv.value)
+        if len(received) == 1:
+            # results arrive before the source is exhausted
+            assert not pipeline.tasks[0].done()
+
+    assert sorted(received) == [1, 2, 3, 4, 5]
+
+
+def test_pipeline_stream_sync():
+    pipeline = Pipeline(stages.Transform(lambda fv: fv.value * 3))
+
+    stream = pipeline.stream_sync(range(10))
+    first = next(stream)
+    rest = list(stream)
+
+    assert sorted(fv.value for fv in [first, *rest]) == [i * 3 for i in range(10)]
+
+
+def test_pipeline_stream_sync_early_exit():
+    pipeline = Pipeline(stages.Transform(lambda fv: fv.value), max_queue_size=1)
+
+    for fv in pipeline.stream_sync(range(1_000)):
+        break
+
+    assert all(task.done() for task in pipeline.tasks)
+
+
+def test_pipeline_chunked():
+    pipeline = Pipeline(
+        stages.Transform(lambda fv: fv.value + 1),
+        stages.Filter(lambda fv: fv.value % 2 == 0),
+        stages.CollectList(),
+        chunk_size=16,
+    )
+
+    result = pipeline.pump(range(1_000), engine="async")
+
+    assert len(result) == 1
+    assert sorted(result[0].value) == [i + 1 for i in range(1_000) if i % 2 == 1]
+
+
+def test_pipeline_fuse():
+    def build(fuse: bool):
+        return Pipeline(
+            stages.Transform(
+                lambda fv: fv.value * 2,
+                meta_func=lambda v, m: {**m, "double": v},
+            ),
+            stages.Filter(lambda fv: fv.value % 3 == 0),
+            stages.UrlGenerator("http://test/{id}", lambda fv: {"id": str(fv.value)}),
+            stages.Passthrough(lambda fv: None, copy_mode=CopyMode.DEEP),
+            stages.Transform(lambda fv: fv.value.upper()),
+            stages.Passthrough(lambda fv: None),
+            fuse=fuse,
+        )
+
+    fused = build(fuse=True)
+    assert [type(s) for s in fused.flow_stages] == [Fused, stages.Passthrough, Fused]
+
+    unfused = build(fuse=False)
+    assert unfused.flow_stages == unfused.stages
+
+    def key(fv):
+        return fv.value
+
+    expected = sorted(unfused.pump(range(30), engine="async"), key=key)
+    result = sorted(fused.pump(range(30), engine="async"), key=key)
+
+    assert result == expected
+    assert FlowValue("HTTP://TEST/6", {"double": 6}) in result
+
+
+@pytest.mark.parametrize("fuse", [True, False])
+def test_pipeline_sync_engine(fuse):
+    def build():
+        return Pipeline(
+            stages.Transform(lambda fv: [fv.value] * (fv.value % 3)),
+            stages.Flatten(meta_func=lambda v, m: {"flat": v}),
+            stages.Filter(lambda fv: fv.value != 4),
+            stages.Transform(lambda fv: 10 // (fv.value - 7)),
+            stages.CollectList(batch_size=5),
+            stages.Transform(lambda fv: sorted(fv.value)),
+            fuse=fuse,
+        )
+
+    sync_result = build().pump(range(20), engine="sync")
+    async_result = build().pump(range(20), engine="async")
+
+    def flatten(result):
+        return sorted(v for fv in result for v in fv.value)
+
+    # same values (the async engine gives no ordering guarantees) and
+    # the value that raised is dropped by both
+    assert flatten(sync_result) == flatten(async_result)
+    assert len(flatten(sync_result)) == 17
+    assert [len(fv.value) for fv in sync_result] == [5, 5, 5, 2]
+
+
+def test_pipeline_engine_selection():
+    pipeline = Pipeline(stages.Transform(lambda fv: fv.value))
+
+    with pytest.raises(ValueError):
+        pipeline.pump(range(3), engine="threads")
+
+    async def source():
+        yield 1
+
+    with pytest.raises(ValueError):
+        pipeline.pump(source(), engine="sync")
+
+    # async iterables fall back to the async engine
+    assert pipeline.pump(source()) == [FlowValue(1)]
+
+    rate_limited = Pipeline(stages.RateLimit(max_per_sec=100))
+    with pytest.raises(ValueError):
+        rate_limited.pump(range(3), engine="sync")
+
+
+def _jitter(fv):
+    time.sleep(0.0001 * (fv.value % 5))
+    return fv.value * 2
+
+
+@pytest.mark.parametrize("chunk_size", [0, 16])
+def test_pipeline_ordered(chunk_size):
+    pipeline = Pipeline(
+        # values finish out of order in the thread pool
+        stages.Transform(_jitter, executor="thread", max_workers=4),
+        stages.Filter(lambda fv: fv.value % 3 != 0),
+        chunk_size=chunk_size,
+        ordered=True,
+        fuse=False,
+    )
+
+    result = pipeline.pump(range(500), engine="async")
+
+    assert [fv.value for fv in result] == [i * 2 for i in range(500) if i % 3 != 0]
+    assert all(stage._ordered for stage in pipeline.flow_stages)
+
+
+def test_pipeline_quiet():
+    pipeline = Pipeline(
+        stages.Transform(lambda fv: fv.value),
+        stages.Filter(lambda fv: True),
+        quiet=True,
+    )
+
+    assert all(stage._progress is False for stage in pipeline.stages)
+    assert all(stage._progress is False for stage in pipeline.flow_stages)
+    assert len(pipeline.pump(range(10), engine="async")) == 10
+
+
+def test_stages_lazy_attributes():
+    assert stages.Request.__name__ == "Request"
+    with pytest.raises(AttributeError):
+        _ = stages.DoesNotExist
@@ -0,0 +1,138 @@
+import asyncio
+import os
+from functools import partial
+
+import pytest
+
+from micropipe import Pipeline, stages
+from micropipe.queues import Chunker, SpillQueue
+from micropipe.types import END_FLOW, FlowValue
+
+
+async def _drain(queue):
+    values = []
+    while True:
+        value = await queue.get()
+        if value is END_FLOW:
+            return values
+        elif isinstance(value, list):
+            values.extend(fv.value for fv in value)
+        else:
+            values.append(value.value)
+
+
+@pytest.mark.asyncio
+async def test_spill_queue_order(tmp_path):
+    queue = SpillQueue(memory_items=3, directory=str(tmp_path))
+
+    for i in range(5):
+        await queue.put(FlowValue(i))
+    assert queue.spilled == 2
+    assert len(os.listdir(tmp_path)) == 1
+
+    # once spilling, values go to disk until it's drained
+    assert (await queue.get()).value == 0
+    await queue.put(FlowValue(5))
+    assert queue.spilled == 3
+    assert queue.qsize() == 5
+
+    await queue.put(END_FLOW)
+    assert queue.spilled == 4
+    assert await _drain(queue) == [1, 2, 3, 4, 5]
+    # the spill directory is removed once the flow ended
+    assert os.listdir(tmp_path) == []
+
+    await queue.put(FlowValue(6))
+    assert queue.spilled == 4
+
+
+@pytest.mark.asyncio
+async def test_spill_queue_bytes():
+    queue = SpillQueue(memory_bytes=10, sizer=len)
+    chunker = Chunker(queue, 2, 0.0)
+
+    for value in ("abcd", "ef", "ghijk", "l", "mn"):
+        await chunker.put(FlowValue(value))
+    await chunker.flush()
+    await queue.put(END_FLOW)
+
+    # the second chunk would take 12 bytes, so it and the rest are spilled
+    assert queue.spilled == 3
+    assert await _drain(queue) == ["abcd", "ef", "ghijk", "l", "mn"]
+
+
+def test_spill_queue_arguments():
+    with pytest.raises(ValueError):
+        _ = SpillQueue(memory_items=0)
+    with pytest.raises(ValueError):
+        _ = SpillQueue(memory_bytes=-1)
+
+    # a bound that would block before anything spills is ignored
+    assert SpillQueue(1000, memory_items=1000).maxsize == 0
+    assert SpillQueue(2000, memory_items=1000).maxsize == 2000
+
+
+@pytest.mark.parametrize("chunk_size", [0, 16])
+def test_pipeline_spill_queue(chunk_size):
+    factory = partial(SpillQueue, memory_items=8)
+    pipeline = Pipeline(
+        stages.Filter(lambda fv: fv.value % 3 != 0),
+        stages.Transform(lambda fv: [fv.value] * 2),
+        stages.Flatten(),
+        chunk_size=chunk_size,
+        queue_factory=factory,
+    )
+
+    assert isinstance(pipeline.input_queue, SpillQueue)
+    assert all(isinstance(s._output_queue, SpillQueue) for s in pipeline.flow_stages)
+
+    # all these stages are sync capable, only the async engine uses queues
+    result = pipeline.pump(range(200), engine="async")
+    queues = [pipeline.input_queue] + [s._output_queue for s in pipeline.flow_stages]
+    assert any(queue.spilled > 0 for queue in queues)
+    expected = [i for i in range(200) if i % 3 != 0 for _ in range(2)]
+    assert sorted(fv.value for fv in result) == expected
+
+
+@pytest.mark.asyncio
+async def test_chunker_linger_before_flush():
+    queue = asyncio.Queue(1)
+    chunker = Chunker(queue, 100, 0.01)
+    await queue.put([FlowValue(0)])
+    await chunker.put(FlowValue(1))
+    # the linger timer fires, its chunk waits for room in the queue
+    await asyncio.sleep(0.05)
+
+    # room is made, but the waiting chunk hasn't been put yet
+    _ = queue.get_nowait()
+    consumer = asyncio.ensure_future(_drain(queue))
+    await chunker.flush()
+    await queue.put(END_FLOW)
+
+    assert await consumer == [1]
+
+
+class _SlowEcho(stages.Transform):
+    def __init__(self, **kwargs):
+        super().__init__(lambda fv: fv.value, **kwargs)
+
+    @property
+    def _fusible(self):
+        return False
+
+    async def _task_handler(self, flow_val):
+        await asyncio.sleep(0.001)
+        return await super()._task_handler(flow_val)
+
+
+def test_pipeline_chunk_linger_slow_consumer():
+    pipeline = Pipeline(
+        stages.Transform(lambda fv: fv.value, chunk_size=64, chunk_linger_sec=0.0005),
+        _SlowEcho(max_in_flight=1),
+        max_queue_size=1,
+        quiet=True,
+    )
+
+    result = pipeline.pump(range(200))
+
+    assert sorted(fv.value for fv in result) == list(range(200))
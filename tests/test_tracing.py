@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import pytest
+
+from micropipe import Pipeline, stages
+from micropipe.tracing import Tracer
+
+
+class _Slow(stages.Transform):
+    def __init__(self, delay, **kwargs):
+        super().__init__(lambda fv: fv.value, **kwargs)
+        self.delay = delay
+
+    @property
+    def name(self):
+        return f"Slow({self.delay})"
+
+    @property
+    def _fusible(self):
+        return False
+
+    async def _task_handler(self, flow_val):
+        await asyncio.sleep(self.delay)
+        return await super()._task_handler(flow_val)
+
+
+def test_tracer_sample_rate():
+    assert Tracer(sample_rate=1.0).sample_every == 1
+    assert Tracer(sample_rate=0.01).sample_every == 100
+    with pytest.raises(ValueError):
+        _ = Tracer(sample_rate=0.0)
+
+
+def test_pipeline_trace(tmp_path):
+    path = str(tmp_path / "trace.json")
+    tracer = Tracer(path=path, sample_rate=0.5)
+    pipeline = Pipeline(
+        _Slow(0.0),
+        _Slow(0.002, max_in_flight=2),
+        _Slow(0.0),
+        max_queue_size=4,
+        tracer=tracer,
+    )
+
+    result = pipeline.pump(range(100))
+
+    assert len(result) == 100
+    summary = tracer.summary(pipeline.flow_stages)
+    assert summary["critical_stage"] == "Slow(0.002)"
+    first, slow, last = summary["stages"]
+    # the first stage waits for room downstream, the last one for values
+    assert first["blocked"] > 0.5
+    assert last["starved"] > 0.5
+
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    names = {e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert names == {"Slow(0.0)", "Slow(0.002)"}
+    handled = [e for e in events if e["ph"] == "b" and e["name"] == "handle"]
+    assert 3 * 50 - 3 <= len(handled) <= 3 * 50
+
+
+def test_tracer_max_spans():
+    tracer = Tracer(sample_rate=1.0, max_spans=10)
+    pipeline = Pipeline(_Slow(0.0), tracer=tracer)
+
+    _ = pipeline.pump(range(20))
+
+    assert len(tracer.spans) == 10
+    assert tracer.dropped > 0
+
+
+def test_pipeline_trace_sync_capable(tmp_path):
+    path = str(tmp_path / "trace.json")
+    tracer = Tracer(path=path, sample_rate=1.0)
+    pipeline = Pipeline(
+        stages.Transform(lambda fv: fv.value * 2),
+        stages.Filter(lambda fv: fv.value % 3 == 0),
+        tracer=tracer,
+        quiet=True,
+    )
+
+    result = pipeline.pump(range(100))
+
+    assert [fv.value for fv in result] == [i * 2 for i in range(100) if i % 3 == 0]
+    assert len(tracer.spans) > 0
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    assert any(e["ph"] == "b" and e["name"] == "handle" for e in events)
+    with pytest.raises(ValueError):
+        _ = pipeline.pump(range(10), engine="sync")
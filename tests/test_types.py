@@ -0,0 +1,36 @@
+import pickle
+from copy import deepcopy
+
+import pytest
+
+from micropipe.types import END_FLOW, EndFlow, FlowValue
+
+
+def test_flow_value_slots():
+    fv = FlowValue(1)
+
+    with pytest.raises(AttributeError):
+        fv.extra = True  # type: ignore
+
+
+def test_flow_value_lazy_meta():
+    fv = FlowValue(1)
+    assert fv._meta is None
+    assert fv == FlowValue(1, {})
+
+    fv.meta["key"] = "value"
+    assert fv.meta == {"key": "value"}
+    assert fv != FlowValue(1)
+
+
+def test_flow_value_copies():
+    fv = FlowValue({"a": [1]}, {"b": 2})
+
+    assert pickle.loads(pickle.dumps(fv)) == fv
+    assert deepcopy(fv) == fv
+    assert deepcopy(fv).value is not fv.value
+
+
+def test_end_flow_singleton():
+    assert EndFlow() is END_FLOW
+    assert pickle.loads(pickle.dumps(END_FLOW)) is END_FLOW